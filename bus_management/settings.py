@@ -72,11 +72,13 @@ SITE_ID = 1
 AUTH_USER_MODEL = 'core.CustomUser'
 
 MIDDLEWARE = [
+    "core.metrics.RequestMetricsMiddleware", # Off unless REQUEST_METRICS['ENABLED']; outermost so it times everything
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.tenancy.CurrentSchoolMiddleware", # Scopes Bus/Route/Student/CustomUser.objects to the user's school, API users included
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -129,6 +131,7 @@ DATABASES = {
 # Add this to your REST_FRAMEWORK settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'core.authentication.DeviceTokenAuthentication', # Driver devices: Authorization: Device <token>
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
@@ -138,12 +141,122 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema'
 }
 
+# Location ingest (see core/ingest.py)
+LOCATION_INGEST = {
+    'WRITE_BEHIND': os.getenv('LOCATION_WRITE_BEHIND', '0') == '1', # Acknowledge fixes from memory, write in bulk
+    'FLUSH_SIZE': 500, # Flush after this many queued fixes...
+    'FLUSH_INTERVAL_MS': 1000, # ...or after this long, whichever comes first
+    'SPOOL_DIR': os.getenv('LOCATION_SPOOL_DIR'), # Append-only spool of raw fixes for replay, None to disable
+    'SPOOL_SEGMENT_MB': 256, # Start a new spool segment file after this size
+    'MAX_BATCH': 1000, # Most fixes accepted by one post_locations request
+    'RECENT_SEQ_WINDOW': 1024, # Recent fix sequence numbers remembered per device token (per bus without one) to drop retries
+}
+
+# Live bus positions for nearest/within queries (see core/spatial.py)
+SPATIAL_INDEX = {
+    'CELL_DEG': 0.01, # Grid cell size in degrees (~1.1 km)
+    'REFRESH_SECONDS': 5, # How often each worker picks up positions written by other workers
+}
+
+# Per-view timing/SQL metrics for /metrics/ (see core/metrics.py)
+REQUEST_METRICS = {
+    'ENABLED': os.getenv('REQUEST_METRICS', '0') == '1', # Add the middleware's work to requests at all
+    'SAMPLE_RATE': float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', '0.1')), # Share of requests measured
+    'TOKEN': os.getenv('METRICS_TOKEN'), # Bearer token for the Prometheus scraper; staff sessions also work
+}
+
+# Per-bus daily stats (see core/rollups.py)
+ROLLUPS = {
+    'INCREMENTAL': True, # Update BusDailyStats as fixes are written; `manage.py rollup_daily_stats` rebuilds
+    'ON_TIME_GRACE_MINUTES': 5, # A trip ending this long after its route's end_time still counts as on time
+}
+
+# `manage.py analyze_history` (see core/analytics.py; needs numpy)
+HISTORY_ANALYTICS = {
+    'CHUNK_SIZE': 50000, # Fixes read and converted to arrays at a time
+    'OFF_ROUTE_M': 150, # Fixes further from their route are left out of segment speeds
+    'STOP_RADIUS_M': 50, # Fixes this close to a route stop count as dwell
+    'MAX_GAP_SECONDS': 300, # A longer gap between fixes at a stop starts a new visit
+    'CONGESTION_KMH': 10, # Moving fixes slower than this count as congested
+    'MIN_SAMPLES': 5, # Segment/stop hours with fewer fixes or visits are not reported
+    'HOTSPOT_CELL_DEG': 0.002, # Hotspot grid cell size (~220 m)
+    'HOTSPOT_MIN_FIXES': 20, # Cells with fewer fixes in an hour are not ranked
+    'HOTSPOT_LIMIT': 200, # Most hotspot rows per report
+}
+
+# Ingest rate/latency tracking for /metrics/ and ingest_status (see core/ingest_metrics.py)
+INGEST_METRICS = {
+    'WINDOW_SECONDS': 60, # Fix rates and latency quantiles cover this many recent seconds
+    'STALE_SECONDS': 120, # An active bus with no position for longer counts as stale
+    'LATENCY_SAMPLES': 2048, # Most recent latency samples kept for the quantiles
+}
+
+# On-demand sampling profiler, per worker (see core/profiler.py)
+PROFILER = {
+    'SIGNAL': os.getenv('PROFILER_SIGNAL', 'SIGUSR2'), # kill -USR2 <worker pid> profiles that worker; '' to disable
+    'DEFAULT_SECONDS': 30, # Length of a signalled profile, and of POST /profile/ without ?seconds
+    'MAX_SECONDS': 300, # Longest profile POST /profile/ accepts
+    'INTERVAL_MS': 10, # Time between stack samples (100 Hz)
+    'DIR': 'profiles', # Collapsed-stack files go here, under MEDIA_ROOT
+}
+
+# Location history archives: `manage.py export_locations` / `import_locations`, GET /api/location-history/export/
+HISTORY_ARCHIVE = {
+    'CHUNK_SIZE': 5000, # Fixes fetched per database round trip when exporting
+    'BATCH_SIZE': 5000, # Archive rows checked against stored history and inserted at a time when importing
+    'ROWS_PER_WRITE': 2000, # Fixes encoded per chunk of the export stream
+    'GZIP_LEVEL': 6, # zlib level for gzipped exports (1 fastest .. 9 smallest)
+}
+
+# Admin "Bulk import" / "Stream CSV" and `manage.py bulk_import` (see core/bulk_import.py)
+BULK_IMPORT = {
+    'BATCH_SIZE': 1000, # Rows per bulk_create/bulk_update transaction; progress is saved after each
+    'MAX_ERRORS': 50, # Invalid rows listed on a failed job
+    'EXPORT_CHUNK_SIZE': 2000, # Rows fetched and written per chunk of a streamed export
+}
+
+# Permissions each CustomUser.role grants, on top of the user's own and group permissions
+# (see core/permissions.py). `*` matches any part of a codename.
+AUTHENTICATION_BACKENDS = [
+    'django.contrib.auth.backends.ModelBackend',
+    'core.permissions.RolePermissionBackend',
+]
+ROLE_PERMISSIONS = {
+    'superuser': ['core.*'],
+    # School administrators manage their school's rows; fleet-wide data (history reports, other
+    # schools' rows) is for superusers
+    'admin': [
+        # Every permission of the models the admin scopes to the user's school (core/tenancy.py)
+        'core.*_customuser', 'core.*_bus', 'core.*_route', 'core.*_student', 'core.*_concern', 'core.*_notification',
+        'core.can_assign_driver', 'core.can_update_maintenance_status', 'core.can_assign_bus_to_route',
+        'core.can_assign_student_to_route', 'core.can_view_student_details', 'core.can_view_all_concerns',
+        'core.can_manage_concerns', 'core.can_send_notification', 'core.can_view_notifications',
+        # Read-only, also scoped
+        'core.view_buslocation', 'core.can_view_bus_location', 'core.view_devicetoken', 'core.view_busdailystats',
+        'core.view_bulkimportjob',
+    ],
+    'staff': [
+        'core.view_customuser', 'core.view_bus', 'core.view_route', 'core.view_student', 'core.view_concern',
+        'core.view_notification', 'core.view_buslocation', 'core.view_busdailystats',
+    ], # Read-only, school-scoped models only
+    'driver': ['core.can_submit_bus_location', 'core.can_update_maintenance_status'],
+    'parent': [], # Parents use the app and the API, not the admin
+}
+
+# How long a verified device token stays cached in each worker (see core/authentication.py)
+DEVICE_TOKEN_CACHE_SECONDS = 300
+
 # Swagger settings
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Basic': {
             'type': 'basic'
         },
+        'Device': {
+            'type': 'apiKey',
+            'name': 'Authorization',
+            'in': 'header'
+        },
         'Bearer': {
             'type': 'apiKey',
             'name': 'Authorization',
@@ -202,6 +315,12 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static', # Project-level static files directory
 ]
 
+# Per-page bundles built by `manage.py build_assets` into STATIC_ROOT/bundles (see core/assets.py)
+ASSET_BUNDLES = {
+    'ENABLED': os.getenv('ASSET_BUNDLES', '0' if DEBUG else '1') == '1', # Serve built bundles instead of the source files
+    'SAFELIST': [], # CSS classes (or 'prefix-') that are only added at runtime and must survive trimming
+}
+
 # Media files (User-uploaded content)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media' # Store user-uploaded files here
@@ -287,6 +406,13 @@ CACHES = {
     }
 }
 
+# TTLs (seconds) of the dashboard/tracking {% cache %} fragments, see core/fragments.py
+FRAGMENT_CACHE_TTL = {
+    'schools': 24 * 60 * 60, # School markers, also invalidated when a school changes
+    'stats': 5 * 60, # Stats cards
+    'activity': 30, # Recent concerns/notifications
+}
+
 # Email Settings (Configure for sending emails)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend' # Use console for testing
 # Configure for production:
@@ -5,6 +5,8 @@ from django.urls import path, include, re_path
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from django.conf import settings
+from core.assets import serve_bundle
 
 # Define schema view for drf-yasg
 schema_view = get_schema_view(
@@ -22,6 +24,8 @@ schema_view = get_schema_view(
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Hashed bundles from build_assets, precompressed and cached for a year
+    re_path(rf'^{settings.STATIC_URL.strip("/")}/bundles/(?P<path>.+)$', serve_bundle),
     # Include your app's urls.py which now contains both template views and API views via the router
     path('', include('core.urls', namespace='core')), # Assuming your app is named 'core'
 
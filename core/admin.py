@@ -1,18 +1,116 @@
 # core/admin.py
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.auth.admin import UserAdmin
-from .models import Bus, BusLocation, Concern, CustomUser, Notification, Route, School, Student
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, Max, Sum
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from .models import (
+    Bus, BulkImportJob, BusDailyStats, BusLocation, Concern, CustomUser, DeviceToken, HistoryReport, HistoryReportRow,
+    Notification, Route, School, Student,
+)
+from . import bulk_import
+from .changelists import AutocompleteFilter, EstimatedCountPaginator
+from .permissions import get_permissions
+from .tenancy import current_school_id, school_q
+from .forms import BulkImportForm
 from import_export.admin import ImportExportModelAdmin
 from import_export import resources
 
-class CustomUserResource(resources.ModelResource):
+
+class BulkImportExportMixin:
+    """
+    Adds "Bulk import" (a background BulkImportJob, see core/bulk_import.py)
+    and "Stream CSV" to an ImportExportModelAdmin. The stock Import and Export
+    buttons are still there for small files and other formats.
+    """
+    import_export_change_list_template = 'admin/core/change_list_bulk_import_export.html'
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path('bulk-import/', self.admin_site.admin_view(self.bulk_import_view), name='%s_%s_bulk_import' % info),
+            path('stream-export/', self.admin_site.admin_view(self.stream_export_view), name='%s_%s_stream_export' % info),
+        ] + super().get_urls()
+
+    def bulk_import_view(self, request):
+        if not self.has_import_permission(request):
+            raise PermissionDenied
+        form = BulkImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            job = BulkImportJob.objects.create(
+                model=self.opts.label, file=form.cleaned_data['file'], dry_run=form.cleaned_data['dry_run'],
+                created_by=request.user,
+            )
+            bulk_import.start_job(job)
+            self.message_user(request, f'Import #{job.pk} started. Reload this page to follow its progress.')
+            return redirect('admin:core_bulkimportjob_change', job.pk)
+        meta = self.resource_class._meta
+        context = {
+            **self.admin_site.each_context(request),
+            'title': f'Bulk import {self.opts.verbose_name_plural}',
+            'opts': self.opts,
+            'form': form,
+            'columns': meta.fields,
+            'key': meta.import_id_fields,
+        }
+        return TemplateResponse(request, 'admin/core/bulk_import.html', context)
+
+    def stream_export_view(self, request):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        # Same rows as the changelist with the current filters and search, read with an iterator
+        queryset = self.get_export_queryset(request).select_related(None).prefetch_related(None)
+        response = StreamingHttpResponse(
+            bulk_import.export_chunks(self.resource_class, queryset), content_type='text/csv',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.opts.model_name}-{timezone.localdate()}.csv"'
+        return response
+
+
+class SchoolScopedAdminMixin:
+    """
+    Lists and opens only the rows of the school the request is bound to
+    (core/tenancy.py): through the row's school, its bus's school, or
+    school_field if set.
+    """
+    school_field = None
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        school_id = current_school_id()
+        if school_id is None:
+            return queryset
+        if self.school_field:
+            return queryset.filter(**{self.school_field: school_id})
+        return queryset.filter(school_q(self.model, school_id))
+
+
+class SchoolResourceMixin:
+    """
+    Creates imported rows in the importing user's school. The stock import
+    already finds rows and foreign keys through Model.objects, which is
+    scoped to that school (core/tenancy.py).
+    """
+
+    def init_instance(self, row=None):
+        instance = super().init_instance(row)
+        instance.school_id = current_school_id()
+        return instance
+
+
+class CustomUserResource(SchoolResourceMixin, resources.ModelResource):
     class Meta:
         model = CustomUser
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'role', 'phone_number', 'is_active', 'is_staff', 'is_superuser', 'date_joined')
         import_id_fields = ['username']
 
 @admin.register(CustomUser)
-class CustomUserAdmin(ImportExportModelAdmin, UserAdmin):
+class CustomUserAdmin(SchoolScopedAdminMixin, BulkImportExportMixin, ImportExportModelAdmin, UserAdmin):
     resource_class = CustomUserResource
     list_display = ('username', 'email', 'first_name', 'last_name', 'role', 'phone_number', 'is_staff', 'is_active')
     list_filter = ('role', 'is_staff', 'is_active', 'groups')
@@ -33,18 +131,18 @@ class CustomUserAdmin(ImportExportModelAdmin, UserAdmin):
         if request.user.is_superuser:
             return True
         # Allow access to the Accounts module if the user can view any user
-        return request.user.has_perm('accounts.view_customuser')
+        return get_permissions(request).has('core.view_customuser')
 
     def has_view_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
         # Allow viewing if user has the specific view permission
-        return request.user.has_perm('accounts.view_customuser')
+        return get_permissions(request).has('core.view_customuser')
 
     def has_add_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('accounts.add_customuser')
+        return get_permissions(request).has('core.add_customuser')
 
     def has_change_permission(self, request, obj=None):
         if request.user.is_superuser:
@@ -52,14 +150,14 @@ class CustomUserAdmin(ImportExportModelAdmin, UserAdmin):
         # Users can change their own profile, or if they have change permission
         if obj is not None and obj == request.user:
             return True # Users can always change their own profile
-        return request.user.has_perm('accounts.change_customuser')
+        return get_permissions(request).has('core.change_customuser')
 
     def has_delete_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('accounts.delete_customuser')
+        return get_permissions(request).has('core.delete_customuser')
 
-class BusResource(resources.ModelResource):
+class BusResource(SchoolResourceMixin, resources.ModelResource):
     class Meta:
         model = Bus
         fields = ('id', 'bus_number', 'driver', 'capacity', 'status')
@@ -71,30 +169,33 @@ class SchoolAdmin(admin.ModelAdmin):
     search_fields = ('name', 'address')
 
 @admin.register(Bus)
-class BusAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+class BusAdmin(SchoolScopedAdminMixin, BulkImportExportMixin, ImportExportModelAdmin, admin.ModelAdmin):
     resource_class = BusResource
     list_display = ('bus_number', 'driver', 'capacity', 'status')
     list_filter = ('driver', 'status')
     search_fields = ('bus_number', 'driver__username')
     list_editable = ('status',) # Allow editing status directly in the list view (with permission)
+    ordering = ('bus_number',) # also orders the bus filter's autocomplete on BusLocationAdmin
 
     # Control visibility based on permissions
     def has_module_permission(self, request):
         if request.user.is_superuser:
             return True
         # Allow access to the 'Buses' module in admin if the user has any bus-related permission
-        return request.user.has_perm('buses.view_bus') or \
-                request.user.has_perm('buses.add_bus') or \
-                request.user.has_perm('buses.change_bus') or \
-                request.user.has_perm('buses.delete_bus') or \
-                request.user.has_perm('buses.can_assign_driver') or \
-                request.user.has_perm('buses.can_update_maintenance_status')
+        return get_permissions(request).has_any(
+            'core.view_bus',
+            'core.add_bus',
+            'core.change_bus',
+            'core.delete_bus',
+            'core.can_assign_driver',
+            'core.can_update_maintenance_status',
+        )
 
     def has_view_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
         # Allow viewing if user has the specific view permission
-        if request.user.has_perm('buses.view_bus'):
+        if get_permissions(request).has('core.view_bus'):
             return True
         # Drivers can view their assigned bus
         if request.user.role == 'driver' and obj is not None and obj.driver == request.user:
@@ -104,29 +205,29 @@ class BusAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     def has_add_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('buses.add_bus')
+        return get_permissions(request).has('core.add_bus')
 
     def has_change_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
         # Drivers can only change the status of their assigned bus
         if request.user.role == 'driver' and obj is not None and obj.driver == request.user:
-            return request.user.has_perm('buses.can_update_maintenance_status')
-        return request.user.has_perm('buses.change_bus')
+            return get_permissions(request).has('core.can_update_maintenance_status')
+        return get_permissions(request).has('core.change_bus')
 
     def has_delete_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('buses.delete_bus')
+        return get_permissions(request).has('core.delete_bus')
 
-class RouteResource(resources.ModelResource):
+class RouteResource(SchoolResourceMixin, resources.ModelResource):
     class Meta:
         model = Route
         fields = ('id', 'name', 'bus', 'start_time', 'end_time')
         import_id_fields = ['name']
 
 @admin.register(Route)
-class RouteAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+class RouteAdmin(SchoolScopedAdminMixin, BulkImportExportMixin, ImportExportModelAdmin, admin.ModelAdmin):
     resource_class = RouteResource
     list_display = ('name', 'bus', 'start_time', 'end_time')
     list_filter = ('bus',)
@@ -136,16 +237,18 @@ class RouteAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     def has_module_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('routes.view_route') or \
-                request.user.has_perm('routes.add_route') or \
-                request.user.has_perm('routes.change_route') or \
-                request.user.has_perm('routes.delete_route') or \
-                request.user.has_perm('routes.can_assign_bus_to_route')
+        return get_permissions(request).has_any(
+            'core.view_route',
+            'core.add_route',
+            'core.change_route',
+            'core.delete_route',
+            'core.can_assign_bus_to_route',
+        )
 
     def has_view_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        if request.user.has_perm('routes.view_route'):
+        if get_permissions(request).has('core.view_route'):
             return True
         # Drivers can view their assigned route
         if request.user.role == 'driver' and obj is not None and obj.bus is not None and obj.bus.driver == request.user:
@@ -158,26 +261,26 @@ class RouteAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     def has_add_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('routes.add_route')
+        return get_permissions(request).has('core.add_route')
 
     def has_change_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('routes.change_route')
+        return get_permissions(request).has('core.change_route')
 
     def has_delete_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('routes.delete_route')
+        return get_permissions(request).has('core.delete_route')
 
-class StudentResource(resources.ModelResource):
+class StudentResource(SchoolResourceMixin, resources.ModelResource):
     class Meta:
         model = Student
         fields = ('id', 'first_name', 'last_name', 'parent', 'assigned_route', 'student_id')
         import_id_fields = ['student_id'] # Or a combination of fields
 
 @admin.register(Student)
-class StudentAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+class StudentAdmin(SchoolScopedAdminMixin, BulkImportExportMixin, ImportExportModelAdmin, admin.ModelAdmin):
     resource_class = StudentResource
     list_display = ('first_name', 'last_name', 'parent', 'assigned_route', 'student_id')
     list_filter = ('assigned_route', 'parent')
@@ -187,17 +290,19 @@ class StudentAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     def has_module_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('students.view_student') or \
-                request.user.has_perm('students.add_student') or \
-                request.user.has_perm('students.change_student') or \
-                request.user.has_perm('students.delete_student') or \
-                request.user.has_perm('students.can_assign_student_to_route') or \
-                request.user.has_perm('students.can_view_student_details')
+        return get_permissions(request).has_any(
+            'core.view_student',
+            'core.add_student',
+            'core.change_student',
+            'core.delete_student',
+            'core.can_assign_student_to_route',
+            'core.can_view_student_details',
+        )
 
     def has_view_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        if request.user.has_perm('students.view_student'):
+        if get_permissions(request).has('core.view_student'):
             return True
         # Parents can view their own children's details
         if request.user.role == 'parent' and obj is not None and obj.parent == request.user:
@@ -207,36 +312,50 @@ class StudentAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     def has_add_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('students.add_student')
+        return get_permissions(request).has('core.add_student')
 
     def has_change_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('students.change_student')
+        return get_permissions(request).has('core.change_student')
 
     def has_delete_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('students.delete_student')
+        return get_permissions(request).has('core.delete_student')
 
 @admin.register(BusLocation)
-class BusLocationAdmin(admin.ModelAdmin):
-    list_display = ('bus', 'latitude', 'longitude', 'timestamp')
-    list_filter = ('bus', 'timestamp')
+class BusLocationAdmin(SchoolScopedAdminMixin, admin.ModelAdmin):
+    # Built for tens of millions of rows, see core/changelists.py
+    list_display = ('bus', 'latitude', 'longitude', 'speed', 'timestamp')
+    list_filter = (('bus', AutocompleteFilter), 'timestamp')
+    list_select_related = ('bus', 'bus__school') # Bus.__str__ shows the school
     search_fields = ('bus__bus_number',)
-    date_hierarchy = 'timestamp' # Add a date drilldown
+    date_hierarchy = 'timestamp' # Add a date drilldown (template: admin/core/buslocation/change_list.html)
+    ordering = ('-timestamp', '-id')
+    sortable_by = ('timestamp',) # sorting by any other column would sort the whole table
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False # no second COUNT(*) for the "N total" link
+    show_facets = admin.ShowFacets.NEVER
+    raw_id_fields = ('bus',)
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(BusLocation._meta.get_field('bus'), self.admin_site).media
 
     # Control visibility based on permissions
     def has_module_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('tracking.view_bus_location') or \
-                request.user.has_perm('tracking.can_submit_bus_location')
+        return get_permissions(request).has_any(
+            'core.view_buslocation',
+            'core.can_submit_bus_location',
+        )
 
     def has_view_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        if request.user.has_perm('tracking.view_bus_location'):
+        if get_permissions(request).has('core.view_buslocation'):
             return True
         # Parents can view location of their child's bus
         if request.user.role == 'parent' and obj is not None and obj.bus.assigned_route.students.filter(parent=request.user).exists():
@@ -257,6 +376,127 @@ class BusLocationAdmin(admin.ModelAdmin):
         return request.user.is_superuser # Only superusers can manually delete locations
 
 
+@admin.register(DeviceToken)
+class DeviceTokenAdmin(SchoolScopedAdminMixin, admin.ModelAdmin):
+    list_display = ('bus', 'driver', 'name', 'created_at', 'last_used', 'is_active')
+    list_filter = ('is_active',)
+    search_fields = ('bus__bus_number', 'driver__username', 'name')
+    readonly_fields = ('driver', 'bus', 'key_digest', 'created_at', 'last_used')
+    list_select_related = ('bus', 'driver')
+
+    # Tokens are issued by drivers' devices or `manage.py issue_device_token`; admins can only revoke them
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(BusDailyStats)
+class BusDailyStatsAdmin(SchoolScopedAdminMixin, admin.ModelAdmin):
+    """Daily fleet report: read-only rollups (core/rollups.py), with totals for the filtered rows."""
+    list_display = ('date', 'bus', 'fixes', 'distance_km', 'average_speed_display', 'max_speed',
+                    'trips_started', 'trips_completed', 'on_time_display', 'first_fix_at', 'last_fix_at')
+    list_filter = ('date', 'bus__school')
+    search_fields = ('bus__bus_number',)
+    date_hierarchy = 'date'
+    list_select_related = ('bus', 'bus__school')
+    readonly_fields = [field.name for field in BusDailyStats._meta.fields]
+
+    @admin.display(description='Distance (km)', ordering='distance_m')
+    def distance_km(self, obj):
+        return round(obj.distance_m / 1000, 1)
+
+    @admin.display(description='Average speed')
+    def average_speed_display(self, obj):
+        return round(obj.average_speed, 1) if obj.average_speed is not None else None
+
+    @admin.display(description='On time %')
+    def on_time_display(self, obj):
+        return round(obj.on_time_percentage) if obj.on_time_percentage is not None else None
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            totals = changelist.queryset.order_by().aggregate(
+                buses=Count('bus', distinct=True),
+                fixes=Sum('fixes'),
+                distance_m=Sum('distance_m'),
+                speed_sum=Sum('speed_sum'),
+                speed_count=Sum('speed_count'),
+                max_speed=Max('max_speed'),
+                trips_completed=Sum('trips_completed'),
+                trips_scheduled=Sum('trips_scheduled'),
+                trips_on_time=Sum('trips_on_time'),
+            )
+            totals['distance_km'] = round((totals['distance_m'] or 0) / 1000, 1)
+            totals['average_speed'] = (
+                round(totals['speed_sum'] / totals['speed_count'], 1) if totals['speed_count'] else None
+            )
+            totals['on_time_percentage'] = (
+                round(100 * totals['trips_on_time'] / totals['trips_scheduled']) if totals['trips_scheduled'] else None
+            )
+            response.context_data['totals'] = totals
+        return response
+
+    # Rows are written by ingest and `manage.py rollup_daily_stats` only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(HistoryReport)
+class HistoryReportAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'since', 'until', 'fixes_scanned', 'seconds')
+    date_hierarchy = 'created_at'
+    readonly_fields = [field.name for field in HistoryReport._meta.fields]
+
+    # Reports are written by `manage.py analyze_history` (core/analytics.py)
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(HistoryReportRow)
+class HistoryReportRowAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'route', 'index', 'hour', 'samples', 'mean_speed', 'p85_speed', 'slow_share',
+                    'mean_dwell_seconds', 'p85_dwell_seconds', 'latitude', 'longitude')
+    list_filter = ('kind', 'hour', 'route', 'report')
+    list_select_related = ('route',)
+    readonly_fields = [field.name for field in HistoryReportRow._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(BulkImportJob)
+class BulkImportJobAdmin(SchoolScopedAdminMixin, admin.ModelAdmin):
+    school_field = 'created_by__school_id'
+    list_display = ('created_at', 'model', 'status', 'progress_display', 'created', 'updated', 'unchanged',
+                    'dry_run', 'created_by')
+    list_filter = ('status', 'model', 'dry_run')
+    list_select_related = ('created_by',)
+    readonly_fields = [field.name for field in BulkImportJob._meta.fields]
+
+    @admin.display(description='Progress')
+    def progress_display(self, obj):
+        if obj.status == 'validating':
+            return f'checked {obj.total_rows} rows'
+        return f'{obj.processed_rows} / {obj.total_rows}' if obj.total_rows else '-'
+
+    # Jobs are started from a model's "Bulk import" page or `manage.py bulk_import`
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 class NotificationResource(resources.ModelResource):
     class Meta:
         model = Notification
@@ -264,7 +504,7 @@ class NotificationResource(resources.ModelResource):
         # You might not want to import/export all fields, adjust as needed
 
 @admin.register(Notification)
-class NotificationAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+class NotificationAdmin(SchoolScopedAdminMixin, BulkImportExportMixin, ImportExportModelAdmin, admin.ModelAdmin):
     resource_class = NotificationResource
     list_display = ('subject', 'notification_type', 'bus', 'sender', 'recipient_group', 'timestamp', 'sent_via', 'status')
     list_filter = ('notification_type', 'recipient_group', 'sent_via', 'status')
@@ -276,15 +516,17 @@ class NotificationAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     def has_module_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('communication.can_send_notification') or \
-                request.user.has_perm('communication.can_view_notifications') or \
-                request.user.has_perm('communication.can_view_all_concerns') or \
-                request.user.has_perm('communication.can_manage_concerns')
+        return get_permissions(request).has_any(
+            'core.can_send_notification',
+            'core.can_view_notifications',
+            'core.can_view_all_concerns',
+            'core.can_manage_concerns',
+        )
 
     def has_view_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
-        if request.user.has_perm('communication.can_view_notifications'):
+        if get_permissions(request).has('core.can_view_notifications'):
             return True
         # Users can view notifications sent to them or their group
         if obj is not None and (obj.recipients.filter(id=request.user.id).exists() or obj.recipient_group == request.user.role):
@@ -294,13 +536,13 @@ class NotificationAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     def has_add_permission(self, request):
         if request.user.is_superuser:
             return True
-        return request.user.has_perm('communication.can_send_notification')
+        return get_permissions(request).has('core.can_send_notification')
 
     def has_change_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
         # Only allow changing status/retry info if user has send permission
-        if request.user.has_perm('communication.can_send_notification'):
+        if get_permissions(request).has('core.can_send_notification'):
             return True
         return False # Prevent others from changing notifications
 
@@ -308,7 +550,7 @@ class NotificationAdmin(ImportExportModelAdmin, admin.ModelAdmin):
         if request.user.is_superuser:
             return True
         # Only allow deleting if user has send permission
-        return request.user.has_perm('communication.can_send_notification')
+        return get_permissions(request).has('core.can_send_notification')
 
 
 class ConcernResource(resources.ModelResource):
@@ -318,7 +560,7 @@ class ConcernResource(resources.ModelResource):
         # You might not want to import/export all fields, adjust as needed
 
 @admin.register(Concern)
-class ConcernAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+class ConcernAdmin(SchoolScopedAdminMixin, BulkImportExportMixin, ImportExportModelAdmin, admin.ModelAdmin):
     resource_class = ConcernResource
     list_display = ('subject', 'raised_by', 'bus', 'timestamp', 'status', 'resolved_by')
     list_filter = ('status', 'bus', 'raised_by')
@@ -328,8 +570,8 @@ class ConcernAdmin(ImportExportModelAdmin, admin.ModelAdmin):
 
     # Control visibility based on permissions
     def has_module_permission(self, request):
-        # Concerns module visibility is tied to communication module permissions
-        return super().has_module_permission(request)
+        # Concerns module visibility is tied to the app's permissions
+        return get_permissions(request).has_module(self.opts.app_label)
 
     def has_view_permission(self, request, obj=None):
         if request.user.is_superuser:
@@ -338,7 +580,7 @@ class ConcernAdmin(ImportExportModelAdmin, admin.ModelAdmin):
         if obj is not None and obj.raised_by == request.user:
             return True
         # Users with 'can_view_all_concerns' permission can view all
-        return request.user.has_perm('communication.can_view_all_concerns')
+        return get_permissions(request).has('core.can_view_all_concerns')
 
     def has_add_permission(self, request):
         # Any logged-in user can raise a concern
@@ -348,12 +590,12 @@ class ConcernAdmin(ImportExportModelAdmin, admin.ModelAdmin):
         if request.user.is_superuser:
             return True
         # Users with 'can_manage_concerns' can change status/resolution
-        return request.user.has_perm('communication.can_manage_concerns')
+        return get_permissions(request).has('core.can_manage_concerns')
 
     def has_delete_permission(self, request, obj=None):
         if request.user.is_superuser:
             return True
         # Only users with 'can_manage_concerns' can delete concerns
-        return request.user.has_perm('communication.can_manage_concerns')
+        return get_permissions(request).has('core.can_manage_concerns')
 
 
@@ -0,0 +1,364 @@
+# core/analytics.py
+"""
+Historical analytics over BusLocation for route planners, behind
+`manage.py analyze_history`. For every local hour of day it computes:
+- segment_speed: speed profile (mean, median, 85th percentile, share below
+  CONGESTION_KMH) of each route segment, i.e. stop i to stop i+1;
+- stop_dwell: how long buses stay within STOP_RADIUS_M of each route stop
+  (mean and 85th percentile per visit);
+- hotspot: grid cells (HOTSPOT_CELL_DEG) where moving buses are most often
+  below CONGESTION_KMH, across all buses.
+
+History is read as plain columns (values_list(...).iterator(), a server-side
+cursor on PostgreSQL) ordered by bus and time. Each CHUNK_SIZE rows become
+NumPy arrays. Fixes are matched to their bus's route segments and stops with
+array arithmetic, and every aggregate is a fixed-size array updated with
+np.bincount. Medians and percentiles come from fixed-width histograms. Memory
+is bounded by the chunk size, the number of routes and the number of hotspot
+cells, not by the length of the history.
+
+Fixes further than OFF_ROUTE_M from their route are left out of the segment
+profiles. Fixes at a stop count as dwell only, not towards segment speeds or
+hotspots. The results are stored as one HistoryReport with its HistoryReportRows.
+
+NumPy is optional for the rest of the project; only this module needs it.
+"""
+import math
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.geometry import EARTH_RADIUS_M, normalize_stops
+from core.models import BusLocation, HistoryReport, HistoryReportRow, Route
+from core.rollups import day_bounds
+from core.synthetic import batched
+
+try:
+    import numpy as np
+except ImportError:  # optional, analyze_history refuses to run without it
+    np = None
+
+DEFAULTS = {
+    'CHUNK_SIZE': 50000,
+    'OFF_ROUTE_M': 150,
+    'STOP_RADIUS_M': 50,
+    'MAX_GAP_SECONDS': 300,
+    'CONGESTION_KMH': 10,
+    'MIN_SAMPLES': 5,
+    'HOTSPOT_CELL_DEG': 0.002,
+    'HOTSPOT_MIN_FIXES': 20,
+    'HOTSPOT_LIMIT': 200,
+}
+
+HOURS = 24
+SPEED_BIN_KMH = 2
+SPEED_BINS = 65  # 0-130 km/h; anything faster lands in the last bin
+DWELL_BIN_SECONDS = 10
+DWELL_BINS = 90  # 0-15 minutes
+METRES_PER_DEG = EARTH_RADIUS_M * math.pi / 180
+PAIRWISE_BLOCK = 2_000_000  # most point-segment pairs compared at once
+
+OpenVisit = namedtuple('OpenVisit', ['bus_id', 'stop', 'start', 'last', 'hour'])
+
+
+def analytics_settings():
+    return {**DEFAULTS, **getattr(settings, 'HISTORY_ANALYTICS', {})}
+
+
+def histogram_quantile(histogram, q, width):
+    """q-quantile of each row of a (groups, bins) histogram, as the middle of the bin it falls in."""
+    cumulative = histogram.cumsum(axis=1)
+    below = (cumulative < q * cumulative[:, -1:]).sum(axis=1)
+    return (below + 0.5) * width
+
+
+def local_hours(timestamps, epoch):
+    """Local hour of day for aware datetimes; vectorised when the UTC offset is the same across the chunk."""
+    first = timezone.localtime(timestamps[0]).utcoffset()
+    if first == timezone.localtime(timestamps[-1]).utcoffset():
+        return ((epoch + first.total_seconds()) // 3600 % HOURS).astype(np.int64)
+    return np.array([timezone.localtime(timestamp).hour for timestamp in timestamps], dtype=np.int64)
+
+
+class RouteShape:
+    """A route's stops projected to metres on a plane tangent at its first stop."""
+
+    def __init__(self, route_id, points):
+        self.route_id = route_id
+        self.points = np.array(points, dtype=float)
+        self.lat0, self.lng0 = points[0]
+        self.kx = METRES_PER_DEG * math.cos(math.radians(self.lat0))
+        self.stops = self.project(self.points[:, 0], self.points[:, 1])
+        self.starts = self.stops[:-1]
+        self.vectors = self.stops[1:] - self.starts
+        self.lengths2 = np.maximum((self.vectors ** 2).sum(axis=1), 1e-9)
+
+    def project(self, latitudes, longitudes):
+        return np.column_stack(((longitudes - self.lng0) * self.kx, (latitudes - self.lat0) * METRES_PER_DEG))
+
+    def _blocks(self, xy, width):
+        step = max(1, PAIRWISE_BLOCK // max(width, 1))
+        for start in range(0, len(xy), step):
+            yield xy[start:start + step]
+
+    def nearest_segment(self, xy):
+        """(segment index, distance in metres) of each point's nearest segment."""
+        indices, distances = [], []
+        for block in self._blocks(xy, len(self.starts)):
+            relative = block[:, None, :] - self.starts[None, :, :]
+            t = np.clip((relative * self.vectors[None]).sum(axis=2) / self.lengths2, 0, 1)
+            offset = relative - t[..., None] * self.vectors[None]
+            distance = np.hypot(offset[..., 0], offset[..., 1])
+            index = distance.argmin(axis=1)
+            indices.append(index)
+            distances.append(distance[np.arange(len(block)), index])
+        return np.concatenate(indices), np.concatenate(distances)
+
+    def nearest_stop(self, xy):
+        """(stop index, distance in metres) of each point's nearest stop."""
+        indices, distances = [], []
+        for block in self._blocks(xy, len(self.stops)):
+            distance = np.hypot(block[:, None, 0] - self.stops[None, :, 0], block[:, None, 1] - self.stops[None, :, 1])
+            index = distance.argmin(axis=1)
+            indices.append(index)
+            distances.append(distance[np.arange(len(block)), index])
+        return np.concatenate(indices), np.concatenate(distances)
+
+
+class RouteAccumulator:
+    """Per (segment, hour) speed and per (stop, hour) dwell aggregates of one route."""
+
+    def __init__(self, shape):
+        self.shape = shape
+        segments, stops = len(shape.starts), len(shape.stops)
+        self.speed_count = np.zeros(segments * HOURS, dtype=np.int64)
+        self.speed_sum = np.zeros(segments * HOURS)
+        self.slow_count = np.zeros(segments * HOURS, dtype=np.int64)
+        self.speed_histogram = np.zeros((segments * HOURS, SPEED_BINS), dtype=np.int64)
+        self.visits = np.zeros(stops * HOURS, dtype=np.int64)
+        self.dwell_sum = np.zeros(stops * HOURS)
+        self.dwell_histogram = np.zeros((stops * HOURS, DWELL_BINS), dtype=np.int64)
+
+    def add_speeds(self, segment, hour, speed, slow_kmh):
+        size = len(self.speed_count)
+        key = segment * HOURS + hour
+        self.speed_count += np.bincount(key, minlength=size)
+        self.speed_sum += np.bincount(key, weights=speed, minlength=size)
+        self.slow_count += np.bincount(key[speed < slow_kmh], minlength=size)
+        bins = np.minimum((speed // SPEED_BIN_KMH).astype(np.int64), SPEED_BINS - 1)
+        self.speed_histogram += np.bincount(key * SPEED_BINS + np.maximum(bins, 0),
+                                            minlength=size * SPEED_BINS).reshape(size, SPEED_BINS)
+
+    def add_visits(self, stop, hour, dwell):
+        size = len(self.visits)
+        key = stop * HOURS + hour
+        self.visits += np.bincount(key, minlength=size)
+        self.dwell_sum += np.bincount(key, weights=dwell, minlength=size)
+        bins = np.minimum((dwell // DWELL_BIN_SECONDS).astype(np.int64), DWELL_BINS - 1)
+        self.dwell_histogram += np.bincount(key * DWELL_BINS + bins,
+                                            minlength=size * DWELL_BINS).reshape(size, DWELL_BINS)
+
+
+class HistoryAnalyzer:
+    """Streams BusLocation for local dates since..until and builds a HistoryReport; see the module docstring."""
+
+    def __init__(self, since, until, bus_ids=None, log=None, **options):
+        if np is None:
+            raise RuntimeError('History analytics need numpy (pip install numpy).')
+        self.since = since
+        self.until = until
+        self.bus_ids = bus_ids
+        self.log = log or (lambda message: None)
+        self.conf = {**analytics_settings(), **{key: value for key, value in options.items() if value is not None}}
+        self.routes = {}  # bus_id -> RouteAccumulator
+        self.cells = {}  # hotspot key -> [fixes, slow fixes, speed sum]
+        self.fixes_scanned = 0
+        self._open = None  # the visit still in progress at the end of the previous slice
+
+    def load_routes(self):
+        routes = Route.objects.filter(bus__isnull=False).values_list('id', 'bus_id', 'stops')
+        if self.bus_ids:
+            routes = routes.filter(bus_id__in=self.bus_ids)
+        for route_id, bus_id, stops in routes:
+            points, _ = normalize_stops(stops)
+            if len(points) >= 2:
+                self.routes[bus_id] = RouteAccumulator(RouteShape(route_id, points))
+
+    def history(self):
+        start, end = day_bounds(self.since, self.until)
+        rows = BusLocation.objects.filter(
+            timestamp__gte=start, timestamp__lt=end, is_trip_start=False, is_trip_end=False,
+        )
+        if self.bus_ids:
+            rows = rows.filter(bus_id__in=self.bus_ids)
+        return (
+            rows.order_by('bus_id', 'timestamp')
+            .values_list('bus_id', 'timestamp', 'latitude', 'longitude', 'speed')
+            .iterator(chunk_size=self.conf['CHUNK_SIZE'])
+        )
+
+    def run(self):
+        started = time.monotonic()
+        self.load_routes()
+        for chunk in batched(self.history(), self.conf['CHUNK_SIZE']):
+            self.add_chunk(chunk)
+            self.fixes_scanned += len(chunk)
+            self.log(f'{self.fixes_scanned} fixes')
+        self._close_visit()
+        return self.save(time.monotonic() - started)
+
+    def add_chunk(self, chunk):
+        bus_ids, timestamps, latitudes, longitudes, speeds = zip(*chunk)
+        bus_ids = np.array(bus_ids, dtype=np.int64)
+        epoch = np.array([timestamp.timestamp() for timestamp in timestamps])
+        hours = local_hours(timestamps, epoch)
+        latitudes = np.array(latitudes, dtype=float)
+        longitudes = np.array(longitudes, dtype=float)
+        speeds = np.array(speeds, dtype=float)  # None -> NaN
+        at_stop = np.zeros(len(chunk), dtype=bool)
+
+        # The rows are ordered by bus, so each bus is one contiguous slice
+        boundaries = np.flatnonzero(np.diff(bus_ids)) + 1
+        for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(chunk)]):
+            bus_id = int(bus_ids[start])
+            if self._open is not None and self._open.bus_id != bus_id:
+                self._close_visit()
+            route = self.routes.get(bus_id)
+            if route is not None:
+                at_stop[start:end] = self.add_route_slice(
+                    route, bus_id, epoch[start:end], hours[start:end],
+                    latitudes[start:end], longitudes[start:end], speeds[start:end],
+                )
+        self.add_hotspots(latitudes[~at_stop], longitudes[~at_stop], hours[~at_stop], speeds[~at_stop])
+
+    def add_route_slice(self, route, bus_id, epoch, hours, latitudes, longitudes, speeds):
+        """Adds one bus's fixes to its route's aggregates; returns which fixes were at a stop."""
+        xy = route.shape.project(latitudes, longitudes)
+        stop, stop_distance = route.shape.nearest_stop(xy)
+        at_stop = stop_distance <= self.conf['STOP_RADIUS_M']
+        self.add_visits(route, bus_id, epoch, hours, np.where(at_stop, stop, -1))
+
+        segment, segment_distance = route.shape.nearest_segment(xy)
+        moving = ~at_stop & (segment_distance <= self.conf['OFF_ROUTE_M']) & ~np.isnan(speeds)
+        route.add_speeds(segment[moving], hours[moving], speeds[moving], self.conf['CONGESTION_KMH'])
+        return at_stop
+
+    def add_visits(self, route, bus_id, epoch, hours, stop):
+        """
+        A visit is a run of consecutive fixes at the same stop with no gap over
+        MAX_GAP_SECONDS. The last run of a slice may continue in the next
+        chunk, so it is kept open until a different run or bus follows.
+        """
+        gap = self.conf['MAX_GAP_SECONDS']
+        starts_run = np.ones(len(stop), dtype=bool)
+        starts_run[1:] = (stop[1:] != stop[:-1]) | (np.diff(epoch) > gap)
+        first = np.flatnonzero(starts_run)
+        last = np.r_[first[1:], len(stop)] - 1
+        run_stop, run_start, run_end, run_hour = stop[first], epoch[first], epoch[last], hours[first]
+
+        previous = self._open
+        if previous is not None and previous.stop == run_stop[0] and epoch[0] - previous.last <= gap:
+            run_start[0], run_hour[0] = previous.start, previous.hour
+        elif previous is not None:
+            self._emit_visit(previous)
+        self._open = OpenVisit(bus_id, int(run_stop[-1]), run_start[-1], run_end[-1], int(run_hour[-1]))
+
+        done = run_stop[:-1] >= 0
+        if done.any():
+            route.add_visits(run_stop[:-1][done], run_hour[:-1][done], (run_end - run_start)[:-1][done])
+
+    def _emit_visit(self, visit):
+        if visit.stop >= 0:
+            self.routes[visit.bus_id].add_visits(
+                np.array([visit.stop]), np.array([visit.hour]), np.array([visit.last - visit.start]),
+            )
+
+    def _close_visit(self):
+        if self._open is not None:
+            self._emit_visit(self._open)
+            self._open = None
+
+    def add_hotspots(self, latitudes, longitudes, hours, speeds):
+        moving = ~np.isnan(speeds)
+        latitudes, longitudes, hours, speeds = latitudes[moving], longitudes[moving], hours[moving], speeds[moving]
+        if not len(speeds):
+            return
+        cell = self.conf['HOTSPOT_CELL_DEG']
+        rows = np.floor(latitudes / cell).astype(np.int64)
+        cols = np.floor(longitudes / cell).astype(np.int64)
+        keys = np.stack([rows, cols, hours], axis=1)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse)
+        slow = np.bincount(inverse, weights=speeds < self.conf['CONGESTION_KMH'])
+        speed_sums = np.bincount(inverse, weights=speeds)
+        for key, count, slow_count, speed_sum in zip(map(tuple, unique.tolist()), counts, slow, speed_sums):
+            totals = self.cells.get(key)
+            if totals is None:
+                self.cells[key] = [int(count), slow_count, speed_sum]
+            else:
+                totals[0] += int(count)
+                totals[1] += slow_count
+                totals[2] += speed_sum
+
+    def report_rows(self, report):
+        minimum = self.conf['MIN_SAMPLES']
+        for route in self.routes.values():
+            shape = route.shape
+            middles = (shape.points[:-1] + shape.points[1:]) / 2
+            medians = histogram_quantile(route.speed_histogram, 0.50, SPEED_BIN_KMH)
+            p85s = histogram_quantile(route.speed_histogram, 0.85, SPEED_BIN_KMH)
+            for key in np.flatnonzero(route.speed_count >= minimum):
+                segment, hour = divmod(int(key), HOURS)
+                count = int(route.speed_count[key])
+                yield HistoryReportRow(
+                    report=report, kind='segment_speed', route_id=shape.route_id, index=segment, hour=hour,
+                    latitude=middles[segment, 0], longitude=middles[segment, 1], samples=count,
+                    mean_speed=route.speed_sum[key] / count, median_speed=medians[key], p85_speed=p85s[key],
+                    slow_share=route.slow_count[key] / count,
+                )
+            p85s = histogram_quantile(route.dwell_histogram, 0.85, DWELL_BIN_SECONDS)
+            for key in np.flatnonzero(route.visits >= minimum):
+                stop, hour = divmod(int(key), HOURS)
+                visits = int(route.visits[key])
+                yield HistoryReportRow(
+                    report=report, kind='stop_dwell', route_id=shape.route_id, index=stop, hour=hour,
+                    latitude=shape.points[stop, 0], longitude=shape.points[stop, 1], samples=visits,
+                    mean_dwell_seconds=route.dwell_sum[key] / visits, p85_dwell_seconds=p85s[key],
+                )
+
+        cell = self.conf['HOTSPOT_CELL_DEG']
+        hotspots = [
+            (key, totals) for key, totals in self.cells.items()
+            if totals[0] >= self.conf['HOTSPOT_MIN_FIXES'] and totals[1]
+        ]
+        # Most slow fixes first, then the higher slow share; the key keeps ties in a stable order
+        hotspots.sort(key=lambda item: (-item[1][1], -item[1][1] / item[1][0], item[0]))
+        for (row, col, hour), (count, slow_count, speed_sum) in hotspots[:self.conf['HOTSPOT_LIMIT']]:
+            yield HistoryReportRow(
+                report=report, kind='hotspot', hour=hour,
+                latitude=(row + 0.5) * cell, longitude=(col + 0.5) * cell, samples=count,
+                mean_speed=speed_sum / count, slow_share=slow_count / count,
+            )
+
+    def save(self, seconds):
+        with transaction.atomic():
+            report = HistoryReport.objects.create(
+                since=self.since, until=self.until, fixes_scanned=self.fixes_scanned, seconds=seconds,
+                parameters={**self.conf, 'buses': self.bus_ids},
+            )
+            rows = [self._plain(row) for row in self.report_rows(report)]
+            HistoryReportRow.objects.bulk_create(rows, batch_size=1000)
+        return report
+
+    def _plain(self, row):
+        # NumPy scalars -> Python numbers before they reach the database driver
+        for field in ('latitude', 'longitude', 'mean_speed', 'median_speed', 'p85_speed', 'slow_share',
+                      'mean_dwell_seconds', 'p85_dwell_seconds'):
+            value = getattr(row, field)
+            if value is not None:
+                setattr(row, field, float(value))
+        return row
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
+
+    def ready(self):
+        from core import signals  # noqa: F401  (connects the receivers)
+        from core.profiler import install_signal_handler
+
+        install_signal_handler()
@@ -0,0 +1,338 @@
+# core/archive.py
+"""
+Streaming export and bulk import of location history (BusLocation) archives.
+
+An archive holds one fix per row, ordered by bus then time, with the columns
+in COLUMNS. Buses are identified by bus_number, so an archive can be restored
+into another database. Two formats are supported:
+- csv: a header row, then one row per fix. Booleans are 1/0 and missing
+  values are empty.
+- ndjson: one JSON object per line.
+Either format can be gzip-compressed. The importer detects compression and
+format itself.
+
+Exports read the history with a server-side iterator of CHUNK_SIZE rows and
+encode and compress it as they go. Memory use therefore does not depend on the
+size of the range. They are served by `manage.py export_locations` and by
+GET /api/location-history/export/ for admins.
+
+Imports (`manage.py import_locations`) read BATCH_SIZE rows at a time. Each
+batch is checked against the history already stored, by (bus, timestamp) and
+by seq (per device, or per bus for fixes without one), and only new fixes are
+inserted. Archives from before the device column are read as fixes without
+a device. Restoring the same archive
+twice is therefore harmless, and an import that stopped halfway can simply be
+rerun. Rows for buses that do not exist are counted and skipped. Afterwards
+the daily rollups of the buses and days that received fixes are rebuilt. The
+live position of a bus is not changed.
+"""
+import csv
+import gzip
+import io
+import json
+import zlib
+from datetime import date
+from itertools import chain
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from core import rollups
+from core.models import Bus, BusLocation
+from core.synthetic import LOCATION_COLUMNS, batched, insert_rows
+from core.tenancy import current_school_id, for_school
+
+IMPORT_COLUMNS = LOCATION_COLUMNS + ['device']
+
+DEFAULTS = {
+    'CHUNK_SIZE': 5000,
+    'BATCH_SIZE': 5000,
+    'ROWS_PER_WRITE': 2000,
+    'GZIP_LEVEL': 6,
+}
+
+COLUMNS = [
+    'bus', 'timestamp', 'latitude', 'longitude', 'speed', 'heading', 'is_trip_start', 'is_trip_end', 'seq', 'device',
+]
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class ArchiveError(ValueError):
+    """An archive row that cannot be read; the message names its line."""
+
+
+def archive_settings():
+    return {**DEFAULTS, **getattr(settings, 'HISTORY_ARCHIVE', {})}
+
+
+def history_rows(since=None, until=None, bus_ids=None, chunk_size=None, school_id=None):
+    """
+    Yields one tuple per fix, in COLUMNS order, for local dates since..until
+    (inclusive; either may be None for no bound), ordered by bus and time.
+    With school_id, only that school's buses are exported.
+    """
+    queryset = for_school(BusLocation.objects.all(), school_id, 'bus__school_id')
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=rollups.day_bounds(since, since)[0])
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=rollups.day_bounds(until, until)[1])
+    if bus_ids:
+        queryset = queryset.filter(bus_id__in=bus_ids)
+    return (
+        queryset
+        .order_by('bus_id', 'timestamp', 'id')
+        .values_list('bus__bus_number', *COLUMNS[1:])
+        .iterator(chunk_size=chunk_size or archive_settings()['CHUNK_SIZE'])
+    )
+
+
+def encode_csv(rows, rows_per_write):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for batch in batched(rows, rows_per_write):
+        writer.writerows(
+            (bus, timestamp.isoformat(), latitude, longitude, speed, heading, int(start), int(end), seq, device)
+            for bus, timestamp, latitude, longitude, speed, heading, start, end, seq, device in batch
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()  # header of an empty export
+
+
+def encode_ndjson(rows, rows_per_write):
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    for batch in batched(rows, rows_per_write):
+        lines = []
+        for row in batch:
+            values = dict(zip(COLUMNS, row))
+            values['timestamp'] = values['timestamp'].isoformat()
+            lines.append(encoder.encode(values))
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def gzipped(chunks, level):
+    """Gzip-compresses a stream of byte chunks without holding more than one."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(file_format, compress=False, since=None, until=None, bus_ids=None, school_id=None):
+    """Byte chunks of an archive of the given range; see history_rows for the arguments."""
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown archive format {file_format!r}; use one of {", ".join(FORMATS)}.')
+    conf = archive_settings()
+    rows = history_rows(since, until, bus_ids, conf['CHUNK_SIZE'], school_id)
+    encode = encode_csv if file_format == 'csv' else encode_ndjson
+    chunks = encode(rows, conf['ROWS_PER_WRITE'])
+    return gzipped(chunks, conf['GZIP_LEVEL']) if compress else chunks
+
+
+def archive_filename(file_format, compress=False, since=None, until=None):
+    span = '-'.join(str(day) for day in (since, until) if day is not None) or 'all'
+    return f'locations-{span}.{file_format}' + ('.gz' if compress else '')
+
+
+def open_archive(stream, file_format=None):
+    """
+    Returns (format, lines) for a binary stream holding a csv or ndjson
+    archive, gzip-compressed or not. The format is taken from the first line
+    unless given.
+    """
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    first = lines.readline()
+    if file_format is None:
+        file_format = 'ndjson' if first.lstrip().startswith('{') else 'csv'
+    elif file_format not in FORMATS:
+        raise ValueError(f'Unknown archive format {file_format!r}; use one of {", ".join(FORMATS)}.')
+    return file_format, chain([first], lines)
+
+
+def _float(value):
+    return None if value in ('', None) else float(value)
+
+
+def _int(value):
+    return None if value in ('', None) else int(value)
+
+
+def _bool(value):
+    return value in (True, 1, '1', 'true', 'True')
+
+
+def _parse(values, line):
+    """Row tuple in COLUMNS order, with the timestamp aware, from one decoded record."""
+    try:
+        timestamp = parse_datetime(values['timestamp'])
+        if timestamp is None:
+            raise ValueError(f"bad timestamp {values['timestamp']!r}")
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        latitude, longitude = float(values['latitude']), float(values['longitude'])
+        return (
+            str(values['bus']), timestamp, latitude, longitude, _float(values.get('speed')),
+            _float(values.get('heading')), _bool(values.get('is_trip_start')), _bool(values.get('is_trip_end')),
+            _int(values.get('seq')), _int(values.get('device')),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ArchiveError(f'Line {line}: {type(e).__name__}: {e}') from e
+
+
+def parse_rows(file_format, lines):
+    """Yields row tuples in COLUMNS order from the lines of an archive."""
+    if file_format == 'csv':
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return
+        missing = {'bus', 'timestamp', 'latitude', 'longitude'} - set(header)
+        if missing:
+            raise ArchiveError(f'Line 1: the header has no {", ".join(sorted(missing))} column.')
+        for record in reader:
+            if record:
+                yield _parse(dict(zip(header, record)), reader.line_num)
+    else:
+        for line, text in enumerate(lines, start=1):
+            if text.strip():
+                try:
+                    values = json.loads(text)
+                except ValueError as e:
+                    raise ArchiveError(f'Line {line}: {e}') from e
+                yield _parse(values, line)
+
+
+class HistoryImporter:
+    """
+    Restores archive rows into BusLocation, BATCH_SIZE at a time; see the
+    module docstring. `counts` holds read, inserted, existing and unknown_bus
+    (rows for bus numbers not in the database), plus the bus numbers
+    themselves in unknown_buses.
+    """
+
+    def __init__(self, batch_size=None, update_rollups=True, log=None):
+        self.batch_size = batch_size or archive_settings()['BATCH_SIZE']
+        self.update_rollups = update_rollups
+        self.log = log
+        self.bus_ids = dict(Bus.objects.values_list('bus_number', 'id'))
+        self.counts = {'read': 0, 'inserted': 0, 'existing': 0, 'unknown_bus': 0}
+        self.unknown_buses = set()
+        self.days = {}  # bus_id -> [first, last] local date that received fixes
+        self.rollup_rows = 0
+
+    def run(self, stream, file_format=None):
+        file_format, lines = open_archive(stream, file_format)
+        for batch in batched(parse_rows(file_format, lines), self.batch_size):
+            self.import_batch(batch)
+            if self.log:
+                self.log(f"{self.counts['read']} rows read, {self.counts['inserted']} inserted")
+        if self.update_rollups:
+            for bus_id, (since, until) in self.days.items():
+                self.rollup_rows += rollups.rebuild(since, until, bus_ids=[bus_id])
+        return self.counts
+
+    def import_batch(self, batch):
+        self.counts['read'] += len(batch)
+        per_bus = {}
+        for row in batch:
+            bus_id = self.bus_ids.get(row[0])
+            if bus_id is None:
+                self.counts['unknown_bus'] += 1
+                self.unknown_buses.add(row[0])
+            else:
+                per_bus.setdefault(bus_id, []).append(row)
+
+        adapt = connection.ops.adapt_datetimefield_value
+        new = []
+        for bus_id, rows in per_bus.items():
+            timestamps, seqs = self.existing(bus_id, rows)
+            for _, timestamp, latitude, longitude, speed, heading, start, end, seq, device in rows:
+                if timestamp in timestamps or (seq is not None and (device, seq) in seqs):
+                    self.counts['existing'] += 1
+                    continue
+                timestamps.add(timestamp)  # duplicates within the archive, too
+                if seq is not None:
+                    seqs.add((device, seq))
+                new.append((bus_id, latitude, longitude, adapt(timestamp), speed,
+                            heading, start, end, seq, device))
+                day = timezone.localdate(timestamp)
+                span = self.days.setdefault(bus_id, [day, day])
+                span[0], span[1] = min(span[0], day), max(span[1], day)
+        if new:
+            # ignore_conflicts only matters if a device sends the same seq while the import runs
+            insert_rows(BusLocation, IMPORT_COLUMNS, new, ignore_conflicts=True)
+            self.counts['inserted'] += len(new)
+
+    def existing(self, bus_id, rows):
+        """(timestamps, (device, seq) pairs) of stored fixes of the bus that match any of the rows."""
+        seqs = [row[8] for row in rows if row[8] is not None]
+        match = Q(timestamp__gte=min(row[1] for row in rows), timestamp__lte=max(row[1] for row in rows))
+        if seqs:
+            match |= Q(seq__in=seqs)
+        stored = BusLocation.objects.filter(match, bus_id=bus_id).values_list('timestamp', 'device', 'seq')
+        timestamps, stored_seqs = set(), set()
+        for timestamp, device, seq in stored.iterator(chunk_size=self.batch_size):
+            timestamps.add(timestamp)
+            if seq is not None:
+                stored_seqs.add((device, seq))
+        return timestamps, stored_seqs
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def history_export_view(request):
+    """
+    Streams an archive (admins only; of their school's buses when bound to
+    one). ?since=YYYY-MM-DD (required), ?until=YYYY-MM-DD (default: since),
+    ?bus=<id> (repeatable; default all), ?file_format=csv|ndjson (default
+    csv), ?gzip=1.
+    """
+    if request.user.role != 'admin':
+        return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
+    params = request.query_params
+    try:
+        since = date.fromisoformat(params['since'])
+        until = date.fromisoformat(params['until']) if params.get('until') else since
+        bus_ids = [int(bus_id) for bus_id in params.getlist('bus')]
+    except KeyError:
+        return Response({'detail': 'since is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        return Response({'detail': 'since and until must be YYYY-MM-DD dates and bus a bus id.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if since > until:
+        return Response({'detail': 'since is after until.'}, status=status.HTTP_400_BAD_REQUEST)
+    file_format = params.get('file_format', 'csv')
+    if file_format not in FORMATS:
+        return Response({'detail': f'file_format must be one of {", ".join(FORMATS)}.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    compress = params.get('gzip') in ('1', 'true')
+
+    # The body streams after the request's school binding is gone, so pass the school in
+    response = StreamingHttpResponse(
+        export_chunks(file_format, compress, since, until, bus_ids, current_school_id()),
+        content_type='application/gzip' if compress else CONTENT_TYPES[file_format],
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{archive_filename(file_format, compress, since, until)}"'
+    )
+    return response
@@ -0,0 +1,328 @@
+# core/assets.py
+"""
+Per-page static bundles.
+
+base.html used to link a dozen vendor files on every page. Now templates ask
+for named bundles with {% bundle 'name' 'css' %} (core/templatetags/assets.py):
+every page gets 'base', and only the table pages add 'datatables'.
+
+`manage.py build_assets` does the following for each bundle:
+- concatenates its sources into STATIC_ROOT/bundles/<name>.<hash>.<ext>;
+- rewrites relative url()s in the CSS;
+- drops CSS rules whose classes appear in no template, Python module or
+  bundled script;
+- writes precompressed .gz copies, plus .br copies when the brotli package is
+  installed.
+Bundle names carry a content hash, so serve_bundle can send them with a one-year
+immutable Cache-Control. When nginx serves /static/ instead, set `gzip_static on`
+and `expires max` for /static/bundles/.
+
+Until build_assets has run, or while ASSET_BUNDLES['ENABLED'] is off (the
+default with DEBUG), the tag falls back to one tag per source file.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.http import FileResponse, Http404
+from django.templatetags.static import static
+from django.utils._os import safe_join
+from django.utils.html import format_html_join
+
+try:
+    import brotli
+except ImportError:  # optional, .br variants are skipped without it
+    brotli = None
+
+BUNDLES = {
+    'base': {
+        'css': [
+            'vendors/feather/feather.css',
+            'vendors/ti-icons/css/themify-icons.css',
+            'vendors/css/vendor.bundle.base.css',
+            'css/vertical-layout-light/style.css',
+        ],
+        'js': [
+            'vendors/js/vendor.bundle.base.js',
+            'js/off-canvas.js',
+            'js/hoverable-collapse.js',
+            'js/template.js',
+            'js/settings.js',
+        ],
+    },
+    'datatables': {
+        'css': [
+            'vendors/datatables.net-bs4/dataTables.bootstrap4.css',
+            'js/select.dataTables.min.css',
+        ],
+        'js': [
+            'vendors/datatables.net/jquery.dataTables.js',
+            'vendors/datatables.net-bs4/dataTables.bootstrap4.js',
+            'js/dataTables.select.min.js',
+            'js/server-datatable.js',
+        ],
+    },
+}
+
+BUNDLE_PREFIX = 'bundles'
+MANIFEST_NAME = 'manifest.json'
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+TAG_TEMPLATES = {
+    'css': '<link rel="stylesheet" href="{}">',
+    'js': '<script src="{}"></script>',
+}
+
+
+def asset_settings():
+    conf = {'ENABLED': not settings.DEBUG, 'SAFELIST': []}
+    conf.update(getattr(settings, 'ASSET_BUNDLES', {}))
+    return conf
+
+
+def bundle_dir():
+    return Path(settings.STATIC_ROOT) / BUNDLE_PREFIX
+
+
+_manifest_cache = {'mtime': None, 'data': {}}
+
+
+def load_manifest():
+    """The manifest written by build_assets, re-read when the file changes. {} if it was never built."""
+    path = bundle_dir() / MANIFEST_NAME
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return {}
+    if mtime != _manifest_cache['mtime']:
+        with open(path) as f:
+            _manifest_cache['data'] = json.load(f)
+        _manifest_cache['mtime'] = mtime
+    return _manifest_cache['data']
+
+
+def bundle_urls(name, kind):
+    entry = load_manifest().get(f'{name}.{kind}') if asset_settings()['ENABLED'] else None
+    if entry:
+        return [static(f'{BUNDLE_PREFIX}/{entry["file"]}')]
+    return [static(path) for path in BUNDLES[name].get(kind, [])]
+
+
+def bundle_tags(name, kind):
+    return format_html_join('\n', TAG_TEMPLATES[kind], ((url,) for url in bundle_urls(name, kind)))
+
+
+def serve_bundle(request, path):
+    """Serves a built bundle, precompressed if the client accepts it, with far-future caching."""
+    try:
+        full_path = safe_join(bundle_dir(), path)
+    except Exception:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    accepted = {token.split(';')[0].strip() for token in request.META.get('HTTP_ACCEPT_ENCODING', '').split(',')}
+    encoding, served_path = None, full_path
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in accepted and os.path.isfile(full_path + suffix):
+            encoding, served_path = candidate, full_path + suffix
+            break
+    response = FileResponse(open(served_path, 'rb'), content_type=mimetypes.guess_type(full_path)[0])
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+# --- Building ---
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+SOURCE_MAP = re.compile(r'^\s*(//|/\*)# sourceMappingURL=.*$', re.M)
+SELECTOR_CLASS = re.compile(r'\.((?:\\.|[\w-])+)')
+SELECTOR_IGNORED = re.compile(r':not\([^)]*\)|\[[^\]]*\]')  # :not(.x) and [attr=".x"] don't need .x on the page
+WORD = re.compile(r'[\w-]+')
+# `badge-{{ status }}`, `marker-${type}`, 'text-' + color: classes built at runtime from a prefix
+DYNAMIC_PREFIX = re.compile(r'([A-Za-z][\w-]*-)(?:\{\{|\$\{|[\'"]\s*\+)')
+# Rules inside these at-rules are trimmed like top-level rules, other at-rules are kept whole
+GROUPING_RULES = ('@media', '@supports', '@document', '@layer')
+
+
+def read_source(path):
+    found = finders.find(path)
+    if not found:
+        raise FileNotFoundError(f'Static file {path!r} not found')
+    with open(found, encoding='utf-8') as f:
+        return f.read()
+
+
+def rewrite_css_urls(css, path):
+    """Makes relative url()s absolute, since the bundle does not live next to its sources."""
+    base = posixpath.dirname(path)
+
+    def replace(match):
+        target = match.group(2).strip()
+        if target.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        split = min((i for i in (target.find('?'), target.find('#')) if i != -1), default=len(target))
+        resolved = posixpath.normpath(posixpath.join(base, target[:split]))
+        return f'url("{static(resolved)}{target[split:]}")'
+
+    return CSS_URL.sub(replace, css)
+
+
+def used_words(extra_sources=()):
+    """
+    Every word that appears in templates, Python modules and the given script
+    sources, plus class prefixes that templates/scripts complete at runtime.
+    A CSS class not in this set cannot be on any page.
+    """
+    texts = list(extra_sources)
+    roots = [Path(directory) for conf in settings.TEMPLATES for directory in conf.get('DIRS', [])]
+    roots.append(Path(__file__).resolve().parent)
+    for root in roots:
+        for path in root.rglob('*'):
+            if path.suffix in ('.html', '.py', '.js') and path.is_file():
+                texts.append(path.read_text(encoding='utf-8', errors='ignore'))
+    words, prefixes = set(), set()
+    for text in texts:
+        words.update(WORD.findall(text))
+        prefixes.update(DYNAMIC_PREFIX.findall(text))
+    conf = asset_settings()
+    words.update(entry for entry in conf['SAFELIST'] if not entry.endswith('-'))
+    prefixes.update(entry for entry in conf['SAFELIST'] if entry.endswith('-'))
+    return words, tuple(prefixes)
+
+
+def _split_rules(css):
+    """Yields (prelude, body) for every top-level rule; body is None for statements like @import."""
+    start = depth = 0
+    prelude_end = 0
+    quote = None
+    i = 0
+    while i < len(css):
+        char = css[i]
+        if quote:
+            if char == '\\':
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == ';' and depth == 0:
+            yield css[start:i].strip(), None
+            start = i + 1
+        elif char == '{':
+            if depth == 0:
+                prelude_end = i
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                yield css[start:prelude_end].strip(), css[prelude_end + 1:i]
+                start = i + 1
+        i += 1
+
+
+def _split_selectors(prelude):
+    selectors, current, depth = [], [], 0
+    for char in prelude:
+        if char == ',' and depth == 0:
+            selectors.append(''.join(current))
+            current = []
+            continue
+        depth += (char in '([') - (char in ')]')
+        current.append(char)
+    selectors.append(''.join(current))
+    return [' '.join(selector.split()) for selector in selectors if selector.strip()]
+
+
+def _squash(body):
+    return re.sub(r'\s*\n\s*', ' ', body).strip()
+
+
+def trim_css(css, words, prefixes=()):
+    """Drops selectors (and then rules) that reference a class not in `words`; collapses whitespace."""
+    def used(selector):
+        classes = SELECTOR_CLASS.findall(SELECTOR_IGNORED.sub('', selector))
+        return all(
+            cls.replace('\\', '') in words or cls.startswith(prefixes)
+            for cls in classes
+        )
+
+    out = []
+    for prelude, body in _split_rules(CSS_COMMENT.sub('', css)):
+        if body is None:
+            if prelude:
+                out.append(prelude + ';')
+        elif prelude.startswith(GROUPING_RULES):
+            inner = trim_css(body, words, prefixes)
+            if inner:
+                out.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            out.append(f'{prelude}{{{_squash(body)}}}')
+        else:
+            selectors = [selector for selector in _split_selectors(prelude) if used(selector)]
+            if selectors:
+                out.append(f'{",".join(selectors)}{{{_squash(body)}}}')
+    return '\n'.join(out)
+
+
+def compressed_sizes(data):
+    """(gzip bytes, brotli bytes or None) for `data` at the levels build_assets writes."""
+    gz = len(gzip.compress(data, compresslevel=9, mtime=0))
+    br = len(brotli.compress(data, quality=11)) if brotli else None
+    return gz, br
+
+
+def build_bundles(names=None):
+    """Builds the given bundles (default: all) and writes the manifest. Returns the manifest."""
+    names = names or list(BUNDLES)
+    out_dir = bundle_dir()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    previous = load_manifest()
+
+    scripts = [read_source(path) for bundle in BUNDLES.values() for path in bundle.get('js', [])]
+    words, prefixes = used_words(scripts)
+
+    manifest = dict(previous)
+    for name in names:
+        for kind, sources in BUNDLES[name].items():
+            parts = []
+            for path in sources:
+                text = SOURCE_MAP.sub('', read_source(path))
+                if kind == 'css':
+                    text = trim_css(rewrite_css_urls(text, path), words, prefixes)
+                parts.append(f'/* {path} */\n{text}')
+            # the ; guards against scripts that end without one
+            data = (';\n' if kind == 'js' else '\n').join(parts).encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            filename = f'{name}.{digest}.{kind}'
+            (out_dir / filename).write_bytes(data)
+            (out_dir / f'{filename}.gz').write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli:
+                (out_dir / f'{filename}.br').write_bytes(brotli.compress(data, quality=11))
+            source_bytes = sum(os.path.getsize(finders.find(path)) for path in sources)
+            gz, br = compressed_sizes(data)
+            manifest[f'{name}.{kind}'] = {
+                'file': filename, 'sources': sources, 'source_bytes': source_bytes,
+                'bytes': len(data), 'gzip': gz, 'br': br,
+            }
+
+    # Keep the previous generation for pages rendered before the deploy, drop anything older
+    keep = {MANIFEST_NAME}
+    for entry in list(manifest.values()) + list(previous.values()):
+        keep.update({entry['file'], entry['file'] + '.gz', entry['file'] + '.br'})
+    for path in out_dir.iterdir():
+        if path.name not in keep:
+            path.unlink()
+
+    with open(out_dir / MANIFEST_NAME, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
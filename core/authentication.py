@@ -0,0 +1,123 @@
+# core/authentication.py
+"""
+Device token authentication for driver GPS ingest.
+
+Basic auth runs the full password hasher (PBKDF2) on every request, which is
+most of the CPU cost of a GPS post. Device tokens are long random secrets, so a
+single sha256 is enough to look them up. Verified tokens are cached per process
+for DEVICE_TOKEN_CACHE_SECONDS together with the driver and the bus they are
+bound to, so a cached request needs no password hashing and no user or bus
+query. Deactivating/deleting a token or reassigning the bus's driver clears the
+cache entry in this process (core/signals.py); other workers pick it up when
+their entry expires.
+
+Clients send:  Authorization: Device <token>
+"""
+import hashlib
+import secrets
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from core.models import DeviceToken
+
+KEYWORD = 'Device'
+
+# request.auth for device-token requests
+DeviceAuth = namedtuple('DeviceAuth', ['token_id', 'bus_id'])
+
+
+def hash_token(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def issue_device_token(driver, bus, name=''):
+    """Creates a token bound to driver and bus. Returns (DeviceToken, plaintext key); the key is shown only once."""
+    if bus.driver_id != driver.id:
+        raise ValueError(f'{driver.username} is not the assigned driver of bus {bus.bus_number}.')
+    key = secrets.token_urlsafe(32)
+    token = DeviceToken.objects.create(driver=driver, bus=bus, key_digest=hash_token(key), name=name)
+    return token, key
+
+
+class VerifiedTokenCache:
+    """Bounded TTL map of token digest -> (user, DeviceAuth)."""
+
+    def __init__(self, ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        expires_at, user, auth = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(digest, None)
+            return None
+        return user, auth
+
+    def put(self, digest, user, auth):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()  # crude but bounded; entries are cheap to rebuild
+            self._entries[digest] = (time.monotonic() + self.ttl, user, auth)
+
+    def discard(self, digest=None, bus_id=None, driver_id=None):
+        """Drops entries by token digest, or every entry bound to a bus or driver."""
+        with self._lock:
+            if digest is not None:
+                self._entries.pop(digest, None)
+            if bus_id is not None or driver_id is not None:
+                for key, (_, user, auth) in list(self._entries.items()):
+                    if auth.bus_id == bus_id or user.id == driver_id:
+                        del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = VerifiedTokenCache(ttl=getattr(settings, 'DEVICE_TOKEN_CACHE_SECONDS', 300))
+
+
+class DeviceTokenAuthentication(BaseAuthentication):
+    """DRF authentication for `Authorization: Device <token>` headers."""
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid device token header.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid device token header.')
+
+        digest = hash_token(key)
+        cached = token_cache.get(digest)
+        if cached is not None:
+            return cached
+
+        try:
+            token = DeviceToken.objects.select_related('driver', 'bus').get(key_digest=digest, is_active=True)
+        except DeviceToken.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid device token.')
+        if not token.driver.is_active or token.bus.driver_id != token.driver_id:
+            raise exceptions.AuthenticationFailed('Device token is no longer bound to an assigned bus.')
+
+        DeviceToken.objects.filter(id=token.id).update(last_used=timezone.now())
+        result = (token.driver, DeviceAuth(token.id, token.bus_id))
+        token_cache.put(digest, *result)
+        return result
+
+    def authenticate_header(self, request):
+        return KEYWORD
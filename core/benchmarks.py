@@ -0,0 +1,586 @@
+# core/benchmarks.py
+"""
+Benchmarks for the hot paths, run with `manage.py benchmark [name ...]`.
+
+Every run happens inside a throwaway test database, so the development
+database is never touched. The database is created once per run and emptied
+between benchmarks (see run_benchmarks). A benchmark is a function registered with
+@benchmark(name) that takes the command's stdout plus keyword parameters
+(passed as --param key=value) and returns a dict of results.
+
+`benchmark --output run.json` stores the results, and `--compare run.json`
+fails when a metric got worse than in that run by more than --threshold (see
+compare_results). Whether lower or higher is better comes from the metric
+name's suffix (METRIC_DIRECTIONS); metrics without a known suffix are reported
+but never compared.
+"""
+import base64
+import inspect
+import json
+import math
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from rest_framework.authentication import BasicAuthentication
+
+from core import ingest, routing, spatial
+from core.authentication import DeviceTokenAuthentication, issue_device_token, token_cache
+from core.geometry import haversine_m
+from core.models import Bus, Concern, CustomUser, Notification, Route, School, Student
+from core.synthetic import FleetGenerator
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark function under the given name."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def benchmark_database():
+    """Creates a test database for the duration of the block and destroys it afterwards."""
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def reset_benchmark_state():
+    """
+    Empties the database between benchmarks, plus this process's caches of it:
+    ids start over after the flush, so cached buses, tokens and seqs would
+    leak into the next benchmark.
+    """
+    ingest.reset_ingest_state()  # drains write-behind fixes before the flush
+    call_command('flush', interactive=False, verbosity=0)
+    spatial.reset_bus_index()
+    token_cache.clear()
+    cache.clear()
+
+
+def run_benchmarks(names, params, stdout, style=None):
+    """
+    Runs the named benchmarks one after the other in the current (test)
+    database, emptying it in between. Each gets the params its signature
+    accepts. Returns {name: results}.
+    """
+    results = {}
+    for index, name in enumerate(names):
+        func = BENCHMARKS[name]
+        accepted = inspect.signature(func).parameters
+        stdout.write(style.MIGRATE_HEADING(name) if style else name)
+        if index:
+            reset_benchmark_state()
+        results[name] = func(stdout, **{key: value for key, value in params.items() if key in accepted}) or {}
+    return results
+
+
+def seed_fleet(buses=1):
+    """Creates one school and `buses` buses, each with its own driver. Returns the buses."""
+    school = School.objects.create(name='Benchmark School', address='Muscat', latitude=23.5880, longitude=58.3829)
+    fleet = []
+    for i in range(buses):
+        driver = CustomUser.objects.create(username=f'bench_driver{i}', role='driver', school=school)
+        fleet.append(Bus.objects.create(bus_number=f'BENCH-{i:05d}', driver=driver, school=school, capacity=50))
+    return fleet
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else float('inf')
+
+
+# Metric name suffix -> +1 if higher is better, -1 if lower is better, and the
+# smallest absolute change that counts (timings below it are noise)
+METRIC_DIRECTIONS = {
+    '_per_sec': (1, 0),
+    '_per_second': (1, 0),
+    '_rps': (1, 0),
+    '_ms': (-1, 0.5),
+    '_seconds': (-1, 0.01),
+    '_queries': (-1, 0),
+    '_peak_kb': (-1, 64),
+}
+
+
+def metric_direction(name):
+    for suffix, direction in METRIC_DIRECTIONS.items():
+        if name.endswith(suffix):
+            return direction
+    return None
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Compares two {benchmark: {metric: value}} dicts. Returns a list of
+    (benchmark, metric, baseline value, current value, relative change, regressed)
+    for every comparable metric present in both; a positive change is always worse.
+    """
+    rows = []
+    for name, metrics in current.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            direction = metric_direction(metric)
+            if direction is None or not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            sign, noise = direction
+            worse_by = (old - value) * sign  # > 0 when the metric got worse
+            change = worse_by / abs(old) if old else (float('inf') if worse_by > 0 else 0.0)
+            rows.append((name, metric, old, value, change, change > threshold and worse_by > noise))
+    return rows
+
+
+@benchmark('ingest_formats')
+def ingest_formats(stdout, fixes=20000, batch=100, write_behind=0):
+    """
+    Fixes/sec through one worker for the JSON batch endpoint, the binary batch
+    endpoint and single-fix JSON post_location, plus decode-only rates for the two
+    batch formats. With write_behind=1 the database write is taken off the
+    request path.
+    """
+    bus = seed_fleet(1)[0]
+    client = Client()
+    client.force_login(bus.driver)
+    base_ms = int(time.time() * 1000) - fixes * 3 * 1000
+    results = {}
+
+    def points(offset, count):
+        return [
+            (base_ms + (offset + i) * 1000, 23.58 + random.random() / 100, 58.38 + random.random() / 100,
+             random.uniform(0, 80), random.uniform(0, 360), offset + i)
+            for i in range(count)
+        ]
+
+    def chunks(items):
+        return [items[i:i + batch] for i in range(0, len(items), batch)]
+
+    conf = {**ingest.ingest_settings(), 'WRITE_BEHIND': bool(write_behind), 'SPOOL_DIR': None,
+            'FLUSH_SIZE': 10 ** 9, 'FLUSH_INTERVAL_MS': 10 ** 9}
+    with override_settings(LOCATION_INGEST=conf):
+        json_bodies = [json.dumps({'fixes': [
+            {'timestamp': ts, 'latitude': lat, 'longitude': lng, 'speed': speed, 'heading': heading, 'seq': seq}
+            for ts, lat, lng, speed, heading, seq in chunk
+        ]}) for chunk in chunks(points(0, fixes))]
+        url = f'/api/bus-trips/{bus.id}/post_locations/'
+        started = time.perf_counter()
+        for body in json_bodies:
+            client.post(url, body, content_type='application/json')
+        results['json_batch_fixes_per_sec'] = rate(fixes, time.perf_counter() - started)
+
+        binary_bodies = [
+            b''.join(ingest.BINARY_FIX.pack(*point) for point in chunk)
+            for chunk in chunks(points(fixes, fixes))
+        ]
+        url = f'/api/bus-trips/{bus.id}/post_locations_binary/'
+        started = time.perf_counter()
+        for body in binary_bodies:
+            client.post(url, body, content_type=ingest.BINARY_CONTENT_TYPE)
+        results['binary_batch_fixes_per_sec'] = rate(fixes, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for body in json_bodies:
+            [ingest.fix_from_data(bus.id, item) for item in json.loads(body)['fixes']]
+        results['json_decode_fixes_per_sec'] = rate(fixes, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for body in binary_bodies:
+            ingest.fixes_from_binary(bus.id, body)
+        results['binary_decode_fixes_per_sec'] = rate(fixes, time.perf_counter() - started)
+
+        singles = points(2 * fixes, min(fixes, 2000))
+        url = f'/api/bus-trips/{bus.id}/post_location/'
+        started = time.perf_counter()
+        for ts, lat, lng, speed, heading, seq in singles:
+            client.post(url, {'timestamp': ts, 'latitude': lat, 'longitude': lng, 'speed': speed, 'seq': seq})
+        results['json_single_fixes_per_sec'] = rate(len(singles), time.perf_counter() - started)
+
+        if write_behind:
+            ingest.get_location_buffer().flush()
+
+    for key, value in results.items():
+        stdout.write(f'  {key:<32} {value:>12,.0f}')
+    stdout.write(f'  {"binary/json endpoint speedup":<32} {results["binary_batch_fixes_per_sec"] / results["json_batch_fixes_per_sec"]:>11.2f}x')
+    stdout.write(f'  {"binary/json decode speedup":<32} {results["binary_decode_fixes_per_sec"] / results["json_decode_fixes_per_sec"]:>11.2f}x')
+    return results
+
+
+@benchmark('auth')
+def auth(stdout, requests=200, basic_requests=10):
+    """
+    Per-request authentication cost of Basic auth (password hash check) versus
+    device tokens (cold and cached), and end-to-end post_location cost for both.
+    """
+    bus = seed_fleet(1)[0]
+    driver = bus.driver
+    driver.set_password('bench-password-1')
+    driver.save()
+    _, key = issue_device_token(driver, bus)
+    basic_header = 'Basic ' + base64.b64encode(f'{driver.username}:bench-password-1'.encode()).decode()
+    device_header = f'Device {key}'
+    factory = RequestFactory()
+    results = {}
+
+    def per_request_ms(authenticator, header, count, cold=False):
+        request = factory.post('/', HTTP_AUTHORIZATION=header)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(count):
+                if cold:
+                    token_cache.clear()
+                authenticator.authenticate(request)
+            elapsed = time.perf_counter() - started
+        return elapsed / count * 1000, len(queries) / count
+
+    results['basic_auth_ms'], results['basic_auth_queries'] = per_request_ms(BasicAuthentication(), basic_header, basic_requests)
+    results['device_cold_ms'], results['device_cold_queries'] = per_request_ms(DeviceTokenAuthentication(), device_header, requests, cold=True)
+    results['device_cached_ms'], results['device_cached_queries'] = per_request_ms(DeviceTokenAuthentication(), device_header, requests)
+
+    conf = {**ingest.ingest_settings(), 'WRITE_BEHIND': True, 'SPOOL_DIR': None,
+            'FLUSH_SIZE': 10 ** 9, 'FLUSH_INTERVAL_MS': 10 ** 9}
+    client = Client()
+    url = f'/api/bus-trips/{bus.id}/post_location/'
+    with override_settings(LOCATION_INGEST=conf):
+        for label, header, count in (('basic', basic_header, basic_requests), ('device', device_header, requests)):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for i in range(count):
+                    client.post(url, {'latitude': 23.58, 'longitude': 58.38}, HTTP_AUTHORIZATION=header)
+                elapsed = time.perf_counter() - started
+            results[f'post_location_{label}_ms'] = elapsed / count * 1000
+            results[f'post_location_{label}_queries'] = len(queries) / count
+        ingest.get_location_buffer().flush()
+
+    for key, value in results.items():
+        stdout.write(f'  {key:<32} {value:>12.3f}')
+    stdout.write(f'  {"basic/device (cached) auth cost":<32} {results["basic_auth_ms"] / results["device_cached_ms"]:>11,.0f}x')
+    return results
+
+
+@benchmark('dashboard')
+def dashboard(stdout, requests=30, buses=50, students=20):
+    """
+    Server time and queries per request for the dashboard and tracking pages,
+    per role, with a cold fragment cache (everything rendered) and a warm one.
+    """
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+        fleet = seed_fleet(buses)
+        school = fleet[0].school
+        admin = CustomUser.objects.create(username='bench_admin', role='admin', school=school)
+        parent = CustomUser.objects.create(username='bench_parent', role='parent', school=school)
+        for i, bus in enumerate(fleet):
+            route = Route.objects.create(name=f'Route {i}', school=school, bus=bus,
+                                         stops=[{'lat': 23.58 + j / 1000, 'lng': 58.38} for j in range(10)])
+            Student.objects.bulk_create([
+                Student(first_name=f'Student{j}', last_name=f'Bus{i}', school=school, assigned_route=route,
+                        parent=parent if j == 0 else None)
+                for j in range(students)
+            ])
+        Concern.objects.bulk_create([Concern(raised_by=parent, subject=f'Concern {i}', description='...') for i in range(20)])
+        Notification.objects.bulk_create([
+            Notification(subject=f'Notice {i}', message='...', recipient_group='all') for i in range(20)
+        ])
+        users = {'admin': admin, 'parent': parent, 'driver': fleet[0].driver}
+        results = {}
+
+        for role, user in users.items():
+            client = Client()
+            client.force_login(user)
+            for page, url in (('dashboard', '/'), ('tracking', '/bus-tracking/')):
+                client.get(url)  # warm up URL resolving, template loading and the session
+                for label in ('cold', 'warm'):
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        for _ in range(requests):
+                            if label == 'cold':
+                                cache.clear()
+                            client.get(url)
+                        elapsed = time.perf_counter() - started
+                    results[f'{role}_{page}_{label}_ms'] = elapsed / requests * 1000
+                    results[f'{role}_{page}_{label}_queries'] = len(queries) / requests
+
+    stdout.write(f'  {"role/page":<20} {"cold ms":>10} {"warm ms":>10} {"cold q":>8} {"warm q":>8}')
+    for role in users:
+        for page in ('dashboard', 'tracking'):
+            prefix = f'{role}_{page}'
+            stdout.write(
+                f'  {role + "/" + page:<20} {results[prefix + "_cold_ms"]:>10.2f} {results[prefix + "_warm_ms"]:>10.2f}'
+                f' {results[prefix + "_cold_queries"]:>8.1f} {results[prefix + "_warm_queries"]:>8.1f}'
+            )
+    return results
+
+
+@benchmark('routing')
+def routing_plan(stdout, students=2000, buses=50, capacity=50, schools=4, workers=1):
+    """
+    Route optimizer time for one school with `students` pickups, and for
+    `schools` such schools solved serially and with `workers` processes.
+    """
+    rng = random.Random(42)
+    depot = (23.5880, 58.3829)
+
+    def problem(school_id):
+        stops = [
+            routing.PlanStop(depot[0] + rng.gauss(0, 0.04), depot[1] + rng.gauss(0, 0.04), [school_id * students + i])
+            for i in range(students)
+        ]
+        return routing.SchoolProblem(school_id, depot, [routing.PlanBus(b, capacity) for b in range(buses)], stops)
+
+    results = {}
+    single = problem(0)
+    started = time.perf_counter()
+    plan = routing.solve(single)
+    results['one_school_seconds'] = time.perf_counter() - started
+    used = [route for route in plan.routes if route.stops]
+    results['buses_used'] = len(used)
+    results['unassigned_students'] = sum(len(stop.student_ids) for stop in plan.unassigned)
+    results['total_km'] = sum(route.distance_m for route in used) / 1000
+
+    # Nearest-neighbour only, to show what the 2-opt/Or-opt passes buy
+    chunks, _ = routing.sweep(routing.project([(s.lat, s.lng) for s in single.stops], depot),
+                              [1] * len(single.stops), [capacity] * buses)
+    nn_total = 0.0
+    for chunk in chunks:
+        xy = routing.project([depot] + [(single.stops[i].lat, single.stops[i].lng) for i in chunk], depot)
+        matrix = routing.distance_matrix(xy)
+        dist = [[0.0] * (len(xy) + 1)] + [[0.0] + row for row in matrix]
+        nn_total += routing.path_length(routing.nearest_neighbour(dist, 0, 1, range(2, len(xy) + 1)), dist)
+    results['nearest_neighbour_km'] = nn_total / 1000
+
+    problems = [problem(i) for i in range(schools)]
+    started = time.perf_counter()
+    routing.optimize_many(problems, workers=1)
+    results['schools_serial_seconds'] = time.perf_counter() - started
+    if workers > 1:
+        started = time.perf_counter()
+        routing.optimize_many(problems, workers=workers)
+        results['schools_parallel_seconds'] = time.perf_counter() - started
+
+    for key, value in results.items():
+        stdout.write(f'  {key:<32} {value:>12,.2f}')
+    return results
+
+
+@benchmark('clustering')
+def clustering(stdout, students=20000, towns=12, max_walk=400, capacity=50):
+    """
+    Pickup clustering for a district: `students` homes spread over `towns`
+    towns (plus 10% rural) in a 40 km square, merged into shared stops.
+    """
+    rng = random.Random(7)
+    centre = (23.5880, 58.3829)
+    degrees = 20000 / 111000
+    centres = [(centre[0] + rng.uniform(-degrees, degrees), centre[1] + rng.uniform(-degrees, degrees)) for _ in range(towns)]
+    stops = []
+    for student_id in range(students):
+        if rng.random() < 0.1:
+            lat, lng = centre[0] + rng.uniform(-degrees, degrees), centre[1] + rng.uniform(-degrees, degrees)
+        else:
+            town = rng.choice(centres)
+            lat, lng = town[0] + rng.gauss(0, 0.01), town[1] + rng.gauss(0, 0.01)
+        stops.append(routing.PlanStop(lat, lng, [student_id]))
+
+    started = time.perf_counter()
+    merged = routing.cluster_stops(stops, max_walk, capacity)
+    seconds = time.perf_counter() - started
+
+    by_student = {stop.student_ids[0]: stop for stop in stops}
+    walks = []
+    for stop in merged:
+        xy = routing.project([(by_student[i].lat, by_student[i].lng) for i in stop.student_ids], (stop.lat, stop.lng))
+        walks.extend(math.hypot(x, y) for x, y in xy)
+    results = {
+        'students': students,
+        'stops': len(merged),
+        'seconds': seconds,
+        'students_per_stop': students / len(merged),
+        'largest_stop': max(len(stop.student_ids) for stop in merged),
+        'mean_walk_m': sum(walks) / len(walks),
+        'max_walk_m': max(walks),
+    }
+    for key, value in results.items():
+        stdout.write(f'  {key:<32} {value:>12,.2f}')
+    return results
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+@benchmark('spatial')
+def spatial_index(stdout, buses=5000, queries=2000, k=5, radius_m=2000, seconds=3, update_hz=1):
+    """
+    Spatial index query latency while every one of `buses` buses (spread over
+    a 60 km square) moves `update_hz` times a second, against a linear scan.
+    """
+    rng = random.Random(11)
+    centre = (23.5880, 58.3829)
+    spread = 30000 / spatial.METRES_PER_DEG
+    index = spatial.BusIndex(spatial.spatial_settings()['CELL_DEG'])
+    positions = {
+        bus_id: [centre[0] + rng.uniform(-spread, spread), centre[1] + rng.uniform(-spread, spread)]
+        for bus_id in range(buses)
+    }
+    for bus_id, (lat, lng) in positions.items():
+        index.update(bus_id, lat, lng, None)
+
+    stop = threading.Event()
+    updates = [0]
+
+    def mover():
+        # Each tick moves every bus ~10 m, spread evenly over the tick like real 1 Hz devices
+        interval = 1 / (update_hz * buses)
+        step = 10 / spatial.METRES_PER_DEG
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            for bus_id, position in positions.items():
+                position[0] += rng.uniform(-step, step)
+                position[1] += rng.uniform(-step, step)
+                index.update(bus_id, position[0], position[1], None)
+                updates[0] += 1
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0.001:
+                    time.sleep(delay)
+                if stop.is_set():
+                    break
+
+    def query_point():
+        return centre[0] + rng.uniform(-spread, spread), centre[1] + rng.uniform(-spread, spread)
+
+    def timed(func, count):
+        latencies = []
+        for _ in range(count):
+            point = query_point()
+            started = time.perf_counter()
+            func(*point)
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    def scan_nearest(lat, lng):
+        return sorted((haversine_m((lat, lng), tuple(p)), bus_id) for bus_id, p in list(positions.items()))[:k]
+
+    thread = threading.Thread(target=mover, daemon=True)
+    started = time.perf_counter()
+    thread.start()
+    nearest = timed(lambda lat, lng: index.nearest(lat, lng, k), queries)
+    within = timed(lambda lat, lng: index.within(lat, lng, radius_m), queries)
+    scan = timed(scan_nearest, max(queries // 20, 10))
+    remaining = seconds - (time.perf_counter() - started)
+    if remaining > 0:
+        time.sleep(remaining)
+    stop.set()
+    thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = {
+        'updates_per_second': updates[0] / elapsed,
+        'nearest_p50_ms': percentile(nearest, 0.5),
+        'nearest_p99_ms': percentile(nearest, 0.99),
+        'within_p50_ms': percentile(within, 0.5),
+        'within_p99_ms': percentile(within, 0.99),
+        'linear_scan_p50_ms': percentile(scan, 0.5),
+    }
+    for key, value in results.items():
+        stdout.write(f'  {key:<32} {value:>12,.3f}')
+    return results
+
+
+def measure(results, name, func, repeat=1):
+    """
+    Records {name}_ms and {name}_queries per call of func over `repeat` calls,
+    then {name}_peak_kb: the peak Python memory allocated during one more call
+    (traced separately, since tracemalloc slows everything down).
+    """
+    func()  # warm up URL resolving, templates and caches that are not part of the measurement
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = time.perf_counter() - started
+    results[f'{name}_ms'] = elapsed / repeat * 1000
+    results[f'{name}_queries'] = len(queries) / repeat
+
+    tracemalloc.start()
+    try:
+        func()
+        results[f'{name}_peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark('hot_paths')
+def hot_paths(stdout, buses=50, students=1000, days=1, fix_interval=10, repeat=10, page_length=50):
+    """
+    Wall time, query count and peak memory per request for location ingest,
+    location_history, the live-locations list, the dashboard per role and the
+    management lists, on a seeded synthetic fleet (core/synthetic.py) of the
+    given size.
+    """
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+        FleetGenerator(prefix='BENCH', schools=max(buses // 20, 1), buses=buses, students=students, days=days,
+                       fix_interval_s=fix_interval, seed=1).run()
+        bus = Bus.objects.filter(bus_number__startswith='BENCH-').select_related('driver', 'school').order_by('id').first()
+        admin = CustomUser.objects.create(username='bench_admin', role='admin', school=bus.school,
+                                          is_staff=True, is_superuser=True)
+        parent = CustomUser.objects.filter(role='parent', children__assigned_route__bus=bus).first()
+        users = {'admin': admin, 'parent': parent, 'driver': bus.driver}
+        clients = {}
+        for role, user in users.items():
+            clients[role] = Client(raise_request_exception=False)
+            clients[role].force_login(user)
+        _, key = issue_device_token(bus.driver, bus)
+        device = Client()
+        results = {}
+
+        # Ingest: one fix, and a batch of 100, through device-token auth and synchronous writes
+        seq = iter(range(10 ** 9))
+        fix_url = f'/api/bus-trips/{bus.id}/post_location/'
+        batch_url = f'/api/bus-trips/{bus.id}/post_locations/'
+        with override_settings(LOCATION_INGEST={**ingest.ingest_settings(), 'WRITE_BEHIND': False, 'SPOOL_DIR': None}):
+            measure(results, 'ingest_single', lambda: device.post(
+                fix_url, {'latitude': 23.58, 'longitude': 58.38, 'seq': next(seq)},
+                content_type='application/json', HTTP_AUTHORIZATION=f'Device {key}',
+            ), repeat)
+            measure(results, 'ingest_batch100', lambda: device.post(
+                batch_url, {'fixes': [{'latitude': 23.58, 'longitude': 58.38, 'seq': next(seq)} for _ in range(100)]},
+                content_type='application/json', HTTP_AUTHORIZATION=f'Device {key}',
+            ), repeat)
+
+        history_url = f'/api/bus-trips/{bus.id}/location_history/?hours={24 * (days + 1)}'
+        measure(results, 'location_history', lambda: clients['admin'].get(history_url), max(repeat // 5, 1))
+
+        for role in ('admin', 'parent', 'driver'):
+            def dashboard():
+                cache.clear()  # every fragment rendered, as on the first view after a change
+                clients[role].get('/')
+            measure(results, f'dashboard_{role}', dashboard, repeat)
+
+        for page in ('users', 'students', 'buses', 'routes'):
+            measure(results, f'manage_{page}_page', lambda: clients['admin'].get(f'/manage-{page}/'), repeat)
+            measure(results, f'manage_{page}_data', lambda: clients['admin'].get(
+                f'/manage-{page}/data/', {'draw': 1, 'start': 0, 'length': page_length}), repeat)
+
+        for role in ('admin', 'parent', 'driver'):
+            measure(results, f'live_locations_{role}', lambda: clients[role].get('/api/live-bus-locations/'), repeat)
+
+    stdout.write(f'  {"path":<28} {"ms":>10} {"queries":>8} {"peak KB":>10}')
+    for name in dict.fromkeys(key.rsplit('_', 1)[0] for key in results if key.endswith('_ms')):
+        stdout.write(
+            f'  {name:<28} {results[name + "_ms"]:>10.2f} {results[name + "_queries"]:>8.1f} {results[name + "_peak_kb"]:>10,.0f}'
+        )
+    return results
@@ -0,0 +1,394 @@
+# core/bulk_import.py
+"""
+Background bulk import and streaming export for the admin's import-export
+resources (CustomUserResource, BusResource, ...).
+
+django-import-export imports one row at a time. For each row it looks the
+instance up by the resource's import_id_fields, then saves it, so a
+20k-student CSV makes tens of thousands of queries inside one request.
+BulkImporter reads the same CSV columns as that resource but works in bulk:
+- all existing rows are loaded once, keyed by import_id_fields, with the
+  columns being imported; so are the ids each foreign key column may refer to;
+- every CSV row is diffed against that map in memory, giving new, changed
+  and unchanged rows;
+- the new and changed rows are written with bulk_create/bulk_update, BATCH_SIZE
+  rows per transaction. The job's progress is saved after each batch.
+
+The file is read twice and never held in memory. The first pass validates
+every row and counts the changes. If any row is invalid the job fails there
+and nothing is written, as with import-export, and the first MAX_ERRORS errors
+are kept on the job. A dry run stops after this pass. The second pass writes
+the changes. If the database rejects a batch on the second pass (a unique
+constraint the CSV breaks, say), the earlier batches stay written.
+Rerunning the job after fixing the file is safe, because rows already
+imported come out unchanged.
+
+Columns and values follow import-export's CSV format. A foreign key column
+holds the related id, booleans are 1/0, and times are local. Columns missing
+from the file leave their fields as they are. A key that appears twice in the
+file is an error. A row whose key matches several existing rows is an error too
+(Route names are only unique per school). bulk_create and bulk_update send no
+signals, so the signal receivers' effects (fragment versions, the device token
+cache) are applied once per job instead. Users created by an import get an
+unusable password and set one through password reset.
+
+A job created by a school-bound user (core/tenancy.py) imports into that
+school only. Its keys match only the school's rows, and a unique key held by
+another school's row is an error. Foreign keys may only refer to the
+school's rows. Created rows get the school.
+
+Jobs are BulkImportJob rows. The admin's "Bulk import" page uploads the file
+and runs the job in a thread of the worker that received it. `manage.py
+bulk_import` runs a file or an existing job in the foreground. The admin's
+"Stream CSV" link exports the filtered changelist with the same columns, and
+reads the rows with an iterator instead of building a dataset in memory.
+"""
+import csv
+import gzip
+import io
+import threading
+import traceback
+from datetime import date, datetime, time as dt_time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, models, transaction
+from django.utils import timezone
+
+from core import fragments
+from core.tenancy import for_school, school_of, school_path
+from core.archive import GZIP_MAGIC
+from core.authentication import token_cache
+from core.models import Bus, BulkImportJob, Concern, CustomUser, Notification, Route, Student
+from core.synthetic import batched
+
+DEFAULTS = {
+    'BATCH_SIZE': 1000,
+    'MAX_ERRORS': 50,
+    'EXPORT_CHUNK_SIZE': 2000,
+}
+
+BOOLEAN_VALUES = {'1': True, 'true': True, 'yes': True, '0': False, 'false': False, 'no': False}
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # import-export's default rendering, in local time
+
+# Models whose post_save receivers in core/signals.py bump these fragment groups
+FRAGMENT_GROUPS = {Bus: ('stats', 'activity'), Route: ('stats', 'activity'), Student: ('stats', 'activity'),
+                   Concern: ('stats', 'activity'), Notification: ('stats', 'activity')}
+
+
+def bulk_import_settings():
+    return {**DEFAULTS, **getattr(settings, 'BULK_IMPORT', {})}
+
+
+def resource_for(model):
+    """The import-export resource class of the model's admin, or None."""
+    try:
+        model_admin = admin.site.get_model_admin(model)
+    except admin.sites.NotRegistered:
+        return None
+    return getattr(model_admin, 'resource_class', None)
+
+
+class RowError(Exception):
+    """A row (or the header) that cannot be imported."""
+
+
+class BulkImporter:
+    """Applies a CSV to a resource's model as described in the module docstring."""
+
+    def __init__(self, resource_class, batch_size=None, max_errors=None, progress=None, school_id=None):
+        conf = bulk_import_settings()
+        self.model = resource_class._meta.model
+        self.school_id = school_id  # import into this school only; None for every school
+        self.batch_size = batch_size or conf['BATCH_SIZE']
+        self.max_errors = max_errors or conf['MAX_ERRORS']
+        self.progress = progress  # called with (phase, rows done) after each batch
+        opts = self.model._meta
+        self.key_fields = [opts.get_field(name) for name in resource_class._meta.import_id_fields]
+        self.fields = [
+            opts.get_field(name) for name in resource_class._meta.fields
+            if name not in resource_class._meta.import_id_fields and not opts.get_field(name).primary_key
+        ]
+        self.counts = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0}
+        self.errors = []
+        self.error_count = 0
+
+    # -- reading
+
+    def open(self, stream):
+        """DictReader over a binary stream holding a CSV, gzipped or not."""
+        if not hasattr(stream, 'peek'):
+            stream = io.BufferedReader(stream)
+        if stream.peek(2)[:2] == GZIP_MAGIC:
+            stream = gzip.GzipFile(fileobj=stream, mode='rb')
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        header = reader.fieldnames or []
+        missing = [field.name for field in self.key_fields if field.name not in header]
+        if missing:
+            raise RowError(f'The file has no {", ".join(missing)} column (the import key).')
+        self.columns = [field for field in self.fields if field.name in header]
+        return reader
+
+    def load(self):
+        """
+        Existing rows keyed by import key, and the ids each foreign key column
+        may use; only the school's, for a school-bound import.
+        """
+        attnames = [field.attname for field in self.columns]
+        self.existing = {}
+        self.ambiguous = set()
+        self.foreign = set()  # unique keys held by another school's rows
+        path = school_path(self.model) if self.school_id is not None else None
+        if self.school_id is not None and path is None:
+            raise RowError(f'{self.model._meta.verbose_name_plural} cannot be imported into one school.')
+        unique_key = len(self.key_fields) == 1 and self.key_fields[0].unique
+        rows = self.model._default_manager.values_list(
+            'pk', *[field.attname for field in self.key_fields], *attnames, *([path] if path else []),
+        ).iterator(chunk_size=self.batch_size)
+        keys = len(self.key_fields)
+        for row in rows:
+            key = row[1:1 + keys]
+            if path and row[-1] != self.school_id:
+                if unique_key:
+                    self.foreign.add(key)
+                continue
+            if key in self.existing:
+                self.ambiguous.add(key)
+            self.existing[key] = (row[0], row[1 + keys:1 + keys + len(attnames)])
+        self.targets = {}
+        for field in self.key_fields + self.columns:
+            if field.is_relation and field.related_model not in self.targets:
+                targets = field.related_model._default_manager.all()
+                if self.school_id is not None and school_path(field.related_model):
+                    targets = for_school(targets, self.school_id, school_path(field.related_model))
+                self.targets[field.related_model] = set(targets.values_list('pk', flat=True).iterator())
+
+    def parse(self, field, raw):
+        raw = (raw or '').strip()
+        if field.is_relation:
+            if raw == '':
+                if not field.null:
+                    raise RowError(f'{field.name}: this field is required.')
+                return None
+            try:
+                value = field.target_field.to_python(raw)
+            except ValidationError:
+                raise RowError(f'{field.name}: {raw!r} is not an id.')
+            if value not in self.targets[field.related_model]:
+                raise RowError(f'{field.name}: no {field.related_model._meta.verbose_name} with id {raw}.')
+            return value
+        if raw == '':
+            value = None if field.null else ''
+        elif isinstance(field, models.BooleanField):
+            value = BOOLEAN_VALUES.get(raw.lower(), raw)
+        else:
+            value = raw
+        try:
+            value = field.clean(value, None)
+        except ValidationError as e:
+            raise RowError(f'{field.name}: {" ".join(e.messages)}')
+        if isinstance(field, models.DateTimeField) and value is not None and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def diff(self, record):
+        """(kind, key, pk, values) for one CSV row; kind is 'create', 'update' or 'unchanged'."""
+        if self.key_fields[0].primary_key and not (record.get(self.key_fields[0].name) or '').strip():
+            key = None  # no id: always a new row
+        else:
+            key = tuple(self.parse(field, record.get(field.name)) for field in self.key_fields)
+            if None in key or '' in key:
+                raise RowError(f'{self.key_label} is required.')
+            if key in self.ambiguous:
+                raise RowError(f'{self.key_label} {self.key_text(key)} matches several existing rows.')
+            if key in self.foreign:
+                raise RowError(f'{self.key_label} {self.key_text(key)} belongs to another school.')
+        values = tuple(self.parse(field, record.get(field.name)) for field in self.columns)
+        current = self.existing.get(key) if key is not None else None
+        if current is None:
+            return 'create', key, None, values
+        return ('unchanged' if current[1] == values else 'update'), key, current[0], values
+
+    @property
+    def key_label(self):
+        return ', '.join(field.name for field in self.key_fields)
+
+    def key_text(self, key):
+        return ', '.join(map(str, key))
+
+    # -- running
+
+    def validate(self, stream):
+        """First pass; counts the changes and returns True if every row is valid."""
+        reader = self.open(stream)
+        self.load()
+        seen = {}  # key -> line, so that a repeated key is an error
+        records = ((reader.line_num, record) for record in reader)
+        for batch in batched(records, self.batch_size):
+            for line, record in batch:
+                self.counts['rows'] += 1
+                try:
+                    kind, key, _, _ = self.diff(record)
+                    if key is not None and key in seen:
+                        raise RowError(f'{self.key_label} {self.key_text(key)} is repeated from line {seen[key]}.')
+                except RowError as e:
+                    self.error_count += 1
+                    if len(self.errors) < self.max_errors:
+                        self.errors.append({'line': line, 'error': str(e)})
+                    continue
+                if key is not None:
+                    seen[key] = line
+                self.counts[{'create': 'created', 'update': 'updated', 'unchanged': 'unchanged'}[kind]] += 1
+            if self.progress:
+                self.progress('validating', self.counts['rows'])
+        return not self.error_count
+
+    def apply(self, stream):
+        """
+        Second pass: writes the changes validate() found. Every key occurs
+        once in a valid file, so the map loaded by validate() still holds.
+        """
+        reader = self.open(stream)
+        key_attnames = [field.attname for field in self.key_fields]
+        attnames = [field.attname for field in self.columns]
+        password = make_password(None) if self.model is CustomUser else None
+        school_id = self.school_id if school_path(self.model) == 'school_id' else None
+        done = 0
+        for batch in batched(reader, self.batch_size):
+            creates, updates = [], []
+            for record in batch:
+                kind, key, pk, values = self.diff(record)
+                if kind == 'unchanged':
+                    continue
+                instance = self.model(**dict(zip(attnames, values)))
+                if kind == 'update':
+                    instance.pk = pk
+                    updates.append(instance)
+                    continue
+                for attname, value in zip(key_attnames, key or ()):
+                    setattr(instance, attname, value)
+                if password is not None:
+                    instance.password = password
+                if school_id is not None:
+                    instance.school_id = school_id
+                creates.append(instance)
+            with transaction.atomic():
+                if creates:
+                    self.model._default_manager.bulk_create(creates)
+                if updates and self.columns:
+                    self.model._default_manager.bulk_update(updates, [field.name for field in self.columns])
+            done += len(batch)
+            if self.progress:
+                self.progress('importing', done)
+        self.after_import()
+
+    def after_import(self):
+        """What core/signals.py's post_save receivers would have done, once."""
+        if not (self.counts['created'] or self.counts['updated']):
+            return
+        groups = FRAGMENT_GROUPS.get(self.model)
+        if groups:
+            fragments.bump(*groups, school_id=self.school_id)
+        if self.model in (Bus, CustomUser) and self.counts['updated']:
+            token_cache.clear()  # drivers or bus bindings may have changed
+
+
+def run_job(job_id, batch_size=None):
+    """Validates and (unless a dry run) applies a BulkImportJob, saving its progress; returns the job."""
+    job = BulkImportJob.objects.get(pk=job_id)
+    try:
+        resource_class = resource_for(apps.get_model(job.model))
+    except (LookupError, ValueError):
+        resource_class = None
+
+    def save(**fields):
+        for name, value in fields.items():
+            setattr(job, name, value)
+        BulkImportJob.objects.filter(pk=job.pk).update(**fields)
+
+    def progress(phase, rows):
+        if phase == 'validating':
+            save(status=phase, total_rows=rows, processed_rows=0)
+        else:
+            save(status=phase, processed_rows=rows)
+
+    save(status='validating', started_at=timezone.now(), finished_at=None, total_rows=0, processed_rows=0,
+         created=0, updated=0, unchanged=0, errors=[], message='')
+    if resource_class is None:
+        save(status='failed', finished_at=timezone.now(), message=f'{job.model} has no import resource.')
+        return job
+
+    # The job runs outside the request, so bind it to its creator's school here
+    school_id = school_of(job.created_by) if job.created_by is not None else None
+    importer = BulkImporter(resource_class, batch_size=batch_size, progress=progress, school_id=school_id)
+    try:
+        with job.file.open('rb') as stream:
+            valid = importer.validate(stream)
+        counts = {'total_rows': importer.counts['rows'], 'created': importer.counts['created'],
+                  'updated': importer.counts['updated'], 'unchanged': importer.counts['unchanged']}
+        if not valid:
+            save(status='failed', finished_at=timezone.now(), errors=importer.errors, **counts,
+                 message=f'{importer.error_count} invalid row(s); nothing was imported.')
+            return job
+        if job.dry_run:
+            save(status='done', finished_at=timezone.now(), processed_rows=counts['total_rows'], **counts,
+                 message='Dry run: nothing was written.')
+            return job
+        save(status='importing', **counts)
+        with job.file.open('rb') as stream:
+            importer.apply(stream)
+        save(status='done', finished_at=timezone.now(), processed_rows=counts['total_rows'])
+    except RowError as e:
+        save(status='failed', finished_at=timezone.now(), message=str(e))
+    except Exception as e:
+        save(status='failed', finished_at=timezone.now(),
+             message=f'{type(e).__name__}: {e} ({job.processed_rows} rows were written before it)\n'
+                     + traceback.format_exc(limit=5))
+    return job
+
+
+def start_job(job):
+    """Runs the job in a daemon thread of this process; returns immediately."""
+    def target():
+        close_old_connections()
+        try:
+            run_job(job.pk)
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=target, name=f'bulk-import-{job.pk}', daemon=True).start()
+
+
+def render_value(value):
+    """A value as import-export renders it in CSV."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, datetime):
+        return (timezone.localtime(value) if timezone.is_aware(value) else value).strftime(DATETIME_FORMAT)
+    if isinstance(value, (date, dt_time)):
+        return value.isoformat()
+    return value
+
+
+def export_chunks(resource_class, queryset, chunk_size=None):
+    """CSV byte chunks of the resource's columns for every row of the queryset."""
+    chunk_size = chunk_size or bulk_import_settings()['EXPORT_CHUNK_SIZE']
+    opts = resource_class._meta.model._meta
+    names = list(resource_class._meta.fields)
+    attnames = [opts.get_field(name).attname for name in names]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    rows = queryset.values_list(*attnames).iterator(chunk_size=chunk_size)
+    for batch in batched(rows, chunk_size):
+        writer.writerows([render_value(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()  # header of an empty export
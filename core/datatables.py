@@ -0,0 +1,120 @@
+# core/datatables.py
+"""
+Server-side processing for DataTables (https://datatables.net/manual/server-side).
+
+The browser asks for one page at a time (draw, start, length, search[value],
+order[0][column], order[0][dir]) and gets back {draw, recordsTotal,
+recordsFiltered, data}. Paging is keyset based where possible: every response
+carries a signed `next_cursor` holding the sort key of its last row, and
+static/js/server-datatable.js sends it back when the user moves to the next
+page, so the query seeks with WHERE (col, id) > (value, id) instead of
+scanning OFFSET rows. Jumping to an arbitrary page, or sorting on a column that
+can be NULL, falls back to OFFSET.
+"""
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core import signing
+from django.db.models import Q
+from django.http import JsonResponse
+from django.views import View
+
+MAX_PAGE_LENGTH = 500
+CURSOR_SALT = 'core.datatables.cursor'
+
+
+class Column:
+    """One table column: the ORM path it sorts on (None = not sortable) and whether it can seek by keyset."""
+
+    def __init__(self, order_field=None, keyset=False):
+        self.order_field = order_field
+        self.keyset = keyset
+
+
+class DataTablesView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Subclasses set `columns`, `search_fields`, implement `get_queryset()`
+    (with select_related for whatever render_row touches) and `render_row(obj)`
+    returning a list of HTML-safe cell strings.
+    """
+    columns = []
+    search_fields = []
+    default_order = 0
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def render_row(self, obj):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        params = request.GET
+        try:
+            draw = int(params.get('draw', 0))
+            start = max(int(params.get('start', 0)), 0)
+            length = int(params.get('length', 25))
+            order_index = int(params.get('order[0][column]', self.default_order))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid paging parameters.'}, status=400)
+        length = MAX_PAGE_LENGTH if length < 0 else min(length, MAX_PAGE_LENGTH)
+        descending = params.get('order[0][dir]') == 'desc'
+        search = params.get('search[value]', '').strip()
+
+        if not 0 <= order_index < len(self.columns) or self.columns[order_index].order_field is None:
+            order_index = self.default_order
+        column = self.columns[order_index]
+
+        queryset = self.get_queryset()
+        records_total = queryset.count()
+        if search and self.search_fields:
+            condition = Q()
+            for field in self.search_fields:
+                condition |= Q(**{f'{field}__icontains': search})
+            queryset = queryset.filter(condition)
+            records_filtered = queryset.count()
+        else:
+            records_filtered = records_total
+
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{column.order_field}', f'{prefix}pk')
+
+        # The cursor is only valid for the exact order/search it was issued for
+        view_key = [order_index, descending, search]
+        cursor = self._load_cursor(params.get('cursor'))
+        if column.keyset and cursor and cursor['view'] == view_key and cursor['start'] == start:
+            value, pk = cursor['value'], cursor['pk']
+            op = 'lt' if descending else 'gt'
+            page = queryset.filter(
+                Q(**{f'{column.order_field}__{op}': value}) |
+                Q(**{column.order_field: value, f'pk__{op}': pk})
+            )[:length]
+        else:
+            page = queryset[start:start + length]
+        page = list(page)
+
+        data = {
+            'draw': draw,
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'data': [self.render_row(obj) for obj in page],
+        }
+        if column.keyset and page and start + length < records_filtered:
+            data['next_start'] = start + length
+            data['next_cursor'] = signing.dumps({
+                'view': view_key,
+                'start': start + length,
+                'value': self._resolve(page[-1], column.order_field),
+                'pk': page[-1].pk,
+            }, salt=CURSOR_SALT, compress=True)
+        return JsonResponse(data)
+
+    def _load_cursor(self, token):
+        if not token:
+            return None
+        try:
+            return signing.loads(token, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+
+    def _resolve(self, obj, path):
+        for attr in path.split('__'):
+            obj = getattr(obj, attr)
+        return obj
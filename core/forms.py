@@ -25,4 +25,8 @@ class ConcernForm(forms.ModelForm):
             if isinstance(field.widget, forms.widgets.CheckboxInput):
                 field.widget.attrs['class'] = 'form-check-input'
             if isinstance(field.widget, forms.widgets.ClearableFileInput):
-                field.widget.attrs['class'] = 'form-control-file'
\ No newline at end of file
+                field.widget.attrs['class'] = 'form-control-file'
+
+class BulkImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV in the same format as the Export button writes; .csv.gz is fine too.")
+    dry_run = forms.BooleanField(required=False, help_text="Only check the file and count the changes.")
@@ -0,0 +1,86 @@
+# core/fragments.py
+"""
+Keys for the {% cache %} fragments on the dashboard and tracking pages.
+
+Each fragment group has a version stored in the default cache, and the
+version is part of every fragment key. core/signals.py bumps a group's version
+when one of the models it renders is saved or deleted. Old fragments are then
+never read again and expire on their own TTL. The groups are:
+
+  schools   school markers; changes about once a year
+  stats     the stats cards, per admin school or per parent/driver
+  activity  recent concerns/notifications and the driver's bus panel; also on
+            a short TTL, since some of it depends on the clock
+
+Versions are namespaced per school (core/tenancy.py). A fragment's version
+combines its group's global version with the version of its namespace: the
+school its user is bound to, or `all` for users who see every school. A
+change to one school's rows bumps that school's namespace and `all`, so the
+other schools keep their fragments. A change with no school, e.g. to a
+School or a bulk import, bumps the global version and with it every
+namespace. A row moved to another school invalidates only its new school's
+fragments; the old school's catch up within their TTL.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.tenancy import school_of
+
+DEFAULT_TTL = {
+    'schools': 24 * 60 * 60,
+    'stats': 5 * 60,
+    'activity': 30,
+}
+
+
+def version_key(group, scope='global'):
+    return f'fragments:version:{group}:{scope}'
+
+
+def namespace(school_id):
+    return 'all' if school_id is None else f'school-{school_id}'
+
+
+def fragment_ttl():
+    return {**DEFAULT_TTL, **getattr(settings, 'FRAGMENT_CACHE_TTL', {})}
+
+
+def fragment_versions(school_id=None):
+    """Current version of every fragment group for a school's namespace (one cache round trip when warm)."""
+    keys = {
+        (group, scope): version_key(group, scope)
+        for group in DEFAULT_TTL for scope in ('global', namespace(school_id))
+    }
+    found = cache.get_many(keys.values())
+    for key in keys.values():
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return {
+        group: f"{found[version_key(group)]}-{found[version_key(group, namespace(school_id))]}"
+        for group in DEFAULT_TTL
+    }
+
+
+def bump(*groups, school_id=None):
+    """Invalidates the groups' fragments for one school (and `all`), or for every school with None."""
+    scopes = ('global',) if school_id is None else (namespace(school_id), namespace(None))
+    # A fresh timestamp rather than incr(): works on every backend and never reuses an old version
+    version = time.time_ns()
+    cache.set_many({version_key(group, scope): version for group in groups for scope in scopes}, timeout=None)
+
+
+def fragment_context(user):
+    """Template context for the cached fragments: versions, TTLs and the per-user scope of each group."""
+    school_id = school_of(user)
+    personal = f'user-{user.pk}'
+    return {
+        'fragment_versions': fragment_versions(school_id),
+        'fragment_ttl': fragment_ttl(),
+        'school_namespace': namespace(school_id),
+        # Admin numbers are the same for everyone in a school; parent/driver ones are personal
+        'stats_scope': f'{user.role}-{namespace(school_id)}' if user.role == 'admin' else personal,
+        'activity_scope': f'{user.role}-{namespace(school_id)}' if user.role == 'admin' else personal,
+    }
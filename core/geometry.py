@@ -0,0 +1,113 @@
+# core/geometry.py
+"""
+Route geometry: Route.stops normalized into a validated polyline with
+precomputed cumulative distances, bounding box and an encoded polyline
+(https://developers.google.com/maps/documentation/utilities/polylinealgorithm).
+
+Geometry depends only on the stops. It is therefore cached under a hash of the
+stops' canonical JSON, and the cache never needs invalidating: edited stops get
+a new hash. Entries expire after CACHE_TIMEOUT, so the geometry of stops that
+were edited away does not pile up in the cache; a route still in use is then
+rebuilt once. RouteViewSet.retrieve also derives its ETag from that hash.
+"""
+import hashlib
+import json
+import math
+
+from django.core.cache import cache
+
+EARTH_RADIUS_M = 6371008.8
+CACHE_PREFIX = 'route-geometry:v1:'
+CACHE_TIMEOUT = 7 * 24 * 3600  # seconds
+POLYLINE_PRECISION = 5
+
+
+def stops_hash(stops):
+    """Content hash of a stops list; equal stops always give the same hash."""
+    canonical = json.dumps(stops, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def parse_coordinate(stop):
+    """(lat, lng) from a {lat, lng}/{latitude, longitude} dict or a [lat, lng] pair, or None."""
+    if isinstance(stop, dict):
+        lat = stop.get('lat', stop.get('latitude'))
+        lng = stop.get('lng', stop.get('lon', stop.get('longitude')))
+    elif isinstance(stop, (list, tuple)) and len(stop) >= 2:
+        lat, lng = stop[0], stop[1]
+    else:
+        return None
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def normalize_stops(stops):
+    """
+    Valid (lat, lng) points of a stops list in order, with consecutive duplicates
+    removed. Returns (points, number of stops dropped as invalid).
+    """
+    points, dropped = [], 0
+    for stop in stops if isinstance(stops, list) else []:
+        point = parse_coordinate(stop)
+        if point is None:
+            dropped += 1
+        elif not points or point != points[-1]:
+            points.append(point)
+    return points, dropped
+
+
+def haversine_m(a, b):
+    lat1, lng1, lat2, lng2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        lat, lng = round(lat * factor), round(lng * factor)
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return ''.join(out)
+
+
+def build_geometry(stops):
+    points, dropped = normalize_stops(stops)
+    cumulative = [0.0]
+    for a, b in zip(points, points[1:]):
+        cumulative.append(cumulative[-1] + haversine_m(a, b))
+    if not points:
+        cumulative = []
+    lats = [lat for lat, _ in points]
+    lngs = [lng for _, lng in points]
+    return {
+        'points': [[lat, lng] for lat, lng in points],
+        'cumulative_m': [round(distance, 1) for distance in cumulative],
+        'length_m': round(cumulative[-1], 1) if cumulative else 0.0,
+        'bbox': [min(lats), min(lngs), max(lats), max(lngs)] if points else None,
+        'encoded': encode_polyline(points),
+        'dropped_stops': dropped,
+    }
+
+
+def route_geometry(stops, digest=None):
+    """Returns (content hash, geometry) for a stops list, computing the geometry at most once per hash."""
+    digest = digest or stops_hash(stops)
+    key = CACHE_PREFIX + digest
+    geometry = cache.get(key)
+    if geometry is None:
+        geometry = build_geometry(stops)
+        cache.set(key, geometry, timeout=CACHE_TIMEOUT)
+    return digest, geometry
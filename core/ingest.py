@@ -0,0 +1,579 @@
+# core/ingest.py
+"""
+Write-behind buffer for bus location fixes.
+
+With LOCATION_INGEST['WRITE_BEHIND'] enabled, post_location only updates the
+in-memory live state and queues the fix; a background thread writes queued
+fixes to the database with bulk_create every FLUSH_SIZE fixes or
+FLUSH_INTERVAL_MS milliseconds, whichever comes first. The queue is drained on
+interpreter shutdown (atexit), which covers gunicorn/runserver graceful stops.
+
+Fixes may carry a per-device sequence number (`seq`). A seq is unique per
+device token, so several devices can report for one bus; fixes sent without a
+token (session or Basic auth) share their bus's seqs. Retried fixes are dropped
+by a small in-memory window of recently seen seqs before they cost a database
+round trip, and at write time by a lookup of the stored seqs, backed by the
+unique_device_location_seq and unique_bus_location_seq constraints. Without
+write-behind, fixes dropped at write time are reported as duplicates too.
+Fixes older than the bus's live state go to history but never move
+Bus.last_known_* backwards. Fixes for buses deleted since they were accepted
+are dropped at write time. A write-behind batch the database rejects (a
+constraint or a value it cannot store) is split until the bad fixes are
+isolated; those are dropped and counted, and the rest is written. Any other
+failed flush (e.g. the database is down) is retried whole on the next tick.
+
+If SPOOL_DIR is set, every accepted fix (live or batch) is also appended to
+the spool in that directory (see core/spool.py). In write-behind mode the spool
+is fsynced before each database flush, so a crash loses at most one flush
+window; `manage.py replay_spool` restores it.
+
+Accepted fixes also move their bus in this process's spatial index
+(core/spatial.py), and are counted in core/ingest_metrics.py along with the
+duration of every database write.
+"""
+import atexit
+import math
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.parsers import BaseParser
+
+from core import rollups
+from core.ingest_metrics import get_ingest_metrics
+from core.models import Bus, BusLocation
+from core.spatial import get_bus_index
+from core.spool import LocationSpool
+
+Fix = namedtuple('Fix', [
+    'bus_id', 'latitude', 'longitude', 'speed', 'heading', 'timestamp',
+    'is_trip_start', 'is_trip_end', 'seq', 'device',
+], defaults=[None, None])
+
+DEFAULTS = {
+    'WRITE_BEHIND': False,
+    'FLUSH_SIZE': 500,
+    'FLUSH_INTERVAL_MS': 1000,
+    'SPOOL_DIR': None,
+    'SPOOL_SEGMENT_MB': 256,
+    'MAX_BATCH': 1000,
+    'RECENT_SEQ_WINDOW': 1024,
+}
+
+# How far ahead of the server clock a device timestamp may be
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+# Errors that retrying the same rows can never get over
+PERMANENT_WRITE_ERRORS = (IntegrityError, DataError)
+
+LIVE_FIELDS = [
+    'last_known_latitude', 'last_known_longitude', 'last_known_location_time',
+    'last_known_speed', 'last_known_heading', 'location_updated_at',
+]
+
+
+def ingest_settings():
+    return {**DEFAULTS, **getattr(settings, 'LOCATION_INGEST', {})}
+
+
+def make_fix(bus_id, latitude, longitude, speed=0, heading=None, timestamp=None,
+             is_trip_start=False, is_trip_end=False, seq=None, device=None):
+    return Fix(
+        bus_id, latitude, longitude, speed, heading,
+        timestamp or timezone.now(), is_trip_start, is_trip_end, seq, device,
+    )
+
+
+def seq_source(fix):
+    """What the fix's seq counts within: its device token, or its bus if it came without one."""
+    return ('device', fix.device) if fix.device is not None else ('bus', fix.bus_id)
+
+
+def parse_device_timestamp(value):
+    """Accepts an ISO 8601 string or epoch milliseconds; returns an aware datetime."""
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)  # form-encoded epoch milliseconds
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value / 1000.0, tz=dt_timezone.utc)
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise ValueError(f'Invalid timestamp: {value!r}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def fix_from_data(bus_id, data, device=None):
+    """
+    Builds a Fix from one JSON fix ({latitude, longitude, speed?, heading?,
+    timestamp?, seq?}) sent by the device token with id `device`, if any.
+    Raises ValueError with a client-facing message if invalid.
+    """
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    if latitude is None or longitude is None:
+        raise ValueError('Latitude and longitude are required.')
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+        speed = data.get('speed', 0)
+        speed = float(speed) if speed is not None else None
+        heading = data.get('heading')
+        heading = float(heading) if heading is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('Latitude, longitude, speed and heading must be numbers.')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Latitude or longitude out of range.')
+    timestamp = data.get('timestamp')
+    timestamp = parse_device_timestamp(timestamp) if timestamp not in (None, '') else None
+    if timestamp is not None and timestamp > timezone.now() + MAX_CLOCK_SKEW:
+        raise ValueError('Timestamp is in the future.')
+    seq = data.get('seq')
+    if seq not in (None, ''):
+        try:
+            seq = int(seq)
+        except (TypeError, ValueError):
+            raise ValueError('seq must be an integer.')
+        if seq < 0:
+            raise ValueError('seq must not be negative.')
+    else:
+        seq = None
+    return make_fix(bus_id, latitude, longitude, speed=speed, heading=heading, timestamp=timestamp, seq=seq,
+                    device=device)
+
+
+# Wire format of the binary ingest endpoint: a body of back-to-back little-endian
+# records, one per fix. timestamp_ms is the device time in epoch milliseconds
+# (0 = use server time); speed/heading NaN = unknown; seq -1 = none.
+BINARY_FIX = struct.Struct('<qddffq')  # timestamp_ms, latitude, longitude, speed, heading, seq
+BINARY_CONTENT_TYPE = 'application/vnd.busmonitor.fixes'
+
+
+class BinaryFixParser(BaseParser):
+    """Hands the raw request body to the view; decoding happens in fixes_from_binary."""
+    media_type = BINARY_CONTENT_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read() if stream is not None else b''
+
+
+def fixes_from_binary(bus_id, body, device=None):
+    """
+    Decodes a binary ingest body sent by the device token with id `device`, if
+    any, into Fixes. The records are unpacked straight
+    into column tuples and validated column-wise, so no per-fix dicts are built.
+    Raises ValueError with a client-facing message if invalid.
+    """
+    if not body or len(body) % BINARY_FIX.size:
+        raise ValueError(f'Body must be a non-empty multiple of {BINARY_FIX.size} bytes.')
+    timestamps, latitudes, longitudes, speeds, headings, seqs = zip(*BINARY_FIX.iter_unpack(body))
+
+    if not all(map(math.isfinite, latitudes + longitudes)):
+        raise ValueError('Latitude and longitude must be finite numbers.')
+    if min(latitudes) < -90 or max(latitudes) > 90 or min(longitudes) < -180 or max(longitudes) > 180:
+        raise ValueError('Latitude or longitude out of range.')
+    now = timezone.now()
+    if max(timestamps) > (now + MAX_CLOCK_SKEW).timestamp() * 1000:
+        raise ValueError('Timestamp is in the future.')
+    if min(seqs) < -1:
+        raise ValueError('seq must not be negative.')
+
+    epoch = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    return [
+        Fix(
+            bus_id, lat, lng,
+            None if speed != speed else speed,  # NaN check without a function call
+            None if heading != heading else heading,
+            epoch + timedelta(milliseconds=ts) if ts else now,
+            False, False,
+            None if seq == -1 else seq,
+            device,
+        )
+        for ts, lat, lng, speed, heading, seq in zip(timestamps, latitudes, longitudes, speeds, headings, seqs)
+    ]
+
+
+class RecentSeqWindow:
+    """
+    Bounded memory of the most recently accepted sequence numbers per device
+    (see seq_source). Answers "have we seen this seq lately?" without touching
+    the database.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._seen = {}  # seq_source -> OrderedDict of seq -> None, oldest first
+        self._lock = threading.Lock()
+
+    def claim(self, fixes):
+        """Records the fixes' sequence numbers and returns only the ones not seen before."""
+        fresh = []
+        with self._lock:
+            for fix in fixes:
+                if fix.seq is None:
+                    fresh.append(fix)
+                    continue
+                seen = self._seen.setdefault(seq_source(fix), OrderedDict())
+                if fix.seq in seen:
+                    continue
+                seen[fix.seq] = None
+                if len(seen) > self.size:
+                    seen.popitem(last=False)
+                fresh.append(fix)
+        return fresh
+
+    def release(self, fixes):
+        """Forgets fixes that were claimed but could not be stored, so a retry is accepted."""
+        with self._lock:
+            for fix in fixes:
+                if fix.seq is not None:
+                    self._seen.get(seq_source(fix), {}).pop(fix.seq, None)
+
+
+def write_fixes(fixes):
+    """
+    Writes fixes to the database: one bulk insert into BusLocation, the
+    matching BusDailyStats updates (core/rollups.py), plus one bulk update of
+    Bus.last_known_* for buses whose newest non-marker fix is newer than what
+    is stored. Fixes for buses that no longer exist are skipped, and so are
+    fixes whose seq is already stored or repeated earlier in the batch.
+    Returns the fixes written.
+    """
+    started = time.monotonic()
+    try:
+        written = _write_fixes(fixes)
+    except Exception:
+        get_ingest_metrics().record_write(len(fixes), time.monotonic() - started, failed=True)
+        raise
+    get_ingest_metrics().record_write(len(written), time.monotonic() - started)
+    return written
+
+
+def _write_fixes(fixes):
+    with transaction.atomic():
+        # Lock the affected buses so concurrent writers cannot move last_known_* backwards
+        stored = dict(
+            Bus.all_objects.select_for_update()
+            .filter(id__in={fix.bus_id for fix in fixes})
+            .values_list('id', 'last_known_location_time')
+        )
+        # Buses deleted since their fixes were accepted
+        fixes = [fix for fix in fixes if fix.bus_id in stored]
+        fixes = _unseen_seqs(fixes)
+        _insert_fixes(fixes, stored)
+    return fixes
+
+
+def _unseen_seqs(fixes):
+    """
+    The fixes without a seq that is stored or repeated earlier in the batch
+    for the same device (see seq_source). Run while the buses are locked, so
+    these are exactly the rows the insert stores and the rollups count.
+    """
+    keyed = [fix for fix in fixes if fix.seq is not None]
+    if not keyed:
+        return fixes
+    seqs = {fix.seq for fix in keyed}
+    devices = {fix.device for fix in keyed if fix.device is not None}
+    buses = {fix.bus_id for fix in keyed if fix.device is None}
+    stored = BusLocation.objects.filter(
+        Q(device__in=devices) | Q(device__isnull=True, bus_id__in=buses), seq__in=seqs,
+    ).values_list('bus_id', 'device', 'seq')
+    seen = {(('device', device) if device is not None else ('bus', bus_id), seq) for bus_id, device, seq in stored}
+    unseen = []
+    for fix in fixes:
+        if fix.seq is not None:
+            key = (seq_source(fix), fix.seq)
+            if key in seen:
+                continue
+            seen.add(key)
+        unseen.append(fix)
+    return unseen
+
+
+def _insert_fixes(fixes, stored):
+    latest = {}
+    for fix in fixes:
+        if fix.is_trip_start or fix.is_trip_end:
+            continue
+        current = latest.get(fix.bus_id)
+        if current is None or fix.timestamp >= current.timestamp:
+            latest[fix.bus_id] = fix
+
+    latest = {
+        bus_id: fix for bus_id, fix in latest.items()
+        if stored[bus_id] is None or fix.timestamp > stored[bus_id]
+    }
+    BusLocation.objects.bulk_create([
+        BusLocation(
+            bus_id=fix.bus_id,
+            latitude=fix.latitude,
+            longitude=fix.longitude,
+            speed=fix.speed,
+            heading=fix.heading,
+            timestamp=fix.timestamp,
+            is_trip_start=fix.is_trip_start,
+            is_trip_end=fix.is_trip_end,
+            seq=fix.seq,
+            device=fix.device,
+        ) for fix in fixes
+    # ignore_conflicts only matters if replay_spool or import_locations stores the same seq meanwhile
+    ], batch_size=1000, ignore_conflicts=True)
+    rollups.apply_fixes(fixes)
+    now = timezone.now()
+    Bus.all_objects.bulk_update([
+        Bus(
+            id=fix.bus_id,
+            last_known_latitude=fix.latitude,
+            last_known_longitude=fix.longitude,
+            last_known_location_time=fix.timestamp,
+            last_known_speed=fix.speed,
+            last_known_heading=fix.heading,
+            location_updated_at=now,
+        ) for fix in latest.values()
+    ], LIVE_FIELDS, batch_size=500)
+
+
+class LocationBuffer:
+    """
+    In-process queue of accepted fixes plus the live state (latest fix per bus)
+    they imply. Thread-safe; one instance per worker process.
+    """
+
+    def __init__(self, flush_size=500, flush_interval_ms=1000, spool=None):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.spool = spool  # fsynced before each flush; fixes are appended by submit_fixes
+        self.live_state = {}  # bus_id -> newest accepted Fix
+
+        self._pending = []
+        self._oldest_pending = None  # monotonic time the oldest queued fix was accepted
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.flushed_total = 0
+        self.failed_flushes = 0
+        self.rejected_total = 0  # fixes dropped because the database refused them
+        self.skipped_total = 0  # already answered as accepted, then found stored or their bus deleted
+        self.last_rejection = None
+        self.last_flush_at = None
+        self.last_flush_duration_ms = None
+        self.last_flush_size = 0
+
+    def add(self, fixes):
+        """Queues fixes and updates the live state. Returns once they are in memory."""
+        with self._lock:
+            if not self._pending:
+                self._oldest_pending = time.monotonic()
+            self._pending.extend(fixes)
+            for fix in fixes:
+                if fix.is_trip_start or fix.is_trip_end:
+                    continue
+                current = self.live_state.get(fix.bus_id)
+                if current is None or fix.timestamp >= current.timestamp:
+                    self.live_state[fix.bus_id] = fix
+            depth = len(self._pending)
+        self._ensure_started()
+        if depth >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Writes everything queued so far. Returns the number of fixes written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._oldest_pending = None
+            if not batch:
+                return 0
+            started = time.monotonic()
+            if self.spool is not None:
+                try:
+                    self.spool.sync()
+                except Exception:
+                    self._requeue(batch, started)
+                    raise
+            written = self._write(batch, started)
+            self.flushed_total += written
+            self.last_flush_size = written
+            self.last_flush_at = timezone.now()
+            self.last_flush_duration_ms = (time.monotonic() - started) * 1000
+            return written
+
+    def _write(self, batch, started):
+        """
+        Writes the batch, halving any part the database rejects for good until
+        the bad fixes are alone; those are dropped. Returns the number written.
+        On any other error, requeues what is not written yet and raises.
+        """
+        written = 0
+        parts = [batch]  # a stack; the next part to write is last
+        while parts:
+            part = parts.pop()
+            try:
+                stored = write_fixes(part)
+                written += len(stored)
+                self.skipped_total += len(part) - len(stored)
+            except PERMANENT_WRITE_ERRORS as e:
+                if len(part) > 1:
+                    middle = len(part) // 2
+                    parts += [part[middle:], part[:middle]]
+                    continue
+                self.rejected_total += 1
+                self.last_rejection = f'bus {part[0].bus_id} at {part[0].timestamp.isoformat()}: {e}'
+            except Exception:
+                self._requeue([fix for rest in [part] + parts[::-1] for fix in rest], started)
+                raise
+        return written
+
+    def _requeue(self, fixes, started):
+        # Put the fixes back in front of anything queued meanwhile and retry next tick
+        with self._lock:
+            self._pending = fixes + self._pending
+            self._oldest_pending = started
+        self.failed_flushes += 1
+
+    def stats(self):
+        with self._lock:
+            depth = len(self._pending)
+            oldest = self._oldest_pending
+        return {
+            'queue_depth': depth,
+            'flush_lag_ms': round((time.monotonic() - oldest) * 1000, 1) if oldest else 0,
+            'flushed_total': self.flushed_total,
+            'failed_flushes': self.failed_flushes,
+            'rejected_total': self.rejected_total,
+            'skipped_total': self.skipped_total,
+            'last_rejection': self.last_rejection,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_size': self.last_flush_size,
+            'last_flush_duration_ms': self.last_flush_duration_ms,
+            'flush_size': self.flush_size,
+            'flush_interval_ms': int(self.flush_interval * 1000),
+            'durable': self.spool is not None,
+        }
+
+    def stop(self):
+        """Stops the flusher thread and drains the queue (graceful shutdown)."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=30)
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='location-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                pass  # counted in failed_flushes, the unwritten fixes are retried on the next tick
+        close_old_connections()
+
+
+_buffer = None
+_spool = None
+_recent_seqs = None
+_buffer_lock = threading.Lock()
+
+
+def write_behind_enabled():
+    return ingest_settings()['WRITE_BEHIND']
+
+
+def get_spool():
+    """Returns this process's spool appender, or None if SPOOL_DIR is not configured."""
+    global _spool
+    conf = ingest_settings()
+    if _spool is None and conf['SPOOL_DIR']:
+        with _buffer_lock:
+            if _spool is None:
+                _spool = LocationSpool(conf['SPOOL_DIR'], segment_bytes=conf['SPOOL_SEGMENT_MB'] * 1024 * 1024)
+                atexit.register(_spool.close)
+    return _spool
+
+
+def get_location_buffer():
+    """Returns this process's LocationBuffer, creating it from settings on first use."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                conf = ingest_settings()
+                _buffer = LocationBuffer(
+                    flush_size=conf['FLUSH_SIZE'],
+                    flush_interval_ms=conf['FLUSH_INTERVAL_MS'],
+                )
+                atexit.register(_buffer.stop)
+    if _buffer.spool is None:
+        _buffer.spool = get_spool()
+    return _buffer
+
+
+def reset_ingest_state():
+    """
+    Drains and forgets this process's LocationBuffer and recent-seq window, e.g.
+    after the database was emptied and ids will be reused (benchmarks).
+    """
+    global _buffer, _recent_seqs
+    with _buffer_lock:
+        buffer, _buffer, _recent_seqs = _buffer, None, None
+    if buffer is not None:
+        buffer.stop()
+
+
+def get_recent_seqs():
+    global _recent_seqs
+    if _recent_seqs is None:
+        with _buffer_lock:
+            if _recent_seqs is None:
+                _recent_seqs = RecentSeqWindow(ingest_settings()['RECENT_SEQ_WINDOW'])
+    return _recent_seqs
+
+
+def submit_fixes(fixes):
+    """
+    Entry point used by the ingest views: drops recently seen seq retries,
+    spools the rest, then queues them when write-behind is enabled or writes
+    them synchronously, and finally updates the spatial index. Returns the
+    fixes that were accepted; written synchronously, that leaves out the
+    retries the database already had.
+    """
+    recent = get_recent_seqs()
+    fixes = recent.claim(fixes)
+    if not fixes:
+        return fixes
+    spool = get_spool()
+    if spool is not None:
+        spool.append(fixes)
+    if write_behind_enabled():
+        get_location_buffer().add(fixes)
+    else:
+        try:
+            fixes = write_fixes(fixes)
+        except Exception:
+            recent.release(fixes)
+            raise
+    get_bus_index().update_fixes(fixes)
+    get_ingest_metrics().record_accepted(fixes)
+    return fixes
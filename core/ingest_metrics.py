@@ -0,0 +1,223 @@
+# core/ingest_metrics.py
+"""
+How far behind real time location ingest is running.
+
+ingest.submit_fixes reports every accepted fix here, and ingest.write_fixes
+reports every database write. From those this module keeps:
+- fixes/sec per bus and fleet-wide, over the last WINDOW_SECONDS;
+- device-to-server latency, i.e. how old a fix is when it is accepted
+  (timezone.now() minus the fix's timestamp). A fix sent without a device
+  timestamp is stamped by the server and counts as 0;
+- write latency, i.e. how long each write_fixes call holds the database.
+Live-state staleness per bus (now minus Bus.last_known_location_time) is read
+from the database when asked for, so it covers fixes taken by every worker.
+
+The counters and histograms are per process, like the rest of the registry in
+core/metrics.py, which serves them at /metrics/. BusTripViewSet.ingest_status
+returns the same figures as JSON for admins.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.metrics import DURATION_BUCKETS, Counter, Gauge, Histogram, registry
+
+DEFAULTS = {
+    'WINDOW_SECONDS': 60,
+    'STALE_SECONDS': 120,
+    'LATENCY_SAMPLES': 2048,
+}
+
+DEVICE_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+
+def ingest_metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'INGEST_METRICS', {})}
+
+
+def quantiles(samples):
+    """p50/p95/p99/max of a list of numbers, or Nones if it is empty."""
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        'p50': ordered[round(last * 0.50)],
+        'p95': ordered[round(last * 0.95)],
+        'p99': ordered[round(last * 0.99)],
+        'max': ordered[-1],
+    }
+
+
+class RateWindow:
+    """Event counts per whole second over the last `seconds` seconds, per key."""
+
+    def __init__(self, seconds=60):
+        self.seconds = seconds
+        self._counts = {}  # key -> deque of [second, count], oldest first
+
+    def add(self, key, count, now):
+        second = int(now)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = deque()
+        if counts and counts[-1][0] == second:
+            counts[-1][1] += count
+        else:
+            counts.append([second, count])
+        self._prune(counts, second)
+
+    def _prune(self, counts, second):
+        while counts and counts[0][0] <= second - self.seconds:
+            counts.popleft()
+
+    def rates(self, now):
+        """{key: events per second} for keys with events in the window; drops idle keys."""
+        second = int(now)
+        rates = {}
+        for key in list(self._counts):
+            counts = self._counts[key]
+            self._prune(counts, second)
+            if counts:
+                rates[key] = sum(count for _, count in counts) / self.seconds
+            else:
+                del self._counts[key]
+        return rates
+
+
+class IngestMetrics:
+    """Thread-safe ingest counters for one process; see the module docstring."""
+
+    def __init__(self, window_seconds=60, latency_samples=2048):
+        self.window_seconds = window_seconds
+        self.accepted_total = 0
+        self.written_total = 0
+        self.failed_writes = 0
+        self._rates = RateWindow(window_seconds)
+        self._device_latency = deque(maxlen=latency_samples)  # (monotonic time, seconds)
+        self._write_latency = deque(maxlen=latency_samples)
+        self._lock = threading.Lock()
+
+    def record_accepted(self, fixes):
+        now = timezone.now()
+        clock = time.monotonic()
+        per_bus = {}
+        latencies = []
+        for fix in fixes:
+            per_bus[fix.bus_id] = per_bus.get(fix.bus_id, 0) + 1
+            if not (fix.is_trip_start or fix.is_trip_end):
+                latencies.append(max((now - fix.timestamp).total_seconds(), 0.0))
+        with self._lock:
+            self.accepted_total += len(fixes)
+            for bus_id, count in per_bus.items():
+                self._rates.add(bus_id, count, clock)
+            self._device_latency.extend((clock, latency) for latency in latencies)
+        for bus_id, count in per_bus.items():
+            BUS_FIXES.inc(bus_id, amount=count)
+        FIXES.inc(amount=len(fixes))
+        for latency in latencies:
+            DEVICE_LATENCY.observe(latency)
+
+    def record_write(self, count, seconds, failed=False):
+        with self._lock:
+            if failed:
+                self.failed_writes += 1
+            else:
+                self.written_total += count
+            self._write_latency.append((time.monotonic(), seconds))
+        WRITE_LATENCY.observe(seconds)
+        if failed:
+            WRITE_FAILURES.inc()
+
+    def _recent(self, samples, since):
+        return [value for at, value in samples if at >= since]
+
+    def snapshot(self):
+        """Totals, rates and latency quantiles over the window, as plain JSON-friendly values."""
+        clock = time.monotonic()
+        with self._lock:
+            rates = self._rates.rates(clock)
+            device = self._recent(self._device_latency, clock - self.window_seconds)
+            write = self._recent(self._write_latency, clock - self.window_seconds)
+            totals = {
+                'accepted_total': self.accepted_total,
+                'written_total': self.written_total,
+                'failed_writes': self.failed_writes,
+            }
+        return {
+            'window_seconds': self.window_seconds,
+            **totals,
+            'fixes_per_second': round(sum(rates.values()), 3),
+            'bus_fixes_per_second': {bus_id: round(rate, 3) for bus_id, rate in rates.items()},
+            'device_latency_seconds': {name: round(value, 3) if value is not None else None
+                                       for name, value in quantiles(device).items()},
+            'write_latency_ms': {name: round(value * 1000, 2) if value is not None else None
+                                 for name, value in quantiles(write).items()},
+        }
+
+
+def bus_staleness(now=None, school_id=None):
+    """
+    (bus_id, bus_number, last_known_location_time, staleness_seconds) for every
+    active bus (of the school, if given), most stale first; staleness is None
+    for buses never seen.
+    """
+    from core.models import Bus
+    from core.tenancy import for_school
+
+    now = now or timezone.now()
+    buses = for_school(Bus.all_objects.filter(status='active'), school_id)
+    rows = buses.values_list('id', 'bus_number', 'last_known_location_time')
+    staleness = [
+        (bus_id, bus_number, seen_at, (now - seen_at).total_seconds() if seen_at else None)
+        for bus_id, bus_number, seen_at in rows
+    ]
+    staleness.sort(key=lambda row: float('inf') if row[3] is None else row[3], reverse=True)
+    return staleness
+
+
+def _collect_staleness():
+    return {(bus_id,): round(seconds, 3) for bus_id, _, _, seconds in bus_staleness() if seconds is not None}
+
+
+FIXES = registry.register(Counter(
+    'busmonitor_ingest_fixes_total', 'Location fixes accepted by this process.', (),
+))
+BUS_FIXES = registry.register(Counter(
+    'busmonitor_ingest_bus_fixes_total', 'Location fixes accepted by this process, per bus id.', ('bus',),
+))
+DEVICE_LATENCY = registry.register(Histogram(
+    'busmonitor_ingest_device_latency_seconds', 'Age of a fix (server time minus device timestamp) when accepted.',
+    DEVICE_LATENCY_BUCKETS, (),
+))
+WRITE_LATENCY = registry.register(Histogram(
+    'busmonitor_ingest_write_seconds', 'Duration of each database write of accepted fixes.', DURATION_BUCKETS, (),
+))
+WRITE_FAILURES = registry.register(Counter(
+    'busmonitor_ingest_write_failures_total', 'Database writes of fixes that raised.', (),
+))
+STALENESS = registry.register(Gauge(
+    'busmonitor_bus_staleness_seconds', 'Seconds since the last known position of each active bus, per bus id.',
+    ('bus',), _collect_staleness,
+))
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_ingest_metrics():
+    """Returns this process's IngestMetrics, creating it from settings on first use."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                conf = ingest_metrics_settings()
+                _metrics = IngestMetrics(
+                    window_seconds=conf['WINDOW_SECONDS'],
+                    latency_samples=conf['LATENCY_SAMPLES'],
+                )
+    return _metrics
@@ -0,0 +1,225 @@
+# core/loadgen.py
+"""
+Load generator behind `manage.py simulate_fleet`.
+
+Simulated buses drive along their route's stops and post fixes to
+BusTripViewSet.post_location with a device token. Simulated parents poll
+/api/live-bus-locations/. One scheduler thread keeps a heap of when each actor
+is due next and hands the requests to a thread pool. Every request's latency
+and outcome is recorded per endpoint. A request that starts later than
+scheduled (because the pool is saturated) counts as lag, not as latency.
+
+Requests go through an HTTP connection per worker thread (--url) or in-process
+through Django's test Client. The in-process mode needs no server, but it
+measures the app and its database without the web server in front.
+"""
+import heapq
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.db import close_old_connections
+from django.test import Client
+
+from core.benchmarks import percentile
+from core.geometry import build_geometry
+
+SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+
+LOCATION_ENDPOINT = 'post_location'
+POLL_ENDPOINT = 'live_bus_locations'
+
+
+class HttpTransport:
+    """Keep-alive HTTP connection per worker thread."""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, path, headers, body=None):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self.connection_class(self.netloc, timeout=self.timeout)
+        try:
+            connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+class ClientTransport:
+    """In-process requests through a test Client per worker thread (not thread-safe to share)."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def request(self, method, path, headers, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client(raise_request_exception=False)
+        extra = {'HTTP_' + name.upper().replace('-', '_'): value for name, value in headers.items()
+                 if name.lower() != 'content-type'}
+        if method == 'POST':
+            response = client.post(path, body, content_type=headers.get('Content-Type'), **extra)
+        else:
+            response = client.get(path, **extra)
+        close_old_connections()
+        return response.status_code
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies_ms = []
+        self.errors = 0
+        self.statuses = {}
+        self.lag_ms = []
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms, status, lag_ms):
+        with self._lock:
+            self.latencies_ms.append(latency_ms)
+            self.lag_ms.append(lag_ms)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                self.errors += 1
+
+    def summary(self, seconds):
+        count = len(self.latencies_ms)
+        return {
+            'requests': count,
+            'throughput_rps': count / seconds if seconds else 0,
+            'error_rate': self.errors / count if count else 0,
+            'p50_ms': percentile(self.latencies_ms, 0.50) if count else None,
+            'p95_ms': percentile(self.latencies_ms, 0.95) if count else None,
+            'p99_ms': percentile(self.latencies_ms, 0.99) if count else None,
+            'max_lag_ms': max(self.lag_ms) if count else None,
+            'statuses': dict(sorted(self.statuses.items(), key=str)),
+        }
+
+
+class SimulatedBus:
+    """Drives back and forth along a route's stops at speed_kmh, one fix per call to next_fix."""
+
+    def __init__(self, bus_id, token, stops, interval_s, speed_kmh=35):
+        geometry = build_geometry(stops)
+        self.bus_id = bus_id
+        self.token = token
+        self.points = geometry['points']
+        self.cumulative = geometry['cumulative_m']
+        self.length = geometry['length_m']
+        self.step_m = speed_kmh / 3.6 * interval_s
+        self.speed_kmh = speed_kmh
+        self.distance = 0.0
+        self.seq = int(time.time() * 1000)  # fresh sequence numbers on every run
+
+    def position(self):
+        # Back and forth: distance runs 0 -> length -> 0 along the path
+        along = self.distance % (2 * self.length) if self.length else 0
+        if along > self.length:
+            along = 2 * self.length - along
+        for index in range(1, len(self.points)):
+            if self.cumulative[index] >= along:
+                a, b = self.points[index - 1], self.points[index]
+                span = self.cumulative[index] - self.cumulative[index - 1]
+                t = (along - self.cumulative[index - 1]) / span if span else 0
+                return a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t
+        return tuple(self.points[-1])
+
+    def next_fix(self):
+        latitude, longitude = self.position()
+        self.distance += self.step_m
+        self.seq += 1
+        return {'latitude': latitude, 'longitude': longitude, 'speed': self.speed_kmh, 'seq': self.seq}
+
+
+class LoadRun:
+    """
+    Runs the simulation for `duration` seconds. buses are SimulatedBus objects
+    posting `rate` fixes per second each; parent_headers holds one auth header
+    dict per simulated parent, polling every poll_interval seconds.
+    """
+
+    def __init__(self, transport, buses, parent_headers, rate=1.0, poll_interval=5.0, duration=30.0, concurrency=32):
+        self.transport = transport
+        self.buses = buses
+        self.parent_headers = parent_headers
+        self.rate = rate
+        self.poll_interval = poll_interval
+        self.duration = duration
+        self.concurrency = concurrency
+        self.stats = {LOCATION_ENDPOINT: EndpointStats(), POLL_ENDPOINT: EndpointStats()}
+
+    def _timed(self, endpoint, due, method, path, headers, body=None):
+        started = time.monotonic()
+        try:
+            status = self.transport.request(method, path, headers, body)
+        except Exception as e:
+            status = type(e).__name__
+        finished = time.monotonic()
+        self.stats[endpoint].record((finished - started) * 1000, status, max(0.0, (started - due) * 1000))
+
+    def _post_fix(self, bus, fix, due):
+        body = json.dumps(fix)
+        headers = {'Authorization': f'Device {bus.token}', 'Content-Type': 'application/json'}
+        self._timed(LOCATION_ENDPOINT, due, 'POST', f'/api/bus-trips/{bus.bus_id}/post_location/', headers, body)
+
+    def _poll(self, headers, due):
+        self._timed(POLL_ENDPOINT, due, 'GET', '/api/live-bus-locations/', headers)
+
+    def run(self):
+        started = time.monotonic()
+        deadline = started + self.duration
+        # Spread the actors' first request over one period so they don't all fire together
+        queue = []
+        fix_period = 1.0 / self.rate
+        for index, bus in enumerate(self.buses):
+            queue.append((started + fix_period * index / max(len(self.buses), 1), 0, index, 'bus'))
+        for index in range(len(self.parent_headers)):
+            queue.append((started + self.poll_interval * index / max(len(self.parent_headers), 1), 1, index, 'parent'))
+        heapq.heapify(queue)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while queue:
+                due, priority, index, kind = heapq.heappop(queue)
+                if due >= deadline:
+                    continue
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if kind == 'bus':
+                    bus = self.buses[index]
+                    pool.submit(self._post_fix, bus, bus.next_fix(), due)
+                    heapq.heappush(queue, (due + fix_period, priority, index, kind))
+                else:
+                    pool.submit(self._poll, self.parent_headers[index], due)
+                    heapq.heappush(queue, (due + self.poll_interval, priority, index, kind))
+        elapsed = time.monotonic() - started
+        return {endpoint: stats.summary(elapsed) for endpoint, stats in self.stats.items()}
+
+
+def session_headers(user):
+    """
+    A Cookie header for a new session logged in as user, made without a
+    password check (what Client.force_login does), so polls skip the hasher.
+    """
+    session = SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return {'Cookie': f'{settings.SESSION_COOKIE_NAME}={session.session_key}'}
@@ -0,0 +1,40 @@
+# core/management/commands/analyze_history.py
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import analytics
+from core.models import HistoryReportRow
+
+
+class Command(BaseCommand):
+    help = "Segment speeds, stop dwell times and congestion hotspots by hour of day from location history (see core/analytics.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='First local date, YYYY-MM-DD')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last local date (default: yesterday)')
+        parser.add_argument('--days', type=int, default=30, help='Days up to --until when --since is not given')
+        parser.add_argument('--bus', type=int, action='append', dest='buses', help='Only this bus id (repeatable)')
+        parser.add_argument('--chunk-size', type=int, help='Fixes per NumPy chunk (default: HISTORY_ANALYTICS)')
+
+    def handle(self, *args, **options):
+        if analytics.np is None:
+            raise CommandError('analyze_history needs numpy (pip install numpy).')
+        until = options['until'] or timezone.localdate() - timedelta(days=1)
+        since = options['since'] or until - timedelta(days=options['days'] - 1)
+        if since > until:
+            raise CommandError('--since is after --until.')
+
+        verbosity = options['verbosity']
+        analyzer = analytics.HistoryAnalyzer(
+            since, until, bus_ids=options['buses'], CHUNK_SIZE=options['chunk_size'],
+            log=(lambda message: self.stdout.write(message)) if verbosity > 1 else None,
+        )
+        report = analyzer.run()
+
+        counts = {kind: report.rows.filter(kind=kind).count() for kind, _ in HistoryReportRow.KIND_CHOICES}
+        self.stdout.write(self.style.SUCCESS(
+            f'Report {report.id}: {report.fixes_scanned} fixes from {since} to {until} in {report.seconds:.1f}s, '
+            + ', '.join(f'{count} {kind} rows' for kind, count in counts.items())
+        ))
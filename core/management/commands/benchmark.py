@@ -0,0 +1,81 @@
+# core/management/commands/benchmark.py
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.benchmarks import BENCHMARKS, benchmark_database, compare_results, run_benchmarks
+
+
+def parse_param(value):
+    key, sep, raw = value.partition('=')
+    if not sep:
+        raise CommandError(f'--param expects key=value, got {value!r}')
+    for cast in (int, float):
+        try:
+            return key, cast(raw)
+        except ValueError:
+            pass
+    return key, raw
+
+
+class Command(BaseCommand):
+    help = 'Run hot-path benchmarks (see core/benchmarks.py) against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Benchmarks to run (default: all)')
+        parser.add_argument('--list', action='store_true', help='List available benchmarks')
+        parser.add_argument('--param', action='append', default=[], help='Benchmark parameter as key=value (repeatable)')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Compare against a JSON file written by --output and fail on regressions')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative change that counts as a regression (default 0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, func in BENCHMARKS.items():
+                summary = (func.__doc__ or '').strip().splitlines()
+                self.stdout.write(f'{name:<24} {summary[0] if summary else ""}')
+            return
+
+        names = options['names'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f'Unknown benchmark(s): {", ".join(unknown)}. Use --list.')
+        params = dict(parse_param(value) for value in options['param'])
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        with benchmark_database():
+            results = run_benchmarks(names, params, self.stdout, self.style)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'machine': platform.node(),
+                    'params': params,
+                    'results': results,
+                }, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            self.report_comparison(compare_results(baseline, results, options['threshold']), options['threshold'])
+
+    def report_comparison(self, rows, threshold):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Compared with baseline (threshold {threshold:.0%})'))
+        for name, metric, old, new, change, regressed in rows:
+            delta = f'{(new - old) / abs(old):>+8.1%}' if old else f'{"new":>8}'
+            line = f'  {name + "." + metric:<48} {old:>12,.3f} -> {new:>12,.3f} {delta}'
+            self.stdout.write(self.style.ERROR(line + '  REGRESSED') if regressed else line)
+        regressions = [row for row in rows if row[5]]
+        if regressions:
+            raise CommandError(f'{len(regressions)} metric(s) regressed by more than {threshold:.0%}.')
+        self.stdout.write(self.style.SUCCESS(f'No regressions in {len(rows)} compared metrics.'))
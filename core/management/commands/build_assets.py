@@ -0,0 +1,100 @@
+# core/management/commands/build_assets.py
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+
+from core.assets import BUNDLES, build_bundles, compressed_sizes, load_manifest
+
+# What base.html linked on every page before bundling (local files only; the CDN
+# font-awesome and leaflet links are not counted on either side)
+PREVIOUS_PAGE_ASSETS = [
+    'vendors/feather/feather.css',
+    'vendors/ti-icons/css/themify-icons.css',
+    'vendors/css/vendor.bundle.base.css',
+    'vendors/datatables.net-bs4/dataTables.bootstrap4.css',
+    'js/select.dataTables.min.css',
+    'css/vertical-layout-light/style.css',
+    'vendors/js/vendor.bundle.base.js',
+    'vendors/chart.js/Chart.min.js',
+    'vendors/datatables.net/jquery.dataTables.js',
+    'vendors/datatables.net-bs4/dataTables.bootstrap4.js',
+    'js/dataTables.select.min.js',
+    'js/off-canvas.js',
+    'js/hoverable-collapse.js',
+    'js/template.js',
+    'js/settings.js',
+    'js/todolist.js',
+]
+BUNDLE_TAG = re.compile(r"""\{%\s*bundle\s+['"](\w+)['"]\s+['"](\w+)['"]\s*%\}""")
+EXTENDS_TAG = re.compile(r"""\{%\s*extends\s+['"]([^'"]+)['"]\s*%\}""")
+
+
+def kb(value):
+    return f'{value / 1024:>9,.1f}' if value is not None else f'{"-":>9}'
+
+
+class Command(BaseCommand):
+    help = 'Build hashed, trimmed and precompressed static bundles (see core/assets.py) and report bytes per page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Bundles to build (default: all)')
+        parser.add_argument('--report-only', action='store_true', help='Only print the per-page report for the current build')
+
+    def handle(self, *args, **options):
+        unknown = [name for name in options['names'] if name not in BUNDLES]
+        if unknown:
+            raise CommandError(f'Unknown bundle(s): {", ".join(unknown)}. Known: {", ".join(BUNDLES)}')
+
+        if options['report_only']:
+            manifest = load_manifest()
+            if not manifest:
+                raise CommandError('No bundles built yet, run build_assets first.')
+        else:
+            manifest = build_bundles(options['names'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Bundles (KB)'))
+        self.stdout.write(f'  {"bundle":<18} {"sources":>9} {"built":>9} {"gzip":>9} {"br":>9}')
+        for key, entry in sorted(manifest.items()):
+            self.stdout.write(f'  {key:<18} {kb(entry["source_bytes"])} {kb(entry["bytes"])} {kb(entry["gzip"])} {kb(entry["br"])}')
+
+        previous = b''.join(Path(finders.find(path)).read_bytes() for path in PREVIOUS_PAGE_ASSETS)
+        # Servers compress per file, so "before, gzip" is the sum over the files
+        previous_gz = sum(compressed_sizes(Path(finders.find(path)).read_bytes())[0] for path in PREVIOUS_PAGE_ASSETS)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Bytes shipped per page (KB)'))
+        self.stdout.write(f'  {"page":<44} {"before":>9} {"gzip":>9} {"after":>9} {"gzip":>9} {"br":>9}')
+        for page, bundles in sorted(self.page_bundles().items()):
+            entries = [manifest[key] for key in bundles if key in manifest]
+            after = sum(entry['bytes'] for entry in entries)
+            after_gz = sum(entry['gzip'] for entry in entries)
+            after_br = sum(entry['br'] for entry in entries) if all(entry['br'] is not None for entry in entries) else None
+            self.stdout.write(f'  {page:<44} {kb(len(previous))} {kb(previous_gz)} {kb(after)} {kb(after_gz)} {kb(after_br)}')
+
+    def page_bundles(self):
+        """Maps every template that extends base.html to the bundles it ends up loading."""
+        sources = {}
+        for directory in (d for conf in settings.TEMPLATES for d in conf.get('DIRS', [])):
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if name.endswith('.html'):
+                        path = os.path.join(root, name)
+                        with open(path, encoding='utf-8') as f:
+                            sources[os.path.relpath(path, directory)] = f.read()
+
+        def bundles(template, seen=()):
+            text = sources.get(template, '')
+            found = [f'{name}.{kind}' for name, kind in BUNDLE_TAG.findall(text)]
+            parent = EXTENDS_TAG.search(text)
+            if parent and parent.group(1) not in seen:
+                found = bundles(parent.group(1), seen + (template,)) + found
+            return found
+
+        return {
+            template: list(dict.fromkeys(bundles(template)))
+            for template, text in sources.items()
+            if EXTENDS_TAG.search(text)
+        }
@@ -0,0 +1,52 @@
+# core/management/commands/bulk_import.py
+import os
+
+from django.apps import apps
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk_import
+from core.models import BulkImportJob
+
+
+class Command(BaseCommand):
+    help = ("Bulk import a CSV through a model's admin resource, e.g. `bulk_import core.Student students.csv`, "
+            "or rerun an import job (see core/bulk_import.py)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', nargs='?', help='Model label, e.g. core.Student')
+        parser.add_argument('path', nargs='?', help='CSV file, optionally gzipped')
+        parser.add_argument('--job', type=int, help='Run this existing BulkImportJob instead (e.g. one that failed or was interrupted)')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the file and count the changes')
+        parser.add_argument('--batch-size', type=int, help='Rows per bulk write (default: BULK_IMPORT)')
+
+    def handle(self, *args, **options):
+        if options['job']:
+            try:
+                job = BulkImportJob.objects.get(pk=options['job'])
+            except BulkImportJob.DoesNotExist:
+                raise CommandError(f"No import job {options['job']}.")
+        else:
+            if not (options['model'] and options['path']):
+                raise CommandError('Give a model label and a CSV file, or --job.')
+            try:
+                model = apps.get_model(options['model'])
+            except (LookupError, ValueError):
+                raise CommandError(f"Unknown model {options['model']}.")
+            if bulk_import.resource_for(model) is None:
+                raise CommandError(f'{model._meta.label} has no import resource in the admin.')
+            try:
+                with open(options['path'], 'rb') as stream:
+                    job = BulkImportJob(model=model._meta.label, dry_run=options['dry_run'])
+                    job.file.save(os.path.basename(options['path']), File(stream))
+            except OSError as e:
+                raise CommandError(str(e))
+
+        job = bulk_import.run_job(job.pk, batch_size=options['batch_size'])
+        for error in job.errors:
+            self.stderr.write(f"Line {error['line']}: {error['error']}")
+        summary = (f'Import #{job.pk} {job.status}: {job.total_rows} rows, {job.created} created, '
+                   f'{job.updated} updated, {job.unchanged} unchanged. {job.message}'.strip())
+        if job.status == 'failed':
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
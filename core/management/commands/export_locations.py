@@ -0,0 +1,40 @@
+# core/management/commands/export_locations.py
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import archive
+
+
+class Command(BaseCommand):
+    help = "Stream location history to a csv or ndjson archive, optionally gzipped (see core/archive.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='First local date, YYYY-MM-DD (default: all history)')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last local date (default: the newest fix)')
+        parser.add_argument('--bus', type=int, action='append', dest='buses', help='Only this bus id (repeatable)')
+        parser.add_argument('--format', choices=archive.FORMATS, default='csv', dest='file_format')
+        parser.add_argument('--gzip', action='store_true', help='Compress the archive (implied by an --output ending in .gz)')
+        parser.add_argument('--output', '-o', default='-', help="File to write, or '-' for stdout (the default)")
+
+    def handle(self, *args, **options):
+        since, until = options['since'], options['until']
+        if since and until and since > until:
+            raise CommandError('--since is after --until.')
+        output = options['output']
+        compress = options['gzip'] or output.endswith('.gz')
+        chunks = archive.export_chunks(options['file_format'], compress, since, until, options['buses'])
+
+        written = 0
+        if output == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+                written += len(chunk)
+            sys.stdout.buffer.flush()
+            return
+        with open(output, 'wb') as stream:
+            for chunk in chunks:
+                stream.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} bytes to {output}.'))
@@ -0,0 +1,43 @@
+# core/management/commands/import_locations.py
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import archive
+
+
+class Command(BaseCommand):
+    help = "Restore location history from a csv or ndjson archive, gzipped or not (see core/archive.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Archive to read, or '-' for stdin")
+        parser.add_argument('--format', choices=archive.FORMATS, dest='file_format',
+                            help='Archive format (default: detected from the first line)')
+        parser.add_argument('--batch-size', type=int, help='Rows checked and inserted at a time (default: HISTORY_ARCHIVE)')
+        parser.add_argument('--no-rollups', action='store_true',
+                            help="Don't rebuild daily stats for the imported days (run rollup_daily_stats later)")
+
+    def handle(self, *args, **options):
+        importer = archive.HistoryImporter(
+            batch_size=options['batch_size'], update_rollups=not options['no_rollups'],
+            log=(lambda message: self.stdout.write(message)) if options['verbosity'] > 1 else None,
+        )
+        try:
+            if options['path'] == '-':
+                counts = importer.run(sys.stdin.buffer, options['file_format'])
+            else:
+                with open(options['path'], 'rb') as stream:
+                    counts = importer.run(stream, options['file_format'])
+        except archive.ArchiveError as e:
+            raise CommandError(f"{e} ({importer.counts['inserted']} rows were inserted before it; rerunning is safe)")
+        except OSError as e:
+            raise CommandError(str(e))
+
+        if importer.unknown_buses:
+            self.stderr.write(self.style.WARNING(
+                f"Skipped {counts['unknown_bus']} row(s) for unknown buses: {', '.join(sorted(importer.unknown_buses))}"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {counts['read']} row(s): {counts['inserted']} inserted, {counts['existing']} already present"
+            + (f", {importer.rollup_rows} daily stats row(s) rebuilt." if importer.update_rollups else '.')
+        ))
@@ -0,0 +1,31 @@
+# core/management/commands/issue_device_token.py
+from django.core.management.base import BaseCommand, CommandError
+
+from core.authentication import issue_device_token
+from core.models import Bus, CustomUser
+
+
+class Command(BaseCommand):
+    help = "Issue a device token for a driver's assigned bus (printed once, only its hash is stored)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Driver username')
+        parser.add_argument('--bus', help='Bus number (default: the bus the driver is assigned to)')
+        parser.add_argument('--name', default='', help='Label for the device')
+
+    def handle(self, *args, **options):
+        try:
+            driver = CustomUser.objects.get(username=options['username'], role='driver')
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No driver named {options['username']!r}")
+
+        buses = Bus.objects.filter(driver=driver)
+        if options['bus']:
+            buses = buses.filter(bus_number=options['bus'])
+        bus = buses.first()
+        if bus is None:
+            raise CommandError(f'{driver.username} is not assigned to {"bus " + options["bus"] if options["bus"] else "any bus"}')
+
+        token, key = issue_device_token(driver, bus, name=options['name'])
+        self.stdout.write(self.style.SUCCESS(f'Issued token #{token.id} for {driver.username} on bus {bus.bus_number}:'))
+        self.stdout.write(key)
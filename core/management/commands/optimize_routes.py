@@ -0,0 +1,51 @@
+# core/management/commands/optimize_routes.py
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import School
+from core.routing import DEFAULT_CAPACITY, DEFAULT_MAX_WALK_M, apply_plan, load_problem, optimize_many
+
+
+class Command(BaseCommand):
+    help = "Plan stop sequences for each school's buses from the students' pickup locations (see core/routing.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('schools', nargs='*', type=int, help='School ids (default: all active schools)')
+        parser.add_argument('--workers', type=int, default=1, help='Solve schools in this many processes')
+        parser.add_argument('--default-capacity', type=int, default=DEFAULT_CAPACITY,
+                            help='Capacity for buses without one')
+        parser.add_argument('--max-walk', type=float, default=DEFAULT_MAX_WALK_M,
+                            help='Merge pickup points into shared stops within this many metres (0: stop at every pickup)')
+        parser.add_argument('--apply', action='store_true',
+                            help="Write the stops into each bus's route and assign the students (default: only report)")
+
+    def handle(self, *args, **options):
+        schools = School.objects.filter(id__in=options['schools']) if options['schools'] else School.objects.filter(is_active=True)
+        schools = list(schools)
+        if not schools:
+            raise CommandError('No matching schools.')
+
+        problems = [load_problem(school, options['default_capacity'], max_walk_m=options['max_walk']) for school in schools]
+        plans = optimize_many(problems, workers=options['workers'])
+
+        names = {school.id: school.name for school in schools}
+        for problem, plan in zip(problems, plans):
+            used = [route for route in plan.routes if route.stops]
+            students = sum(route.load for route in used)
+            total_km = sum(route.distance_m for route in used) / 1000
+            longest_km = max((route.distance_m for route in used), default=0) / 1000
+            self.stdout.write(
+                f'{names[plan.school_id]}: {students} students at {sum(len(route.stops) for route in used)} stops '
+                f'on {len(used)}/{len(problem.buses)} buses, '
+                f'{total_km:.1f} km total, longest route {longest_km:.1f} km, solved in {plan.seconds:.2f}s'
+            )
+            if plan.unassigned:
+                unassigned = sum(len(stop.student_ids) for stop in plan.unassigned)
+                self.stdout.write(self.style.WARNING(f'  {unassigned} students did not fit on any bus'))
+            if options['apply']:
+                cleared = apply_plan(plan)
+                if cleared:
+                    self.stdout.write(self.style.WARNING(
+                        f'  {cleared} students are no longer on a stop of their route and were unassigned'
+                    ))
+        if options['apply']:
+            self.stdout.write(self.style.SUCCESS(f'Applied plans for {len(plans)} school(s).'))
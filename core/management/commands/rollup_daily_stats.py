@@ -0,0 +1,45 @@
+# core/management/commands/rollup_daily_stats.py
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import BusDailyStats, BusLocation
+from core.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-bus daily stats from location history (see core/rollups.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat,
+                            help='First local date to rebuild, YYYY-MM-DD (default: the day before the newest '
+                                 'rolled-up day, or the first day of history if there are no rollups yet)')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last local date to rebuild (default: today)')
+        parser.add_argument('--days', type=int, help='Rebuild this many days up to --until instead of --since')
+        parser.add_argument('--bus', type=int, action='append', dest='buses', help='Only this bus id (repeatable)')
+
+    def handle(self, *args, **options):
+        until = options['until'] or timezone.localdate()
+        if options['days']:
+            since = until - timedelta(days=options['days'] - 1)
+        elif options['since']:
+            since = options['since']
+        else:
+            since = self.catch_up_start()
+            if since is None:
+                self.stdout.write('No location history to roll up.')
+                return
+        if since > until:
+            raise CommandError('--since is after --until.')
+
+        rows = rebuild(since, until, bus_ids=options['buses'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} bus-day row(s) for {since} to {until}.'))
+
+    def catch_up_start(self):
+        newest = BusDailyStats.objects.order_by('-date').values_list('date', flat=True).first()
+        if newest is not None:
+            # The day before too: its last fixes may have been rolled up after it ended, or out of order
+            return newest - timedelta(days=1)
+        oldest = BusLocation.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        return timezone.localdate(oldest) if oldest else None
@@ -0,0 +1,74 @@
+# core/management/commands/simulate_fleet.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.authentication import issue_device_token
+from core.loadgen import ClientTransport, HttpTransport, LoadRun, SimulatedBus, session_headers
+from core.models import Bus, CustomUser, DeviceToken
+
+
+class Command(BaseCommand):
+    help = ('Simulate driver devices posting fixes and parents polling live locations, '
+            'and report throughput, error rate and latency per endpoint (see core/loadgen.py)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buses', type=int, default=50, help='Simulated buses (taken from buses with a driver and a routed stops list)')
+        parser.add_argument('--parents', type=int, default=100, help='Simulated parents polling /api/live-bus-locations/')
+        parser.add_argument('--rate', type=float, default=1.0, help='Fixes per second per bus')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds between polls per parent')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run')
+        parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight at most')
+        parser.add_argument('--url', help='Base URL of a running server, e.g. http://127.0.0.1:8000 (default: in-process test client)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0 or options['poll_interval'] <= 0 or options['duration'] <= 0:
+            raise CommandError('--rate, --poll-interval and --duration must be positive.')
+
+        buses = list(
+            Bus.objects.filter(driver__isnull=False, assigned_route__isnull=False)
+            .select_related('driver', 'assigned_route').order_by('id')[:options['buses']]
+        )
+        buses = [bus for bus in buses if len(bus.assigned_route.stops or []) >= 2]
+        parents = list(CustomUser.objects.filter(role='parent', is_active=True).order_by('id')[:options['parents']])
+        if not buses and not parents:
+            raise CommandError('No buses with a driver and route stops, and no parents. Load a fleet first: load_test_data --fleet')
+        if len(buses) < options['buses'] or len(parents) < options['parents']:
+            self.stdout.write(self.style.WARNING(f'Only {len(buses)} usable buses and {len(parents)} parents available.'))
+
+        tokens = []
+        try:
+            simulated = []
+            for bus in buses:
+                token, key = issue_device_token(bus.driver, bus, name='simulate_fleet')
+                tokens.append(token.id)
+                simulated.append(SimulatedBus(bus.id, key, bus.assigned_route.stops, 1.0 / options['rate']))
+            headers = [session_headers(parent) for parent in parents]
+
+            transport = HttpTransport(options['url']) if options['url'] else ClientTransport()
+            self.stdout.write(
+                f"Simulating {len(simulated)} buses at {options['rate']:g} fix/s and {len(headers)} parents polling every "
+                f"{options['poll_interval']:g}s for {options['duration']:g}s against {options['url'] or 'the in-process client'}..."
+            )
+            results = LoadRun(
+                transport, simulated, headers, rate=options['rate'], poll_interval=options['poll_interval'],
+                duration=options['duration'], concurrency=options['concurrency'],
+            ).run()
+        finally:
+            DeviceToken.objects.filter(id__in=tokens).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f'  {"endpoint":<20} {"requests":>9} {"req/s":>8} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"lag ms":>8}')
+        for endpoint, summary in results.items():
+            if not summary['requests']:
+                continue
+            self.stdout.write(
+                f'  {endpoint:<20} {summary["requests"]:>9} {summary["throughput_rps"]:>8.1f} {summary["error_rate"]:>7.1%} '
+                f'{summary["p50_ms"]:>8.1f} {summary["p95_ms"]:>8.1f} {summary["p99_ms"]:>8.1f} {summary["max_lag_ms"]:>8.1f}'
+            )
+            failures = {status: count for status, count in summary['statuses'].items() if not (isinstance(status, int) and status < 400)}
+            if failures:
+                self.stdout.write(self.style.WARNING(f'    failures: {failures}'))
@@ -0,0 +1,237 @@
+# core/metrics.py
+"""
+Opt-in per-request instrumentation, exported in the Prometheus text format.
+
+With REQUEST_METRICS['ENABLED'], RequestMetricsMiddleware measures a random
+SAMPLE_RATE share of requests. For each sampled request it records, per view
+name:
+- wall time;
+- SQL query count and total SQL time (through a connection execute_wrapper);
+- duplicate queries, i.e. queries whose SQL text (before parameters) already
+  ran in the same request, which is how an N+1 shows up;
+- response size.
+Unsampled requests cost one random() call.
+
+The values go into in-process histograms, served by metrics_view at
+/metrics/. Each worker process has its own registry, so with several workers
+every worker is a separate scrape target (or each reports only its own share).
+The endpoint takes `Authorization: Bearer <REQUEST_METRICS['TOKEN']>` or a
+staff session. It also serves the ingest metrics that core/ingest_metrics.py
+registers, which are recorded whether or not request metrics are enabled.
+"""
+import bisect
+import random
+import secrets
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'TOKEN': None,
+}
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus model."""
+
+    def __init__(self, name, help_text, buckets, labels):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            braced = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{braced} {values[-1]}')
+            lines.append(f'{self.name}_count{braced} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}' if labels else f'{self.name} {value}')
+        return lines
+
+
+class Gauge:
+    """A gauge whose values are read from `collect()` (returning {label values: value}) at scrape time."""
+
+    def __init__(self, name, help_text, labels, collect):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        for label_values, value in sorted(self.collect().items()):
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}' if labels else f'{self.name} {value}')
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    'busmonitor_sampled_requests_total', 'Sampled requests by view, method and status class.',
+    ('view', 'method', 'status'),
+))
+DURATION = registry.register(Histogram(
+    'busmonitor_request_duration_seconds', 'Wall time of sampled requests.', DURATION_BUCKETS, ('view', 'method'),
+))
+QUERIES = registry.register(Histogram(
+    'busmonitor_request_queries', 'SQL queries per sampled request.', QUERY_BUCKETS, ('view',),
+))
+QUERY_TIME = registry.register(Histogram(
+    'busmonitor_request_query_seconds', 'Total SQL time per sampled request.', DURATION_BUCKETS, ('view',),
+))
+DUPLICATES = registry.register(Histogram(
+    'busmonitor_request_duplicate_queries', 'Queries per sampled request whose SQL already ran in that request.',
+    QUERY_BUCKETS, ('view',),
+))
+RESPONSE_SIZE = registry.register(Histogram(
+    'busmonitor_response_bytes', 'Response body size of sampled requests (not streaming responses).',
+    SIZE_BUCKETS, ('view',),
+))
+
+
+class QueryRecorder:
+    """connection.execute_wrapper that counts, times and de-duplicates the queries it sees."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.seen = set()
+        self.duplicates = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            if sql in self.seen:
+                self.duplicates += 1
+            else:
+                self.seen.add(sql)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match.route or 'unresolved'
+
+
+class RequestMetricsMiddleware:
+    """Records the metrics above for a sample of requests; a no-op unless REQUEST_METRICS['ENABLED']."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        conf = metrics_settings()
+        if not conf['ENABLED'] or random.random() >= conf['SAMPLE_RATE']:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        view = view_label(request)
+        REQUESTS.inc(view, request.method, f'{response.status_code // 100}xx')
+        DURATION.observe(elapsed, view, request.method)
+        QUERIES.observe(recorder.count, view)
+        QUERY_TIME.observe(recorder.seconds, view)
+        DUPLICATES.observe(recorder.duplicates, view)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(len(response.content), view)
+        return response
+
+
+def metrics_view(request):
+    """Prometheus text exposition of this process's metrics."""
+    token = metrics_settings()['TOKEN']
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = (
+        (token and header.startswith('Bearer ') and secrets.compare_digest(header[7:], token))
+        or (request.user.is_authenticated and request.user.is_staff)
+    )
+    if not authorized:
+        return HttpResponseForbidden('Forbidden')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_bus_last_known_heading_bus_last_known_speed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="buslocation",
+            name="seq",
+            field=models.BigIntegerField(
+                blank=True,
+                help_text="Per-device fix sequence number, used to drop retried fixes",
+                null=True,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="buslocation",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("seq__isnull", False)),
+                fields=("bus", "seq"),
+                name="unique_bus_location_seq",
+            ),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2 on 2026-10-19 17:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_devicetoken"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BusDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("fixes", models.PositiveIntegerField(default=0)),
+                ("distance_m", models.FloatField(default=0)),
+                ("speed_sum", models.FloatField(default=0)),
+                ("speed_count", models.PositiveIntegerField(default=0)),
+                ("max_speed", models.FloatField(blank=True, null=True)),
+                ("trips_started", models.PositiveIntegerField(default=0)),
+                ("trips_completed", models.PositiveIntegerField(default=0)),
+                (
+                    "trips_scheduled",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Completed trips whose route has an end time",
+                    ),
+                ),
+                ("trips_on_time", models.PositiveIntegerField(default=0)),
+                ("first_fix_at", models.DateTimeField(blank=True, null=True)),
+                ("last_fix_at", models.DateTimeField(blank=True, null=True)),
+                ("last_latitude", models.FloatField(blank=True, null=True)),
+                ("last_longitude", models.FloatField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "bus",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="core.bus",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Bus daily stats",
+                "ordering": ["-date", "bus"],
+                "indexes": [models.Index(fields=["date"], name="bus_daily_stats_date")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("bus", "date"), name="unique_bus_daily_stats"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 5.2 on 2026-10-19 17:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_busdailystats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HistoryReport",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("since", models.DateField()),
+                ("until", models.DateField()),
+                ("fixes_scanned", models.BigIntegerField(default=0)),
+                ("seconds", models.FloatField(default=0)),
+                ("parameters", models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.CreateModel(
+            name="HistoryReportRow",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("segment_speed", "Segment speed"),
+                            ("stop_dwell", "Stop dwell"),
+                            ("hotspot", "Congestion hotspot"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("index", models.IntegerField(blank=True, null=True)),
+                ("hour", models.PositiveSmallIntegerField()),
+                ("latitude", models.FloatField(blank=True, null=True)),
+                ("longitude", models.FloatField(blank=True, null=True)),
+                ("samples", models.PositiveIntegerField(default=0)),
+                ("mean_speed", models.FloatField(blank=True, null=True)),
+                ("median_speed", models.FloatField(blank=True, null=True)),
+                ("p85_speed", models.FloatField(blank=True, null=True)),
+                ("slow_share", models.FloatField(blank=True, null=True)),
+                ("mean_dwell_seconds", models.FloatField(blank=True, null=True)),
+                ("p85_dwell_seconds", models.FloatField(blank=True, null=True)),
+                (
+                    "report",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rows",
+                        to="core.historyreport",
+                    ),
+                ),
+                (
+                    "route",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="core.route",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["kind", "route", "index", "hour"],
+                "indexes": [
+                    models.Index(
+                        fields=["report", "kind"], name="history_report_row_kind"
+                    )
+                ],
+            },
+        ),
+    ]
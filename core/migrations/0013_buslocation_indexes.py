@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 17:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_bulkimportjob"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="buslocation",
+            name="bus",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="core.bus",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="buslocation",
+            index=models.Index(
+                fields=["bus", "timestamp"], name="bus_location_bus_time"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="buslocation",
+            index=models.Index(fields=["timestamp"], name="bus_location_time"),
+        ),
+    ]
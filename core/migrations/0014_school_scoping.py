@@ -0,0 +1,147 @@
+# Generated by Django 5.2 on 2026-10-19 17:25
+
+import django.contrib.auth.models
+import django.db.models.deletion
+import django.db.models.manager
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("core", "0013_buslocation_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="bus",
+            options={
+                "default_manager_name": "all_objects",
+                "permissions": [
+                    ("can_assign_driver", "Can assign a driver to a bus"),
+                    (
+                        "can_update_maintenance_status",
+                        "Can update bus maintenance status",
+                    ),
+                ],
+                "verbose_name_plural": "Buses",
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="customuser",
+            options={"default_manager_name": "all_objects", "verbose_name": "User"},
+        ),
+        migrations.AlterModelOptions(
+            name="route",
+            options={
+                "default_manager_name": "all_objects",
+                "permissions": [
+                    ("can_assign_bus_to_route", "Can assign a bus to a route")
+                ],
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="student",
+            options={
+                "default_manager_name": "all_objects",
+                "permissions": [
+                    ("can_assign_student_to_route", "Can assign a student to a route"),
+                    (
+                        "can_view_student_details",
+                        "Can view detailed student information",
+                    ),
+                ],
+            },
+        ),
+        migrations.AlterModelManagers(
+            name="bus",
+            managers=[
+                ("all_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name="customuser",
+            managers=[
+                ("all_objects", django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name="route",
+            managers=[
+                ("all_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name="student",
+            managers=[
+                ("all_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="bus",
+            name="school",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="buses",
+                to="core.school",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="customuser",
+            name="school",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="users",
+                to="core.school",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="route",
+            name="school",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="routes",
+                to="core.school",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="student",
+            name="school",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="students",
+                to="core.school",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bus",
+            index=models.Index(fields=["school", "status"], name="bus_school_status"),
+        ),
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(fields=["school", "role"], name="user_school_role"),
+        ),
+        migrations.AddIndex(
+            model_name="route",
+            index=models.Index(fields=["school", "bus"], name="route_school_bus"),
+        ),
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(
+                fields=["school", "assigned_route"], name="student_school_route"
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-19 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0014_school_scoping"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="buslocation",
+            name="unique_bus_location_seq",
+        ),
+        migrations.AddField(
+            model_name="buslocation",
+            name="device",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Id of the DeviceToken that sent the fix, if any",
+                null=True,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="buslocation",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("device__isnull", False), ("seq__isnull", False)),
+                fields=("device", "seq"),
+                name="unique_device_location_seq",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="buslocation",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("device__isnull", True), ("seq__isnull", False)),
+                fields=("bus", "seq"),
+                name="unique_bus_location_seq",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0015_buslocation_device"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bus",
+            name="location_updated_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
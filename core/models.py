@@ -1,9 +1,11 @@
 # apps/accounts/models.py
-from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.contrib.auth.models import AbstractUser, Group, Permission, UserManager
 from django.db import models
 from django.utils.timezone import now
 from django.contrib.contenttypes.models import ContentType
 
+from core.tenancy import SchoolScopedManager, SchoolScopedUserManager
+
 class School(models.Model):
     name = models.CharField(max_length=255)
     address = models.TextField()
@@ -35,7 +37,8 @@ class CustomUser(AbstractUser):
         on_delete=models.SET_NULL, 
         null=True, 
         blank=True,
-        related_name='users'
+        related_name='users',
+        db_index=False,  # led by user_school_role instead
     )
 
     # Add related_name to avoid clashes
@@ -54,11 +57,19 @@ class CustomUser(AbstractUser):
         related_query_name="custom_user",
     )
 
+    # Only the current school's users while a request is bound to one (core/tenancy.py)
+    objects = SchoolScopedUserManager()
+    all_objects = UserManager()
+
     def __str__(self):
         return f"{self.username} ({self.school.name if self.school else 'No School'})"
 
     class Meta:
         verbose_name = 'User'
+        default_manager_name = 'all_objects'
+        indexes = [
+            models.Index(fields=['school', 'role'], name='user_school_role'),
+        ]
 
 class Bus(models.Model):
     STATUS_CHOICES = (
@@ -74,7 +85,8 @@ class Bus(models.Model):
         on_delete=models.CASCADE,
         related_name='buses',
         null=True,
-        blank=True
+        blank=True,
+        db_index=False,  # led by the school indexes in Meta instead
     )
     capacity = models.IntegerField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
@@ -83,10 +95,15 @@ class Bus(models.Model):
     last_known_location_time = models.DateTimeField(null=True, blank=True)
     last_known_speed = models.FloatField(null=True, blank=True)  # ✅ Add this field
     last_known_heading = models.FloatField(null=True, blank=True)  # ✅ Add this field
+    # Server time of the last write of last_known_*; the device's clock may run ahead or behind
+    location_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
     last_maintenance_date = models.DateField(null=True, blank=True)
     next_maintenance_due = models.DateField(null=True, blank=True)
     maintenance_status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
 
+    objects = SchoolScopedManager()  # the current school's buses only (core/tenancy.py)
+    all_objects = models.Manager()
+
     def __str__(self):
         return f"{self.bus_number} ({self.school.name if self.school else 'No School'})"
 
@@ -102,10 +119,14 @@ class Bus(models.Model):
 
     @property
     def route(self):
-        return Route.objects.filter(bus=self).first()
+        return Route.all_objects.filter(bus=self).first()
     
     class Meta:
         verbose_name_plural = "Buses"
+        default_manager_name = 'all_objects'
+        indexes = [
+            models.Index(fields=['school', 'status'], name='bus_school_status'),
+        ]
         permissions = [
             ("can_assign_driver", "Can assign a driver to a bus"),
             ("can_update_maintenance_status", "Can update bus maintenance status"),
@@ -119,17 +140,25 @@ class Route(models.Model):
         on_delete=models.CASCADE,
         related_name='routes',
         null=True,
-        blank=True
+        blank=True,
+        db_index=False,  # led by the school indexes in Meta instead
     )
     start_time = models.TimeField(null=True, blank=True)
     end_time = models.TimeField(null=True, blank=True)
     stops = models.JSONField(default=list, blank=True)  # For storing route waypoints
 
+    objects = SchoolScopedManager()  # the current school's routes only (core/tenancy.py)
+    all_objects = models.Manager()
+
     def __str__(self):
         return f"{self.name} ({self.school.name if self.school else 'No School'})"
 
     class Meta:
         unique_together = ('name', 'school')
+        default_manager_name = 'all_objects'
+        indexes = [
+            models.Index(fields=['school', 'bus'], name='route_school_bus'),
+        ]
         permissions = [
             ("can_assign_bus_to_route", "Can assign a bus to a route"),
         ]
@@ -144,24 +173,32 @@ class Student(models.Model):
         on_delete=models.CASCADE,
         related_name='students',
         null=True,
-        blank=True
+        blank=True,
+        db_index=False,  # led by the school indexes in Meta instead
     )
     student_id = models.CharField(max_length=50, unique=True, null=True, blank=True)
     grade_level = models.CharField(max_length=20, blank=True, null=True)
     home_address = models.TextField(blank=True, null=True)
     pickup_location = models.JSONField(null=True, blank=True)  # {lat: x, lng: y}
 
+    objects = SchoolScopedManager()  # the current school's students only (core/tenancy.py)
+    all_objects = models.Manager()
+
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.school.name if self.school else 'No School'})"
 
     class Meta:
+        default_manager_name = 'all_objects'
+        indexes = [
+            models.Index(fields=['school', 'assigned_route'], name='student_school_route'),
+        ]
         permissions = [
             ("can_assign_student_to_route", "Can assign a student to a route"),
             ("can_view_student_details", "Can view detailed student information"),
         ]
 
 class BusLocation(models.Model):
-    bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, db_index=False)  # led by bus_location_bus_time instead
     latitude = models.FloatField()
     longitude = models.FloatField()
     timestamp = models.DateTimeField(default=now)
@@ -169,17 +206,164 @@ class BusLocation(models.Model):
     heading = models.FloatField(null=True, blank=True)  # Direction in degrees
     is_trip_start = models.BooleanField(default=False)  # Add this field
     is_trip_end = models.BooleanField(default=False)   # Add this field
+    seq = models.BigIntegerField(null=True, blank=True, help_text="Per-device fix sequence number, used to drop retried fixes")
+    # Not a ForeignKey: history outlives revoked tokens, and seqs stay unique per device
+    device = models.PositiveIntegerField(null=True, blank=True, help_text="Id of the DeviceToken that sent the fix, if any")
 
     def __str__(self):
         return f"{self.bus.bus_number} at ({self.latitude}, {self.longitude})"
 
     class Meta:
         ordering = ['-timestamp']
+        constraints = [
+            # A bus may have several devices, each counting its own seqs; session-auth fixes share the bus's
+            models.UniqueConstraint(fields=['device', 'seq'], condition=models.Q(seq__isnull=False, device__isnull=False),
+                                    name='unique_device_location_seq'),
+            models.UniqueConstraint(fields=['bus', 'seq'], condition=models.Q(seq__isnull=False, device__isnull=True),
+                                    name='unique_bus_location_seq'),
+        ]
+        indexes = [
+            models.Index(fields=['bus', 'timestamp'], name='bus_location_bus_time'),  # a bus's history, in order
+            models.Index(fields=['timestamp'], name='bus_location_time'),  # newest first, date ranges
+        ]
         permissions = [
             ("can_view_bus_location", "Can view real-time bus locations"),
             ("can_submit_bus_location", "Can submit bus location data"),
         ]
 
+class DeviceToken(models.Model):
+    """API token for a driver's device, bound to the bus the driver is assigned to."""
+    driver = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='device_tokens')
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='device_tokens')
+    key_digest = models.CharField(max_length=64, unique=True)  # sha256 of the token, the token itself is never stored
+    name = models.CharField(max_length=100, blank=True, help_text="Label for the device, e.g. phone model")
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"Device token for {self.bus.bus_number} ({self.driver.username})"
+
+class BusDailyStats(models.Model):
+    """Per-bus per-day rollup of BusLocation, maintained by core/rollups.py."""
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()  # local date (TIME_ZONE) of the fixes
+    fixes = models.PositiveIntegerField(default=0)
+    distance_m = models.FloatField(default=0)
+    speed_sum = models.FloatField(default=0)  # over fixes that reported a speed
+    speed_count = models.PositiveIntegerField(default=0)
+    max_speed = models.FloatField(null=True, blank=True)
+    trips_started = models.PositiveIntegerField(default=0)
+    trips_completed = models.PositiveIntegerField(default=0)
+    trips_scheduled = models.PositiveIntegerField(default=0, help_text="Completed trips whose route has an end time")
+    trips_on_time = models.PositiveIntegerField(default=0)
+    first_fix_at = models.DateTimeField(null=True, blank=True)
+    last_fix_at = models.DateTimeField(null=True, blank=True)
+    last_latitude = models.FloatField(null=True, blank=True)  # where the distance resumes from
+    last_longitude = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.bus.bus_number} on {self.date}"
+
+    @property
+    def average_speed(self):
+        return self.speed_sum / self.speed_count if self.speed_count else None
+
+    @property
+    def on_time_percentage(self):
+        return 100.0 * self.trips_on_time / self.trips_scheduled if self.trips_scheduled else None
+
+    class Meta:
+        verbose_name_plural = "Bus daily stats"
+        ordering = ['-date', 'bus']
+        constraints = [
+            models.UniqueConstraint(fields=['bus', 'date'], name='unique_bus_daily_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='bus_daily_stats_date'),
+        ]
+
+class HistoryReport(models.Model):
+    """One run of `manage.py analyze_history` over a range of location history (core/analytics.py)."""
+    created_at = models.DateTimeField(auto_now_add=True)
+    since = models.DateField()
+    until = models.DateField()
+    fixes_scanned = models.BigIntegerField(default=0)
+    seconds = models.FloatField(default=0)
+    parameters = models.JSONField(default=dict, blank=True)
+
+    def __str__(self):
+        return f"History report {self.since} to {self.until}"
+
+    class Meta:
+        ordering = ['-created_at']
+
+class HistoryReportRow(models.Model):
+    KIND_CHOICES = (
+        ('segment_speed', 'Segment speed'),  # route segment (stop i to i+1) by hour of day
+        ('stop_dwell', 'Stop dwell'),  # route stop by hour of day
+        ('hotspot', 'Congestion hotspot'),  # grid cell by hour of day
+    )
+    report = models.ForeignKey(HistoryReport, on_delete=models.CASCADE, related_name='rows')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    route = models.ForeignKey(Route, on_delete=models.SET_NULL, null=True, blank=True)
+    index = models.IntegerField(null=True, blank=True)  # segment or stop index along the route
+    hour = models.PositiveSmallIntegerField()  # local hour of day, 0-23
+    latitude = models.FloatField(null=True, blank=True)  # segment midpoint, stop or cell centre
+    longitude = models.FloatField(null=True, blank=True)
+    samples = models.PositiveIntegerField(default=0)  # fixes, or visits for stop_dwell
+    mean_speed = models.FloatField(null=True, blank=True)
+    median_speed = models.FloatField(null=True, blank=True)
+    p85_speed = models.FloatField(null=True, blank=True)
+    slow_share = models.FloatField(null=True, blank=True)  # share of fixes below the congestion speed
+    mean_dwell_seconds = models.FloatField(null=True, blank=True)
+    p85_dwell_seconds = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.index} at {self.hour}:00"
+
+    class Meta:
+        ordering = ['kind', 'route', 'index', 'hour']
+        indexes = [
+            models.Index(fields=['report', 'kind'], name='history_report_row_kind'),
+        ]
+
+class BulkImportJob(models.Model):
+    """A CSV upload applied in the background by core/bulk_import.py, with its progress."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('validating', 'Validating'),
+        ('importing', 'Importing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    model = models.CharField(max_length=100)  # app_label.ModelName of an admin with a resource_class
+    file = models.FileField(upload_to='imports/')
+    dry_run = models.BooleanField(default=False, help_text="Only validate and count the changes")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='import_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    unchanged = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)  # [{'line': n, 'error': message}], the first few only
+    message = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"Import of {self.model} #{self.pk} ({self.status})"
+
+    @property
+    def progress(self):
+        return 100.0 * self.processed_rows / self.total_rows if self.total_rows else None
+
+    class Meta:
+        ordering = ['-created_at']
+
 class Notification(models.Model):
     TYPE_CHOICES = (
         ('alert', 'Alert'),
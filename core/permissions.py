@@ -0,0 +1,122 @@
+# core/permissions.py
+"""
+Permission checks answered from one set per request.
+
+The admin's has_*_permission methods run for every model on the index page
+and for every row of a changelist, and most check several permissions.
+get_permissions(request) resolves the user's effective permissions once per
+request, then answers every check from memory. It takes them from every
+authentication backend, i.e. the user's own and group permissions
+(ModelBackend) plus the ones their role grants (RolePermissionBackend). The
+result is cached on the request's user object, which Django builds once per
+request.
+
+RolePermissionBackend grants permissions by CustomUser.role, so a school
+administrator doesn't need a group set up before the admin works for them.
+ROLE_PERMISSIONS maps each role to a list of permission names. A name may
+hold `*` wildcards to match several of the app's permissions, e.g. 'core.*'
+or 'core.*_bus'. The patterns are expanded from the models'
+Meta.permissions and default_permissions, without querying the database.
+Because the backend is listed in AUTHENTICATION_BACKENDS, user.has_perm()
+and templates' {{ perms }} see the role permissions too.
+"""
+import threading
+from fnmatch import fnmatchcase
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_permission_codename
+from django.contrib.auth.backends import BaseBackend
+
+DEFAULTS = {
+    'superuser': ['core.*'],
+    'admin': [
+        # Every permission of the models the admin scopes to the user's school (core/tenancy.py)
+        'core.*_customuser', 'core.*_bus', 'core.*_route', 'core.*_student', 'core.*_concern', 'core.*_notification',
+        'core.can_assign_driver', 'core.can_update_maintenance_status', 'core.can_assign_bus_to_route',
+        'core.can_assign_student_to_route', 'core.can_view_student_details', 'core.can_view_all_concerns',
+        'core.can_manage_concerns', 'core.can_send_notification', 'core.can_view_notifications',
+        # Read-only, also scoped
+        'core.view_buslocation', 'core.can_view_bus_location', 'core.view_devicetoken', 'core.view_busdailystats',
+        'core.view_bulkimportjob',
+    ],
+    'staff': [
+        'core.view_customuser', 'core.view_bus', 'core.view_route', 'core.view_student', 'core.view_concern',
+        'core.view_notification', 'core.view_buslocation', 'core.view_busdailystats',
+    ],
+    'driver': ['core.can_submit_bus_location', 'core.can_update_maintenance_status'],
+    'parent': [],
+}
+
+_role_permissions = {}
+_role_permissions_lock = threading.Lock()
+
+
+def role_permission_settings():
+    return {**DEFAULTS, **getattr(settings, 'ROLE_PERMISSIONS', {})}
+
+
+def model_permission_names(app_label):
+    """Every 'app_label.codename' the app's models define, default and custom."""
+    names = set()
+    for model in apps.get_app_config(app_label).get_models():
+        opts = model._meta
+        names.update(f'{app_label}.{get_permission_codename(action, opts)}' for action in opts.default_permissions)
+        names.update(f'{app_label}.{codename}' for codename, _ in opts.permissions)
+    return names
+
+
+def role_permissions(role):
+    """The permission names ROLE_PERMISSIONS grants a role, with patterns expanded; cached per process."""
+    permissions = _role_permissions.get(role)
+    if permissions is None:
+        with _role_permissions_lock:
+            names = set()
+            for name in role_permission_settings().get(role, []):
+                if '*' in name:
+                    names.update(
+                        permission for permission in model_permission_names(name.split('.', 1)[0])
+                        if fnmatchcase(permission, name)
+                    )
+                else:
+                    names.add(name)
+            permissions = _role_permissions[role] = frozenset(names)
+    return permissions
+
+
+class RolePermissionBackend(BaseBackend):
+    """Grants active users the permissions of their CustomUser.role; never authenticates anyone."""
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        return set(role_permissions(getattr(user_obj, 'role', None)))
+
+
+class PermissionSet:
+    """A user's effective permissions, resolved once."""
+
+    def __init__(self, user):
+        self.is_superuser = user.is_active and user.is_superuser
+        self.role = getattr(user, 'role', None)
+        self.permissions = frozenset(user.get_all_permissions()) if user.is_active else frozenset()
+
+    def has(self, *permissions):
+        """True if the user has every one of the permissions."""
+        return self.is_superuser or all(permission in self.permissions for permission in permissions)
+
+    def has_any(self, *permissions):
+        return self.is_superuser or any(permission in self.permissions for permission in permissions)
+
+    def has_module(self, app_label):
+        prefix = app_label + '.'
+        return self.is_superuser or any(permission.startswith(prefix) for permission in self.permissions)
+
+
+def get_permissions(request):
+    """The PermissionSet of the request's user, built on first use in the request."""
+    user = request.user
+    permissions = getattr(user, '_permission_set', None)
+    if permissions is None:
+        permissions = user._permission_set = PermissionSet(user)
+    return permissions
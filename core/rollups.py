@@ -0,0 +1,187 @@
+# core/rollups.py
+"""
+Per-bus per-day rollups of BusLocation (BusDailyStats): fixes, distance
+driven, average and top speed, trips started/completed and on-time trips.
+Dashboards, the analytics API and the admin read these rows instead of
+scanning location history.
+
+Rows are kept up to date incrementally. ingest.write_fixes calls apply_fixes
+with the fixes of every batch it stores, in the same transaction; retried
+fixes it drops as already stored are not passed on. The fixes are added to
+their (bus, local date) row, and distance continues from the last position
+stored on that row. A trip counts as on time when its end marker arrives no
+later than the route's end_time plus ON_TIME_GRACE_MINUTES.
+
+A fix older than its row's last fix still counts towards fixes and speed but
+adds no distance. `manage.py rollup_daily_stats` rebuilds days from the
+history, which repairs that and fills in days from before the rollups existed
+(or with ROLLUPS['INCREMENTAL'] off). replay_spool and import_locations
+rebuild the days they insert history for.
+"""
+from datetime import datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.geometry import haversine_m
+from core.models import Bus, BusDailyStats, BusLocation, Route
+
+DEFAULTS = {
+    'INCREMENTAL': True,
+    'ON_TIME_GRACE_MINUTES': 5,
+}
+
+TOTAL_FIELDS = [
+    'fixes', 'distance_m', 'speed_sum', 'speed_count', 'max_speed',
+    'trips_started', 'trips_completed', 'trips_scheduled', 'trips_on_time',
+    'first_fix_at', 'last_fix_at', 'last_latitude', 'last_longitude',
+]
+
+
+def rollup_settings():
+    return {**DEFAULTS, **getattr(settings, 'ROLLUPS', {})}
+
+
+class DayTotals:
+    """Running totals for one bus on one day; fixes must be added oldest first."""
+
+    def __init__(self, row=None):
+        for field in TOTAL_FIELDS:
+            setattr(self, field, getattr(row, field) if row is not None else None)
+        for field in ('fixes', 'distance_m', 'speed_sum', 'speed_count',
+                      'trips_started', 'trips_completed', 'trips_scheduled', 'trips_on_time'):
+            if getattr(self, field) is None:
+                setattr(self, field, 0)
+
+    def add(self, latitude, longitude, speed, timestamp, is_trip_start=False, is_trip_end=False, deadline=None):
+        """deadline: latest on-time end for a trip ending at `timestamp`, or None if the route has no end_time."""
+        if is_trip_start:
+            self.trips_started += 1
+            return
+        if is_trip_end:
+            self.trips_completed += 1
+            if deadline is not None:
+                self.trips_scheduled += 1
+                self.trips_on_time += timestamp <= deadline
+            return
+
+        self.fixes += 1
+        if speed is not None:
+            self.speed_sum += speed
+            self.speed_count += 1
+            self.max_speed = speed if self.max_speed is None else max(self.max_speed, speed)
+        if self.first_fix_at is None or timestamp < self.first_fix_at:
+            self.first_fix_at = timestamp
+        if self.last_fix_at is None or timestamp >= self.last_fix_at:
+            if self.last_latitude is not None:
+                self.distance_m += haversine_m((self.last_latitude, self.last_longitude), (latitude, longitude))
+            self.last_fix_at = timestamp
+            self.last_latitude, self.last_longitude = latitude, longitude
+
+    def apply_to(self, row):
+        for field in TOTAL_FIELDS:
+            setattr(row, field, getattr(self, field))
+        row.updated_at = timezone.now()
+        return row
+
+
+def route_end_times(bus_ids):
+    """{bus_id: route end_time} for the given buses' routes that have one."""
+    return dict(
+        Route.all_objects.filter(bus_id__in=bus_ids, end_time__isnull=False).values_list('bus_id', 'end_time')
+    )
+
+
+def on_time_deadline(timestamp, end_time, grace):
+    """Latest on-time trip end on timestamp's local day for a route ending at end_time, or None."""
+    if end_time is None:
+        return None
+    return timezone.make_aware(datetime.combine(timezone.localdate(timestamp), end_time)) + grace
+
+
+def apply_fixes(fixes):
+    """Adds stored fixes (core.ingest.Fix) to their buses' daily rows. Call inside the write's transaction."""
+    conf = rollup_settings()
+    if not conf['INCREMENTAL'] or not fixes:
+        return
+    groups = {}  # (bus_id, local date) -> fixes, oldest first
+    for fix in sorted(fixes, key=lambda fix: (fix.bus_id, fix.timestamp)):
+        if fix.latitude is None:
+            continue  # not stored either: a trip marker for a bus with no position yet
+        groups.setdefault((fix.bus_id, timezone.localdate(fix.timestamp)), []).append(fix)
+    if not groups:
+        return
+    bus_ids = {bus_id for bus_id, _ in groups}
+    end_times = route_end_times(bus_ids) if any(fix.is_trip_end for fix in fixes) else {}
+    grace = timedelta(minutes=conf['ON_TIME_GRACE_MINUTES'])
+
+    with transaction.atomic():
+        # Create missing rows first (a concurrent writer may create the same ones), then lock them all
+        BusDailyStats.objects.bulk_create(
+            [BusDailyStats(bus_id=bus_id, date=date) for bus_id, date in groups], ignore_conflicts=True,
+        )
+        rows = {
+            (row.bus_id, row.date): row
+            for row in BusDailyStats.objects.select_for_update().filter(
+                bus_id__in=bus_ids, date__in={date for _, date in groups},
+            )
+        }
+        updated = []
+        for key, group in groups.items():
+            row = rows[key]
+            totals = DayTotals(row)
+            for fix in group:
+                totals.add(
+                    fix.latitude, fix.longitude, fix.speed, fix.timestamp, fix.is_trip_start, fix.is_trip_end,
+                    on_time_deadline(fix.timestamp, end_times.get(fix.bus_id), grace) if fix.is_trip_end else None,
+                )
+            updated.append(totals.apply_to(row))
+        BusDailyStats.objects.bulk_update(updated, TOTAL_FIELDS + ['updated_at'], batch_size=500)
+
+
+def day_bounds(since, until):
+    """Aware datetimes spanning local dates since..until inclusive."""
+    start = timezone.make_aware(datetime.combine(since, dt_time.min))
+    end = timezone.make_aware(datetime.combine(until + timedelta(days=1), dt_time.min))
+    return start, end
+
+
+def rebuild(since, until, bus_ids=None, chunk_size=5000):
+    """
+    Recomputes the rows for local dates since..until (inclusive) from
+    BusLocation, one bus at a time, replacing what is stored. Buses with no
+    history in the range lose their rows for it. Returns the number of rows written.
+    """
+    conf = rollup_settings()
+    grace = timedelta(minutes=conf['ON_TIME_GRACE_MINUTES'])
+    start, end = day_bounds(since, until)
+    if bus_ids is None:
+        bus_ids = list(Bus.objects.order_by('id').values_list('id', flat=True))
+    end_times = route_end_times(bus_ids)
+
+    written = 0
+    for bus_id in bus_ids:
+        days = {}  # local date -> DayTotals
+        rows = (
+            BusLocation.objects
+            .filter(bus_id=bus_id, timestamp__gte=start, timestamp__lt=end)
+            .order_by('timestamp')
+            .values_list('latitude', 'longitude', 'speed', 'timestamp', 'is_trip_start', 'is_trip_end')
+            .iterator(chunk_size=chunk_size)
+        )
+        for latitude, longitude, speed, timestamp, is_trip_start, is_trip_end in rows:
+            date = timezone.localdate(timestamp)
+            totals = days.get(date)
+            if totals is None:
+                totals = days[date] = DayTotals()
+            deadline = on_time_deadline(timestamp, end_times.get(bus_id), grace) if is_trip_end else None
+            totals.add(latitude, longitude, speed, timestamp, is_trip_start, is_trip_end, deadline)
+
+        with transaction.atomic():
+            BusDailyStats.objects.filter(bus_id=bus_id, date__gte=since, date__lte=until).delete()
+            BusDailyStats.objects.bulk_create([
+                totals.apply_to(BusDailyStats(bus_id=bus_id, date=date)) for date, totals in sorted(days.items())
+            ], batch_size=500)
+        written += len(days)
+    return written
@@ -0,0 +1,329 @@
+# core/routing.py
+"""
+Route planning: turns a school's pickup points into capacity-respecting stop
+sequences for its buses.
+
+1. Sweep: stops are ordered by bearing around the school, starting after the
+   widest empty sector. They are then cut into consecutive chunks that fit each
+   bus, largest bus first.
+2. Sequencing: each chunk gets a nearest-neighbour tour over a precomputed
+   distance matrix. 2-opt and Or-opt moves then improve it until no move
+   helps. A route is an open path that ends at the school (the morning run).
+   A zero-cost dummy start node fixes both ends, so the moves need no special
+   cases.
+
+Before that, cluster_stops can merge nearby pickup points into shared stops
+that nobody walks more than max_walk_m to. Neighbours are found through a
+spatial hash with cells max_walk_m wide, so each point is compared only with
+the points in its own and the eight surrounding cells.
+
+Distances are straight-line metres on a local equirectangular projection,
+which is accurate well within 1% at district scale. Problems are plain
+namedtuples, so optimize_many can solve schools in worker processes.
+"""
+import math
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import transaction
+
+from core.geometry import EARTH_RADIUS_M, parse_coordinate
+
+DEFAULT_CAPACITY = 50
+DEFAULT_MAX_WALK_M = 400
+OR_OPT_SEGMENTS = (1, 2, 3)
+
+PlanStop = namedtuple('PlanStop', ['lat', 'lng', 'student_ids'])
+PlanBus = namedtuple('PlanBus', ['bus_id', 'capacity'])
+SchoolProblem = namedtuple('SchoolProblem', ['school_id', 'depot', 'buses', 'stops'])
+BusRoute = namedtuple('BusRoute', ['bus_id', 'stops', 'distance_m', 'load'])
+SchoolPlan = namedtuple('SchoolPlan', ['school_id', 'routes', 'unassigned', 'seconds'])
+
+
+def project(points, origin):
+    """(lat, lng) points -> (x, y) metres on a plane tangent at origin."""
+    lat0 = math.radians(origin[0])
+    kx = EARTH_RADIUS_M * math.cos(lat0) * math.pi / 180
+    ky = EARTH_RADIUS_M * math.pi / 180
+    return [((lng - origin[1]) * kx, (lat - origin[0]) * ky) for lat, lng in points]
+
+
+def distance_matrix(xy):
+    return [[math.hypot(ax - bx, ay - by) for bx, by in xy] for ax, ay in xy]
+
+
+def sweep(stops_xy, demands, capacities):
+    """
+    Splits stop indices into one chunk per capacity (in the given order) by
+    bearing around the origin. Returns (chunks, unassigned indices).
+    """
+    order = sorted(range(len(stops_xy)), key=lambda i: math.atan2(stops_xy[i][1], stops_xy[i][0]))
+    if len(order) > 1:
+        angles = [math.atan2(stops_xy[i][1], stops_xy[i][0]) for i in order]
+        gaps = [(angles[(k + 1) % len(angles)] - angles[k]) % (2 * math.pi) for k in range(len(angles))]
+        start = (gaps.index(max(gaps)) + 1) % len(order)
+        order = order[start:] + order[:start]
+
+    chunks, unassigned = [[] for _ in capacities], []
+    bus, load = 0, 0
+    for index in order:
+        while bus < len(capacities) and load + demands[index] > capacities[bus] and chunks[bus]:
+            bus, load = bus + 1, 0
+        if bus >= len(capacities) or demands[index] > capacities[bus]:
+            unassigned.append(index)
+            continue
+        chunks[bus].append(index)
+        load += demands[index]
+    return chunks, unassigned
+
+
+def grid_index(xy, cell):
+    """Spatial hash: (cell x, cell y) -> indices of the points in that cell."""
+    grid = {}
+    for index, (x, y) in enumerate(xy):
+        grid.setdefault((math.floor(x / cell), math.floor(y / cell)), []).append(index)
+    return grid
+
+
+def neighbours(grid, xy, cell, index, radius):
+    """Indices of the points within radius (<= cell) of point index, itself included."""
+    x, y = xy[index]
+    cx, cy = math.floor(x / cell), math.floor(y / cell)
+    found = []
+    for gx in (cx - 1, cx, cx + 1):
+        for gy in (cy - 1, cy, cy + 1):
+            for other in grid.get((gx, gy), ()):
+                ox, oy = xy[other]
+                if (ox - x) ** 2 + (oy - y) ** 2 <= radius * radius:
+                    found.append(other)
+    return found
+
+
+def cluster_stops(stops, max_walk_m=DEFAULT_MAX_WALK_M, max_students=None):
+    """
+    Merges pickup points into shared stops no further than max_walk_m from any
+    of their students, with at most max_students per stop (so a stop always
+    fits on one bus). Greedy: points in the busiest neighbourhoods become stops
+    first and take their nearest unclaimed neighbours. A stop moves to its
+    members' centroid when that keeps everyone within reach.
+    """
+    if not stops or max_walk_m <= 0:
+        return list(stops)
+    origin = (sum(stop.lat for stop in stops) / len(stops), sum(stop.lng for stop in stops) / len(stops))
+    xy = project([(stop.lat, stop.lng) for stop in stops], origin)
+    grid = grid_index(xy, max_walk_m)
+    weight = [len(stop.student_ids) for stop in stops]
+
+    # Students in the surrounding 3x3 cells: a cheap stand-in for each point's neighbour count
+    cell_weight = {key: sum(weight[index] for index in members) for key, members in grid.items()}
+
+    def density(index):
+        cx, cy = math.floor(xy[index][0] / max_walk_m), math.floor(xy[index][1] / max_walk_m)
+        return sum(cell_weight.get((cx + dx, cy + dy), 0) for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+
+    claimed = [False] * len(stops)
+    merged = []
+    for seed in sorted(range(len(stops)), key=lambda index: -density(index)):
+        if claimed[seed]:
+            continue
+        sx, sy = xy[seed]
+        candidates = sorted(
+            (index for index in neighbours(grid, xy, max_walk_m, seed, max_walk_m) if not claimed[index]),
+            key=lambda index: (xy[index][0] - sx) ** 2 + (xy[index][1] - sy) ** 2,
+        )
+        members, load = [], 0
+        for index in candidates:
+            if members and max_students and load + weight[index] > max_students:
+                continue
+            members.append(index)
+            load += weight[index]
+            claimed[index] = True
+
+        total = load or 1
+        cx = sum(xy[index][0] * weight[index] for index in members) / total
+        cy = sum(xy[index][1] * weight[index] for index in members) / total
+        if all((xy[index][0] - cx) ** 2 + (xy[index][1] - cy) ** 2 <= max_walk_m ** 2 for index in members):
+            lat = sum(stops[index].lat * weight[index] for index in members) / total
+            lng = sum(stops[index].lng * weight[index] for index in members) / total
+        else:
+            lat, lng = stops[seed].lat, stops[seed].lng
+        merged.append(PlanStop(lat, lng, [student_id for index in members for student_id in stops[index].student_ids]))
+    return merged
+
+
+def path_length(path, dist):
+    return sum(dist[a][b] for a, b in zip(path, path[1:]))
+
+
+def nearest_neighbour(dist, start, end, nodes):
+    """Path start -> every node (greedy nearest next) -> end."""
+    path, remaining = [start], set(nodes)
+    while remaining:
+        last = dist[path[-1]]
+        nearest = min(remaining, key=last.__getitem__)
+        path.append(nearest)
+        remaining.remove(nearest)
+    path.append(end)
+    return path
+
+
+def two_opt(path, dist):
+    """Reverses segments while that shortens the path; the end points stay fixed. Returns True if improved."""
+    improved_any, improved = False, True
+    n = len(path)
+    while improved:
+        improved = False
+        for i in range(1, n - 2):
+            a, b = path[i - 1], path[i]
+            d_ab = dist[a][b]
+            for j in range(i + 1, n - 1):
+                c, d = path[j], path[j + 1]
+                if dist[a][c] + dist[b][d] < d_ab + dist[c][d] - 1e-9:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    improved = improved_any = True
+                    b = path[i]
+                    d_ab = dist[a][b]
+    return improved_any
+
+
+def or_opt(path, dist):
+    """Moves runs of 1-3 stops (optionally reversed) to a better place. Returns True if improved."""
+    improved_any, improved = False, True
+    while improved:
+        improved = False
+        for length in OR_OPT_SEGMENTS:
+            for i in range(1, len(path) - length):
+                first, last = path[i], path[i + length - 1]
+                prev, nxt = path[i - 1], path[i + length]
+                removal_gain = dist[prev][first] + dist[last][nxt] - dist[prev][nxt]
+                if removal_gain <= 1e-9:
+                    continue
+                rest = path[:i] + path[i + length:]
+                best = None
+                for k in range(len(rest) - 1):
+                    p, q = rest[k], rest[k + 1]
+                    base = dist[p][q]
+                    forward = dist[p][first] + dist[last][q] - base
+                    backward = dist[p][last] + dist[first][q] - base
+                    cost, reverse = (forward, False) if forward <= backward else (backward, True)
+                    if cost < removal_gain - 1e-9 and (best is None or cost < best[0]):
+                        best = (cost, k, reverse)
+                if best:
+                    _, k, reverse = best
+                    segment = path[i:i + length]
+                    path[:] = rest[:k + 1] + (segment[::-1] if reverse else segment) + rest[k + 1:]
+                    improved = improved_any = True
+                    break
+            if improved:
+                break
+    return improved_any
+
+
+def sequence(depot, stops):
+    """
+    Orders stops into the shortest path found that ends at depot.
+    Returns (ordered stops, length in metres).
+    """
+    if not stops:
+        return [], 0.0
+    xy = project([depot] + [(stop.lat, stop.lng) for stop in stops], depot)
+    # node 0: dummy start (free first stop), 1: depot, 2..: stops
+    matrix = distance_matrix(xy)
+    dist = [[0.0] * (len(xy) + 1)] + [[0.0] + row for row in matrix]
+    path = nearest_neighbour(dist, 0, 1, range(2, len(xy) + 1))
+    while two_opt(path, dist) | or_opt(path, dist):
+        pass
+    return [stops[node - 2] for node in path[1:-1]], path_length(path, dist)
+
+
+def solve(problem):
+    """Plans every bus of one school. Pure function of the problem, safe to run in a worker process."""
+    started = time.perf_counter()
+    buses = sorted(problem.buses, key=lambda bus: -bus.capacity)
+    xy = project([(stop.lat, stop.lng) for stop in problem.stops], problem.depot)
+    demands = [len(stop.student_ids) for stop in problem.stops]
+    chunks, unassigned = sweep(xy, demands, [bus.capacity for bus in buses])
+
+    routes = []
+    for bus, chunk in zip(buses, chunks):
+        ordered, distance = sequence(problem.depot, [problem.stops[i] for i in chunk])
+        routes.append(BusRoute(bus.bus_id, ordered, distance, sum(len(stop.student_ids) for stop in ordered)))
+    return SchoolPlan(problem.school_id, routes, [problem.stops[i] for i in unassigned], time.perf_counter() - started)
+
+
+def optimize_many(problems, workers=1):
+    """Solves problems in order; with workers > 1 each school is solved in its own process."""
+    if workers > 1 and len(problems) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(solve, problems))
+    return [solve(problem) for problem in problems]
+
+
+def student_stops(students):
+    """One stop per distinct pickup coordinate, from (student id, pickup_location) pairs."""
+    by_point = {}
+    for student_id, pickup in students:
+        point = parse_coordinate(pickup) if pickup else None
+        if point is not None:
+            by_point.setdefault(point, []).append(student_id)
+    return [PlanStop(lat, lng, ids) for (lat, lng), ids in by_point.items()]
+
+
+def load_problem(school, default_capacity=DEFAULT_CAPACITY, stops=None, max_walk_m=0):
+    """
+    Builds the planning problem for a school from its buses and its students'
+    pickup locations, merged into shared stops when max_walk_m is set.
+    """
+    buses = [
+        PlanBus(bus_id, capacity or default_capacity)
+        for bus_id, capacity in school.buses.exclude(status='out_of_commission').values_list('id', 'capacity')
+    ]
+    if stops is None:
+        stops = student_stops(school.students.values_list('id', 'pickup_location').iterator(chunk_size=5000))
+    if max_walk_m:
+        stops = cluster_stops(stops, max_walk_m, max(bus.capacity for bus in buses) if buses else None)
+    return SchoolProblem(school.id, (school.latitude, school.longitude), buses, stops)
+
+
+def stops_json(stops):
+    """Route.stops entries for planned stops."""
+    return [
+        {'name': f'Stop {number}', 'lat': stop.lat, 'lng': stop.lng,
+         'students': len(stop.student_ids), 'student_ids': list(stop.student_ids)}
+        for number, stop in enumerate(stops, start=1)
+    ]
+
+
+@transaction.atomic
+def apply_plan(plan):
+    """
+    Writes a plan into each bus's route (created if missing) and assigns the
+    students to it. A bus the plan leaves without stops keeps its route as it
+    is. Students still assigned to a rewritten route without a stop on it
+    (e.g. they did not fit on any bus) lose the assignment. Returns the
+    number of those students.
+    """
+    # Imported here: worker processes import this module without setting up Django
+    from core.models import Bus, Route, Student
+
+    buses = Bus.objects.in_bulk([route.bus_id for route in plan.routes])
+    rewritten = []  # (route, its students)
+    for bus_route in plan.routes:
+        if not bus_route.stops:
+            continue
+        bus = buses[bus_route.bus_id]
+        route = Route.objects.filter(bus=bus).first()
+        if route is None:
+            route = Route(name=f'Route {bus.bus_number}', school_id=plan.school_id, bus=bus)
+        route.stops = stops_json(bus_route.stops)
+        route.save()
+        student_ids = [student_id for stop in bus_route.stops for student_id in stop.student_ids]
+        Student.objects.filter(id__in=student_ids).update(assigned_route=route)
+        rewritten.append((route, student_ids))
+
+    # Only now: a student may have moved from one rewritten route to another
+    return sum(
+        Student.objects.filter(assigned_route=route).exclude(id__in=student_ids).update(assigned_route=None)
+        for route, student_ids in rewritten
+    )
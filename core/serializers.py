@@ -1,7 +1,10 @@
 from rest_framework import serializers
-from core.models import Bus, Route, BusLocation
+from core.models import Bus, BusDailyStats, Route, BusLocation
 
 class BusSerializer(serializers.ModelSerializer):
+    # Map clients load the route's geometry once from /api/routes/<route_id>/
+    route_id = serializers.IntegerField(source='assigned_route.id', read_only=True, default=None)
+
     class Meta:
         model = Bus
         fields = '__all__'  # Adjust fields based on needs
@@ -14,4 +17,13 @@ class RouteSerializer(serializers.ModelSerializer):
 class BusLocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = BusLocation
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class BusDailyStatsSerializer(serializers.ModelSerializer):
+    bus_number = serializers.CharField(source='bus.bus_number', read_only=True)
+    average_speed = serializers.FloatField(read_only=True)
+    on_time_percentage = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = BusDailyStats
+        exclude = ['id', 'last_latitude', 'last_longitude']
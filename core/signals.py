@@ -0,0 +1,57 @@
+# core/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import fragments
+from core.spatial import forget_bus
+from core.authentication import token_cache
+from core.models import Bus, Concern, CustomUser, DeviceToken, Notification, Route, School, Student
+
+
+@receiver([post_save, post_delete], sender=DeviceToken)
+def forget_device_token(sender, instance, **kwargs):
+    # Deactivated or deleted tokens must stop authenticating in this process right away
+    token_cache.discard(digest=instance.key_digest)
+
+
+@receiver(post_save, sender=Bus)
+def forget_bus_tokens(sender, instance, **kwargs):
+    # The driver may have been reassigned, so re-verify the bus binding on next use
+    token_cache.discard(bus_id=instance.id)
+
+
+@receiver(post_save, sender=CustomUser)
+def forget_driver_tokens(sender, instance, **kwargs):
+    token_cache.discard(driver_id=instance.id)
+
+
+@receiver(post_delete, sender=Bus)
+def forget_bus_position(sender, instance, **kwargs):
+    forget_bus(instance.id)
+
+
+@receiver([post_save, post_delete], sender=School)
+def invalidate_school_fragments(sender, **kwargs):
+    fragments.bump('schools')
+
+
+@receiver([post_save, post_delete], sender=Bus)
+@receiver([post_save, post_delete], sender=Route)
+@receiver([post_save, post_delete], sender=Student)
+def invalidate_dashboard_fragments(sender, instance, **kwargs):
+    # Only the row's school's fragments (and the all-schools ones); see core/fragments.py
+    fragments.bump('stats', 'activity', school_id=instance.school_id)
+
+
+@receiver([post_save, post_delete], sender=Concern)
+@receiver([post_save, post_delete], sender=Notification)
+def invalidate_bus_fragments(sender, instance, **kwargs):
+    # Concerns and notifications belong to their bus's school; without a bus, to every school
+    school_id = None
+    if instance.bus_id is not None:
+        if sender.bus.is_cached(instance):
+            school_id = instance.bus.school_id
+        else:
+            # The bus may be gone already when its notifications are cascade-deleted
+            school_id = Bus.all_objects.filter(pk=instance.bus_id).values_list('school_id', flat=True).first()
+    fragments.bump('stats', 'activity', school_id=school_id)
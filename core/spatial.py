@@ -0,0 +1,250 @@
+# core/spatial.py
+"""
+In-memory spatial index over live bus positions, for "nearest buses to this
+point" and "buses within 2 km of this school/stop" queries.
+
+Positions are bucketed in a fixed lat/lng grid (SPATIAL_INDEX['CELL_DEG'],
+about 1.1 km at the default 0.01). A radius query scans only the cells that
+overlap the circle's bounding box. A k-nearest query scans rings of cells
+outward from the query cell, and stops once the k-th best distance is closer
+than any cell it has not visited yet.
+
+ingest.submit_fixes updates the index with every accepted fix. Each worker
+process has its own index: it is loaded from Bus.last_known_* on first use,
+and then re-reads buses that moved in the database (i.e. fixes taken by other
+workers) at most every REFRESH_SECONDS. "Moved" goes by Bus.location_updated_at,
+the server time of the write: device timestamps may run ahead of the server
+clock (up to ingest.MAX_CLOCK_SKEW) or behind it, so they cannot mark what was
+already read.
+"""
+import heapq
+import math
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.geometry import haversine_m
+
+DEFAULTS = {
+    'CELL_DEG': 0.01,
+    'REFRESH_SECONDS': 5,
+}
+
+# Each refresh re-reads writes stamped this long before the previous one started: a
+# write is stamped before it commits, and workers' clocks may differ a little
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+METRES_PER_DEG = 111195.0  # along a meridian, for the mean earth radius in core/geometry.py
+
+Position = namedtuple('Position', ['bus_id', 'latitude', 'longitude', 'timestamp'])
+Match = namedtuple('Match', ['bus_id', 'latitude', 'longitude', 'timestamp', 'distance_m'])
+
+
+def spatial_settings():
+    return {**DEFAULTS, **getattr(settings, 'SPATIAL_INDEX', {})}
+
+
+class BusIndex:
+    """Grid of bus positions. Thread-safe; queries never touch the database."""
+
+    def __init__(self, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self._positions = {}  # bus_id -> Position
+        self._cells = {}  # (row, col) -> set of bus_ids
+        self._extent = None  # [min row, max row, min col, max col] ever occupied; bounds the ring search
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_deg), math.floor(longitude / self.cell_deg)
+
+    def update(self, bus_id, latitude, longitude, timestamp):
+        """Moves a bus, unless its indexed position is newer. Returns True if it moved."""
+        with self._lock:
+            return self._update(bus_id, latitude, longitude, timestamp)
+
+    def update_many(self, positions):
+        with self._lock:
+            for position in positions:
+                self._update(*position)
+
+    def _update(self, bus_id, latitude, longitude, timestamp):
+        current = self._positions.get(bus_id)
+        new_cell = self._cell(latitude, longitude)
+        if current is not None:
+            if timestamp is not None and current.timestamp is not None and timestamp < current.timestamp:
+                return False
+            old_cell = self._cell(current.latitude, current.longitude)
+            if old_cell != new_cell:
+                members = self._cells[old_cell]
+                members.discard(bus_id)
+                if not members:
+                    del self._cells[old_cell]
+                self._add_to_cell(new_cell, bus_id)
+        else:
+            self._add_to_cell(new_cell, bus_id)
+        self._positions[bus_id] = Position(bus_id, latitude, longitude, timestamp)
+        return True
+
+    def _add_to_cell(self, cell, bus_id):
+        self._cells.setdefault(cell, set()).add(bus_id)
+        row, col = cell
+        if self._extent is None:
+            self._extent = [row, row, col, col]
+        else:
+            extent = self._extent
+            extent[0], extent[1] = min(extent[0], row), max(extent[1], row)
+            extent[2], extent[3] = min(extent[2], col), max(extent[3], col)
+
+    def remove(self, bus_id):
+        with self._lock:
+            current = self._positions.pop(bus_id, None)
+            if current is not None:
+                cell = self._cell(current.latitude, current.longitude)
+                self._cells[cell].discard(bus_id)
+                if not self._cells[cell]:
+                    del self._cells[cell]
+
+    def get(self, bus_id):
+        return self._positions.get(bus_id)
+
+    def _candidates(self, rows, cols, include, since):
+        for row in rows:
+            for col in cols:
+                for bus_id in self._cells.get((row, col), ()):
+                    if include is not None and bus_id not in include:
+                        continue
+                    position = self._positions[bus_id]
+                    if since is not None and (position.timestamp is None or position.timestamp < since):
+                        continue
+                    yield position
+
+    def within(self, latitude, longitude, radius_m, include=None, since=None):
+        """
+        Buses within radius_m of the point, nearest first. `include` limits the
+        search to a set of bus ids and `since` to positions at least that recent.
+        """
+        dlat = radius_m / METRES_PER_DEG
+        dlng = radius_m / (METRES_PER_DEG * max(math.cos(math.radians(min(abs(latitude) + dlat, 89.9))), 1e-6))
+        top, left = self._cell(latitude - dlat, longitude - dlng)
+        bottom, right = self._cell(latitude + dlat, longitude + dlng)
+        point = (latitude, longitude)
+        with self._lock:
+            matches = []
+            for position in self._candidates(range(top, bottom + 1), range(left, right + 1), include, since):
+                distance = haversine_m(point, (position.latitude, position.longitude))
+                if distance <= radius_m:
+                    matches.append(Match(*position, distance))
+        matches.sort(key=lambda match: match.distance_m)
+        return matches
+
+    def nearest(self, latitude, longitude, k=5, max_distance_m=None, include=None, since=None):
+        """The k buses nearest to the point (optionally no further than max_distance_m), nearest first."""
+        row0, col0 = self._cell(latitude, longitude)
+        point = (latitude, longitude)
+        cell_height = self.cell_deg * METRES_PER_DEG
+        best = []  # max-heap of (-distance, bus_id, position) holding the k best so far
+        with self._lock:
+            if not self._cells:
+                return []
+            min_row, max_row, min_col, max_col = self._extent
+            max_ring = max(abs(row0 - min_row), abs(row0 - max_row), abs(col0 - min_col), abs(col0 - max_col))
+            for ring in range(max_ring + 1):
+                # Ring r covers every cell at Chebyshev distance r from the query cell
+                ring_rows = range(row0 - ring, row0 + ring + 1)
+                cells = (
+                    [(row, col) for row in ring_rows for col in (col0 - ring, col0 + ring)] +
+                    [(row, col) for row in (row0 - ring, row0 + ring) for col in range(col0 - ring + 1, col0 + ring)]
+                    if ring else [(row0, col0)]
+                )
+                for row, col in dict.fromkeys(cells):
+                    for position in self._candidates((row,), (col,), include, since):
+                        distance = haversine_m(point, (position.latitude, position.longitude))
+                        if max_distance_m is not None and distance > max_distance_m:
+                            continue
+                        entry = (-distance, position.bus_id, position)
+                        if len(best) < k:
+                            heapq.heappush(best, entry)
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, entry)
+
+                # Anything outside rings 0..r is at least r cells away in some direction
+                edge_lat = min(abs(latitude) + (ring + 1) * self.cell_deg, 89.9)
+                reach = ring * min(cell_height, cell_height * math.cos(math.radians(edge_lat)))
+                if len(best) == k and -best[0][0] <= reach:
+                    break
+                if max_distance_m is not None and reach >= max_distance_m:
+                    break
+        return [Match(*position, -negative) for negative, _, position in sorted(best, reverse=True)]
+
+
+class LiveBusIndex(BusIndex):
+    """The process-wide index: loaded from the database and refreshed with other workers' fixes."""
+
+    def __init__(self, cell_deg=0.01, refresh_seconds=5):
+        super().__init__(cell_deg)
+        self.refresh_seconds = refresh_seconds
+        self._watermark = None  # location_updated_at from which the next refresh reads
+        self._refreshed_at = None
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Reads buses whose stored position changed since the last refresh."""
+        if not force and self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        from core.models import Bus
+
+        with self._refresh_lock:
+            started = timezone.now()
+            # Every school's buses: the index is shared by all requests in the process
+            buses = Bus.all_objects.filter(last_known_latitude__isnull=False, last_known_longitude__isnull=False)
+            if self._watermark is not None:
+                buses = buses.filter(location_updated_at__gte=self._watermark)
+            rows = list(buses.values_list('id', 'last_known_latitude', 'last_known_longitude', 'last_known_location_time'))
+            self.update_many(rows)
+            self._watermark = started - REFRESH_OVERLAP
+            self._refreshed_at = time.monotonic()
+
+    def update_fixes(self, fixes):
+        """Applies accepted fixes (trip start/end markers carry no new position)."""
+        self.update_many(
+            (fix.bus_id, fix.latitude, fix.longitude, fix.timestamp)
+            for fix in fixes
+            if not (fix.is_trip_start or fix.is_trip_end) and fix.latitude is not None and fix.longitude is not None
+        )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_bus_index():
+    """Returns this process's LiveBusIndex, loading it from the database on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                conf = spatial_settings()
+                index = LiveBusIndex(cell_deg=conf['CELL_DEG'], refresh_seconds=conf['REFRESH_SECONDS'])
+                index.refresh(force=True)
+                _index = index
+    return _index
+
+
+def reset_bus_index():
+    """Forgets this process's index; the next get_bus_index loads it from the database again."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def forget_bus(bus_id):
+    """Drops a deleted bus from the index, if this process has loaded one."""
+    if _index is not None:
+        _index.remove(bus_id)
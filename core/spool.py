@@ -0,0 +1,174 @@
+# core/spool.py
+"""
+Append-only spool of raw bus location fixes.
+
+Each worker process appends to its own segment file in the spool directory, so
+writers never interleave. Fixes are written in frames: a small header (magic,
+record count, crc32 of the payload) followed by fixed-size little-endian
+records. The magic doubles as the record version; SBF1 segments (written
+before fixes carried a sequence number) and SBF2 segments (before they carried
+the sending device) are still readable. A torn frame at
+the end of a segment (crash during a write) fails the length/crc check and is
+skipped by the reader.
+
+The spool is the source for `manage.py replay_spool`, which rebuilds
+BusLocation rows and Bus.last_known_* from it.
+"""
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+FRAME_MAGIC = b'SBF3'
+FRAME_HEADER = struct.Struct('<4sII')  # magic, record count, crc32 of payload
+# bus_id, timestamp (microseconds since epoch), latitude, longitude, speed, heading, flags, seq (-1 if none),
+# device token id (0 if none)
+RECORD = struct.Struct('<Iqddff BqI')
+RECORD_FORMATS = {
+    b'SBF1': struct.Struct('<Iqddff B'),
+    b'SBF2': struct.Struct('<Iqddff Bq'),
+    FRAME_MAGIC: RECORD,
+}
+NO_SEQ = -1
+NO_DEVICE = 0
+SEGMENT_SUFFIX = '.sbf'
+
+FLAG_TRIP_START = 1
+FLAG_TRIP_END = 2
+
+
+def pack_fix(fix):
+    """Packs a core.ingest.Fix into a single spool record."""
+    flags = (FLAG_TRIP_START if fix.is_trip_start else 0) | (FLAG_TRIP_END if fix.is_trip_end else 0)
+    return RECORD.pack(
+        fix.bus_id,
+        int(fix.timestamp.timestamp() * 1_000_000),
+        fix.latitude,
+        fix.longitude,
+        fix.speed if fix.speed is not None else float('nan'),
+        fix.heading if fix.heading is not None else float('nan'),
+        flags,
+        fix.seq if fix.seq is not None else NO_SEQ,
+        fix.device if fix.device is not None else NO_DEVICE,
+    )
+
+
+class LocationSpool:
+    """Thread-safe appender for this process's segment in a spool directory."""
+
+    def __init__(self, directory, segment_bytes=256 * 1024 * 1024):
+        self.directory = str(directory)
+        self.segment_bytes = segment_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._fd = None
+        self._size = 0
+        self._open_segment()
+
+    def _open_segment(self):
+        name = f'fixes-{socket.gethostname()}-{os.getpid()}-{time.time_ns()}{SEGMENT_SUFFIX}'
+        self.path = os.path.join(self.directory, name)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = 0
+
+    def append(self, fixes):
+        """Writes one frame holding all the given fixes. Returns the bytes written."""
+        if not fixes:
+            return 0
+        payload = b''.join(pack_fix(fix) for fix in fixes)
+        frame = FRAME_HEADER.pack(FRAME_MAGIC, len(fixes), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._size >= self.segment_bytes:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._open_segment()
+            os.write(self._fd, frame)
+            self._size += len(frame)
+        return len(frame)
+
+    def sync(self):
+        """Fsyncs the current segment so everything appended so far survives a crash."""
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+
+def segment_paths(paths):
+    """Expands spool directories into their segment files, oldest first."""
+    result = []
+    for path in paths:
+        path = str(path)
+        if os.path.isdir(path):
+            segments = [os.path.join(path, name) for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX)]
+            result.extend(sorted(segments, key=os.path.getmtime))
+        else:
+            result.append(path)
+    return result
+
+
+def iter_frames(path):
+    """Yields (record struct, payload) for every intact frame in a segment file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset, end = 0, len(data)
+    while offset + FRAME_HEADER.size <= end:
+        magic, count, crc = FRAME_HEADER.unpack_from(data, offset)
+        record = RECORD_FORMATS.get(magic)
+        start = offset + FRAME_HEADER.size
+        stop = start + count * (record.size if record else 0)
+        if record is None or stop > end:
+            break  # torn or foreign tail, nothing after it can be trusted
+        payload = data[start:stop]
+        if count and zlib.crc32(payload) == crc:
+            yield record, payload
+        offset = stop
+
+
+class SpoolColumns:
+    """Column arrays for a run of spool records (no per-record objects)."""
+
+    def __init__(self):
+        self.bus_id = array('I')
+        self.timestamp_us = array('q')
+        self.latitude = array('d')
+        self.longitude = array('d')
+        self.speed = array('f')
+        self.heading = array('f')
+        self.flags = array('B')
+        self.seq = array('q')
+        self.device = array('I')
+
+    def __len__(self):
+        return len(self.bus_id)
+
+    def extend(self, record, payload):
+        values = list(zip(*record.iter_unpack(payload)))
+        bus_id, ts, lat, lng, speed, heading, flags = values[:7]
+        self.seq.extend(values[7] if len(values) > 7 else [NO_SEQ] * len(bus_id))
+        self.device.extend(values[8] if len(values) > 8 else [NO_DEVICE] * len(bus_id))
+        self.bus_id.extend(bus_id)
+        self.timestamp_us.extend(ts)
+        self.latitude.extend(lat)
+        self.longitude.extend(lng)
+        self.speed.extend(speed)
+        self.heading.extend(heading)
+        self.flags.extend(flags)
+
+
+def read_columns(paths):
+    """Reads every intact record from the given segments/directories into columns."""
+    columns = SpoolColumns()
+    for path in segment_paths(paths):
+        for record, payload in iter_frames(path):
+            columns.extend(record, payload)
+    return columns
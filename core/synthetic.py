@@ -0,0 +1,351 @@
+# core/synthetic.py
+"""
+Synthetic fleet generator for load testing: schools, drivers, buses, routes,
+parents, students and days of location history at a given fix rate.
+
+Routes start in one of the Muscat RESIDENTIAL_AREAS, may pass through a
+second one and end at their school. They follow a jittered street grid
+(alternating north-south and east-west legs of a few hundred metres) rather
+than a straight line. Each route's trip is sampled once at the fix interval,
+with speeds that vary by leg and a dwell at every stop. That profile is then
+replayed for every day's morning run and, reversed, for the afternoon run.
+
+Every table is filled in batches, each batch in its own transaction: bulk_create
+for the fleet itself, and a plain executemany for the location history, which
+is where the row count is. All generated users share one password hash, so
+hashing happens once.
+"""
+import math
+import random
+from datetime import datetime, time as dt_time, timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from core.geometry import haversine_m
+from core.models import Bus, BusLocation, CustomUser, Route, School, Student
+
+# Oman school locations (latitude, longitude)
+SCHOOL_LOCATIONS = {
+    'main_campus': (23.5880, 58.3829),  # Muscat
+    'branch_1': (23.6139, 58.5423),     # Seeb
+    'branch_2': (23.5657, 58.3259)      # Al Amerat
+}
+
+# Residential areas in Oman with coordinates
+RESIDENTIAL_AREAS = [
+    {'name': 'Al Khuwair', 'coords': (23.5792, 58.4076)},
+    {'name': 'Qurum', 'coords': (23.5937, 58.4458)},
+    {'name': 'Al Ghubrah', 'coords': (23.5657, 58.3829)},
+    {'name': 'Bawshar', 'coords': (23.5500, 58.3806)},
+    {'name': 'Ruwi', 'coords': (23.5937, 58.5423)},
+    {'name': 'Mabelah', 'coords': (23.5333, 58.3667)},
+    {'name': 'Al Hail', 'coords': (23.6000, 58.4833)},
+    {'name': 'Saruj', 'coords': (23.5500, 58.4167)}
+]
+
+METRES_PER_DEG = 111195.0
+MORNING_START = dt_time(6, 30)
+AFTERNOON_START = dt_time(13, 30)
+STOP_DWELL_S = 30
+STOPS_PER_ROUTE = 10
+
+
+def jitter(point, metres, rng):
+    lat, lng = point
+    return (
+        lat + rng.uniform(-metres, metres) / METRES_PER_DEG,
+        lng + rng.uniform(-metres, metres) / (METRES_PER_DEG * math.cos(math.radians(lat))),
+    )
+
+
+def street_path(start, end, rng, block_m=(200, 800)):
+    """Points from start to end along alternating N-S / E-W legs of block_m metres, like a street grid."""
+    points = [start]
+    lat, lng = start
+    north_south = rng.random() < 0.5
+    while True:
+        dlat_m = (end[0] - lat) * METRES_PER_DEG
+        dlng_m = (end[1] - lng) * METRES_PER_DEG * math.cos(math.radians(lat))
+        if abs(dlat_m) < block_m[0] and abs(dlng_m) < block_m[0]:
+            break
+        step = rng.uniform(*block_m)
+        if north_south and abs(dlat_m) >= block_m[0] / 2:
+            lat += math.copysign(min(step, abs(dlat_m)), dlat_m) / METRES_PER_DEG
+        elif abs(dlng_m) >= block_m[0] / 2:
+            lng += math.copysign(min(step, abs(dlng_m)), dlng_m) / (METRES_PER_DEG * math.cos(math.radians(lat)))
+        else:
+            lat += math.copysign(min(step, abs(dlat_m)), dlat_m) / METRES_PER_DEG
+        points.append(jitter((lat, lng), 15, rng))
+        north_south = not north_south
+    points.append(end)
+    return points
+
+
+def route_polyline(school_point, rng):
+    """A route from a residential area (sometimes via a second one) to the school."""
+    areas = rng.sample(RESIDENTIAL_AREAS, 2)
+    waypoints = [jitter(areas[0]['coords'], 800, rng)]
+    if rng.random() < 0.5:
+        waypoints.append(jitter(areas[1]['coords'], 800, rng))
+    waypoints.append(school_point)
+    points = [waypoints[0]]
+    for start, end in zip(waypoints, waypoints[1:]):
+        points.extend(street_path(start, end, rng)[1:])
+    return points
+
+
+def heading_deg(a, b):
+    dlng = (b[1] - a[1]) * math.cos(math.radians(a[0]))
+    return (math.degrees(math.atan2(dlng, b[0] - a[0])) + 360) % 360
+
+
+def trip_profile(points, stop_indices, fix_interval_s, rng):
+    """
+    Samples a drive along points every fix_interval_s seconds. Returns a list of
+    (offset seconds, lat, lng, speed km/h, heading), including a STOP_DWELL_S
+    wait at every point in stop_indices.
+    """
+    fixes = []
+    clock = 0.0
+    next_fix = 0.0
+    for index, (a, b) in enumerate(zip(points, points[1:])):
+        if index in stop_indices:
+            # Dwell: stationary fixes at the stop
+            dwell_end = clock + STOP_DWELL_S
+            while next_fix <= dwell_end:
+                fixes.append((next_fix, a[0], a[1], 0.0, None))
+                next_fix += fix_interval_s
+            clock = dwell_end
+        length = haversine_m(a, b)
+        speed_kmh = rng.uniform(20, 55)
+        duration = length / (speed_kmh / 3.6) if length else 0
+        heading = heading_deg(a, b)
+        while next_fix <= clock + duration:
+            t = (next_fix - clock) / duration if duration else 1
+            fixes.append((
+                next_fix, a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t,
+                round(speed_kmh + rng.uniform(-3, 3), 1), round(heading, 1),
+            ))
+            next_fix += fix_interval_s
+        clock += duration
+    end = points[-1]
+    fixes.append((max(clock, next_fix), end[0], end[1], 0.0, None))
+    return fixes
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_insert(model, objects, batch_size):
+    """bulk_create in batches, one transaction per batch. Returns the number of rows written."""
+    total = 0
+    for batch in batched(objects, batch_size):
+        with transaction.atomic():
+            model.objects.bulk_create(batch, batch_size=batch_size)
+        total += len(batch)
+    return total
+
+
+LOCATION_COLUMNS = ['bus', 'latitude', 'longitude', 'timestamp', 'speed', 'heading', 'is_trip_start', 'is_trip_end', 'seq']
+
+
+def insert_rows(model, fields, rows, ignore_conflicts=False):
+    """
+    Inserts already-adapted value tuples with one executemany in a transaction.
+    The fast path for history rows: no model instances, and no per-statement
+    parameter limit, which caps SQLite bulk_create at ~100 rows per INSERT.
+    With ignore_conflicts, rows that violate a constraint are skipped as in
+    bulk_create(ignore_conflicts=True).
+    """
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+    columns = [model._meta.get_field(name).column for name in fields]
+    suffix = connection.ops.on_conflict_suffix_sql(fields, on_conflict, None, None) if on_conflict else ''
+    sql = '{} {} ({}) VALUES ({}){}'.format(
+        connection.ops.insert_statement(on_conflict=on_conflict),
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)),
+        ' ' + suffix if suffix else '',
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+    return len(rows)
+
+
+class FleetGenerator:
+    """
+    Writes a synthetic fleet. Every generated name starts with `prefix`, so
+    several fleets can coexist and a rerun with the same prefix is refused.
+    """
+
+    def __init__(self, prefix='SYN', schools=3, buses=30, students=1000, days=1, fix_interval_s=5,
+                 batch_size=5000, seed=None, password='test1234', log=None):
+        self.prefix = prefix
+        self.counts = {'schools': schools, 'buses': buses, 'students': students}
+        self.days = days
+        self.fix_interval_s = fix_interval_s
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.password = password
+        self.log = log or (lambda message: None)
+
+    def exists(self):
+        return Bus.objects.filter(bus_number__startswith=f'{self.prefix}-').exists()
+
+    def run(self):
+        schools = self.create_schools()
+        buses, routes = self.create_buses_and_routes(schools)
+        self.create_students(routes)
+        rows = self.create_history(buses, routes) if self.days else 0
+        return {'schools': len(schools), 'buses': len(buses), 'routes': len(routes),
+                'students': self.counts['students'], 'locations': rows}
+
+    def create_schools(self):
+        sites = list(SCHOOL_LOCATIONS.values())
+        School.objects.bulk_create([
+            School(
+                name=f'{self.prefix} School {i + 1}',
+                address=f'Synthetic school {i + 1}, Muscat',
+                latitude=point[0], longitude=point[1],
+                is_active=True,
+            )
+            for i, point in ((i, jitter(sites[i % len(sites)], 3000 if i >= len(sites) else 0, self.rng))
+                             for i in range(self.counts['schools']))
+        ], batch_size=self.batch_size)
+        schools = list(School.objects.filter(name__startswith=f'{self.prefix} School ').order_by('id'))
+        self.log(f'{len(schools)} schools')
+        return schools
+
+    def create_users(self, role, count, schools, label):
+        password = make_password(self.password)
+        username = f'{self.prefix.lower()}_{role}'
+        bulk_insert(CustomUser, (
+            CustomUser(
+                username=f'{username}{i + 1}', password=password, role=role,
+                first_name=label, last_name=str(i + 1),
+                email=f'{username}{i + 1}@example.com',
+                school=schools[i % len(schools)],
+            )
+            for i in range(count)
+        ), self.batch_size)
+        users = list(CustomUser.objects.filter(username__startswith=username, role=role).order_by('id'))
+        self.log(f'{len(users)} {role}s')
+        return users
+
+    def create_buses_and_routes(self, schools):
+        count = self.counts['buses']
+        drivers = self.create_users('driver', count, schools, 'Driver')
+        bulk_insert(Bus, (
+            Bus(
+                bus_number=f'{self.prefix}-{i + 1:05d}', driver=drivers[i], school=drivers[i].school,
+                capacity=self.rng.choice([45, 50, 55]), status='active',
+            )
+            for i in range(count)
+        ), self.batch_size)
+        buses = list(Bus.objects.filter(bus_number__startswith=f'{self.prefix}-').select_related('school').order_by('id'))
+
+        self.polylines = {}
+        routes = []
+        for bus in buses:
+            points = route_polyline((bus.school.latitude, bus.school.longitude), self.rng)
+            stop_indices = sorted(self.rng.sample(range(len(points) - 1), min(STOPS_PER_ROUTE, len(points) - 1)))
+            self.polylines[bus.bus_number] = (points, set(stop_indices))
+            routes.append(Route(
+                name=f'{self.prefix} Route {bus.bus_number}', bus=bus, school=bus.school,
+                start_time=MORNING_START, end_time=dt_time(7, 45),
+                stops=[
+                    {'name': f'Stop {number}', 'lat': points[index][0], 'lng': points[index][1]}
+                    for number, index in enumerate(stop_indices, start=1)
+                ] + [{'name': bus.school.name, 'lat': points[-1][0], 'lng': points[-1][1]}],
+            ))
+        bulk_insert(Route, routes, self.batch_size)
+        routes = list(Route.objects.filter(name__startswith=f'{self.prefix} Route ').select_related('bus', 'school').order_by('id'))
+        self.log(f'{len(buses)} buses and routes')
+        return buses, routes
+
+    def create_students(self, routes):
+        count = self.counts['students']
+        # Parent k's children ride route k, so parent and children share a school
+        parent_count = max(count // 2, 1)
+        schools = [routes[k % len(routes)].school for k in range(parent_count)]
+        parents = self.create_users('parent', parent_count, schools, 'Parent')
+        rng = self.rng
+
+        def students():
+            for i in range(count):
+                k = i // 2 % len(parents)
+                route = routes[k % len(routes)]
+                stop = rng.choice(route.stops[:-1] or route.stops)
+                yield Student(
+                    first_name='Student', last_name=str(i + 1),
+                    student_id=f'{self.prefix}-STU-{i + 1:07d}',
+                    parent=parents[k],
+                    assigned_route=route, school_id=route.school_id,
+                    grade_level=str(rng.randint(1, 12)),
+                    pickup_location=dict(zip(('lat', 'lng'), jitter((stop['lat'], stop['lng']), 150, rng))),
+                )
+
+        bulk_insert(Student, students(), self.batch_size)
+        self.log(f'{count} students')
+
+    def create_history(self, buses, routes):
+        """Morning and afternoon trips for every bus on each of the last `days` days."""
+        today = timezone.localdate()
+        tz = timezone.get_current_timezone()
+        profiles = {}
+        for route in routes:
+            points, stop_indices = self.polylines[route.bus.bus_number]
+            morning = trip_profile(points, stop_indices, self.fix_interval_s, self.rng)
+            afternoon = trip_profile(points[::-1], {len(points) - 1 - i for i in stop_indices}, self.fix_interval_s, self.rng)
+            profiles[route.bus_id] = (morning, afternoon)
+
+        adapt = connection.ops.adapt_datetimefield_value
+
+        def locations():
+            for day in range(self.days, 0, -1):
+                date = today - timedelta(days=day)
+                for bus in buses:
+                    seq = (self.days - day) * 100000
+                    for start, profile in zip((MORNING_START, AFTERNOON_START), profiles[bus.id]):
+                        departs = timezone.make_aware(datetime.combine(date, start), tz) + timedelta(
+                            seconds=self.rng.randint(-300, 300))
+                        last = len(profile) - 1
+                        for index, (offset, lat, lng, speed, heading) in enumerate(profile):
+                            seq += 1
+                            yield (bus.id, lat, lng, adapt(departs + timedelta(seconds=offset)), speed, heading,
+                                   index == 0, index == last, seq)
+
+        per_day = sum(len(morning) + len(afternoon) for morning, afternoon in profiles.values())
+        self.log(f'{per_day * self.days:,} location rows ({per_day:,} per day)...')
+        written = 0
+        for batch in batched(locations(), self.batch_size * 20):
+            written += insert_rows(BusLocation, LOCATION_COLUMNS, batch)
+            self.log(f'  {written:,} location rows written')
+
+        # Leave each bus where its last trip ended
+        Bus.objects.bulk_update([
+            Bus(
+                id=bus.id,
+                last_known_latitude=profiles[bus.id][1][-1][1],
+                last_known_longitude=profiles[bus.id][1][-1][2],
+                last_known_location_time=timezone.make_aware(
+                    datetime.combine(today - timedelta(days=1), AFTERNOON_START), tz
+                ) + timedelta(seconds=profiles[bus.id][1][-1][0]),
+                last_known_speed=0,
+                location_updated_at=timezone.now(),
+            )
+            for bus in buses
+        ], ['last_known_latitude', 'last_known_longitude', 'last_known_location_time', 'last_known_speed',
+            'location_updated_at'],
+            batch_size=self.batch_size)
+        return written
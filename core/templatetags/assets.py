@@ -0,0 +1,12 @@
+from django import template
+
+from core.assets import bundle_tags
+
+register = template.Library()
+
+@register.simple_tag
+def bundle(name, kind):
+    """
+    Emits the <link>/<script> tags for a bundle from core/assets.py, e.g. {% bundle 'base' 'css' %}
+    """
+    return bundle_tags(name, kind)
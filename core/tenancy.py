@@ -0,0 +1,120 @@
+# core/tenancy.py
+"""
+Per-school (tenant) scoping of queries.
+
+School is the tenant boundary: every Bus, Route, Student and CustomUser
+belongs to one. CurrentSchoolMiddleware binds each request to the school of
+the signed-in user. While a school is bound, `Model.objects` on those four
+models returns only that school's rows, so a district running many schools on
+one install pays for one school's rows per request. The composite indexes
+led by school_id (core/models.py) find those rows directly.
+
+- Superusers (is_superuser or role 'superuser') and users without a school
+  are not bound and see every school.
+- Management commands, background threads and streamed response bodies run
+  outside a request and are not bound either.
+- The school follows request.user at each scoped query. For an API request
+  that is the session user until DRF has authenticated the request, then
+  the device token's or Basic auth user DRF sets. Requests that run no
+  scoped query never load the user for it.
+- `all_objects` is the default manager of those models and is never scoped.
+  Django uses the default manager for uniqueness validation, logins and
+  related-object lookups, which must see every school.
+- school_scope(school_id) binds a block explicitly, e.g. in a shell or a job
+  run for one school.
+
+The dashboard's cached fragments are versioned per school as well
+(core/fragments.py).
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.contrib.auth.models import UserManager
+from django.db import models
+from django.db.models import Q
+
+# A school id, None, or a callable that works out the request's school
+_current_school = contextvars.ContextVar('current_school', default=None)
+
+
+def school_of(user):
+    """The school a user's requests are bound to; None for superusers and users without a school."""
+    if not user.is_authenticated or user.is_superuser or getattr(user, 'role', None) == 'superuser':
+        return None
+    return user.school_id
+
+
+def current_school_id():
+    """The id of the school the current request or block is bound to, or None if it sees every school."""
+    school_id = _current_school.get()
+    return school_id() if callable(school_id) else school_id
+
+
+@contextmanager
+def school_scope(school_id):
+    """Binds the block to one school, or to none (every school) with None."""
+    token = _current_school.set(school_id)
+    try:
+        yield
+    finally:
+        _current_school.reset(token)
+
+
+def for_school(queryset, school_id, field='school_id'):
+    """Rows of the queryset that belong to the school, through `field`; all of them for None."""
+    if school_id is None:
+        return queryset
+    return queryset.filter(**{field: school_id})
+
+
+def school_path(model):
+    """The lookup from the model to its school's id ('pk', 'school_id' or 'bus__school_id'), or None."""
+    opts = model._meta
+    if opts.label == 'core.School':
+        return 'pk'
+    fields = {field.name: field for field in opts.get_fields() if field.many_to_one}
+    if 'school' in fields:
+        return 'school_id'
+    if 'bus' in fields and school_path(fields['bus'].related_model) == 'school_id':
+        return 'bus__school_id'
+    return None
+
+
+def school_q(model, school_id):
+    """
+    Q matching the model's rows that belong to the school (see school_path).
+    A notification without a bus is a broadcast and belongs to its sender's school.
+    """
+    q = Q(**{school_path(model): school_id})
+    if model._meta.label == 'core.Notification':
+        q |= Q(bus__isnull=True, sender__school_id=school_id)
+    return q
+
+
+class SchoolScopedManagerMixin:
+    def get_queryset(self):
+        return for_school(super().get_queryset(), current_school_id())
+
+
+class SchoolScopedManager(SchoolScopedManagerMixin, models.Manager):
+    """Returns only the bound school's rows while a school is bound."""
+
+
+class SchoolScopedUserManager(SchoolScopedManagerMixin, UserManager):
+    """UserManager (create_user etc.) that returns only the bound school's users."""
+    use_in_migrations = False  # migrations use all_objects
+
+
+class CurrentSchoolMiddleware:
+    """Binds the request to its user's school (see school_of); must come after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Not cached: DRF replaces request.user with the user its authenticators found
+        token = _current_school.set(lambda: school_of(request.user))
+        try:
+            return self.get_response(request)
+        finally:
+            _current_school.reset(token)
@@ -1,3 +1,677 @@
-from django.test import TestCase
+import base64
+import io
+import random
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from tablib import Dataset
+
+from core import analytics, archive, benchmarks, geometry, ingest, routing, spatial
+from core.views import DashboardView
+from core.admin import StudentResource
+from core.authentication import issue_device_token
+from core.profiler import SamplingProfiler
+from core.bulk_import import BulkImporter
+from core.models import (
+    Bus, BulkImportJob, BusDailyStats, BusLocation, Concern, CustomUser, Notification, Route, School, Student,
+)
+from core.spool import LocationSpool
+from core.synthetic import FleetGenerator
+from core.tenancy import school_scope
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_school(name='School'):
+    return School.objects.create(name=name, address='Muscat', latitude=23.58, longitude=58.38)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LocationBufferTests(TestCase):
+    def setUp(self):
+        school = make_school()
+        self.bus = Bus.objects.create(bus_number='B1', school=school)
+        self.other = Bus.objects.create(bus_number='B2', school=school)
+        # Flushed by the tests only; the flusher thread would wait an hour
+        self.buffer = ingest.LocationBuffer(flush_size=1000, flush_interval_ms=3600 * 1000)
+        self.addCleanup(self.buffer.stop)
+
+    def test_fixes_of_a_deleted_bus_are_dropped(self):
+        self.buffer.add([ingest.make_fix(self.bus.id, 23.5, 58.3), ingest.make_fix(self.other.id, 23.6, 58.4)])
+        self.bus.delete()
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.stats()['queue_depth'], 0)
+        self.assertEqual(BusLocation.objects.filter(bus=self.other).count(), 1)
+
+    def test_rejected_fixes_are_isolated_and_dropped(self):
+        self.buffer.add([ingest.make_fix(self.bus.id, 23.5, 58.3 + i / 1000, seq=i) for i in range(8)])
+        write = ingest._write_fixes
+
+        def reject_seq_5(fixes):
+            if any(fix.seq == 5 for fix in fixes):
+                raise IntegrityError('rejected')
+            return write(fixes)
+
+        with mock.patch('core.ingest._write_fixes', side_effect=reject_seq_5):
+            self.buffer.flush()
+        stats = self.buffer.stats()
+        self.assertEqual((stats['queue_depth'], stats['rejected_total'], stats['flushed_total']), (0, 1, 7))
+        self.assertEqual(sorted(BusLocation.objects.values_list('seq', flat=True)), [0, 1, 2, 3, 4, 6, 7])
+
+    def test_transient_errors_keep_the_batch_queued(self):
+        self.buffer.add([ingest.make_fix(self.bus.id, 23.5, 58.3), ingest.make_fix(self.other.id, 23.6, 58.4)])
+        with mock.patch('core.ingest._write_fixes', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.buffer.flush()
+        stats = self.buffer.stats()
+        self.assertEqual((stats['queue_depth'], stats['failed_flushes']), (2, 1))
+        self.assertEqual(self.buffer.flush(), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RollupTests(TestCase):
+    def setUp(self):
+        self.bus = Bus.objects.create(bus_number='B1', school=make_school())
+
+    def daily_fixes(self):
+        return list(BusDailyStats.objects.filter(bus=self.bus).values_list('fixes', flat=True))
+
+    def test_retried_seqs_are_counted_once(self):
+        first = ingest.make_fix(self.bus.id, 23.5, 58.3, seq=1)
+        retry = first._replace(timestamp=first.timestamp + timedelta(seconds=1))
+        self.assertEqual(len(ingest.write_fixes([first, retry])), 1)
+        self.assertEqual(ingest.write_fixes([retry]), [])
+        self.assertEqual(BusLocation.objects.count(), 1)
+        self.assertEqual(self.daily_fixes(), [1])
+
+    def test_replayed_fixes_are_rolled_up(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        spool = LocationSpool(directory.name)
+        spool.append([ingest.make_fix(self.bus.id, 23.5, 58.3 + i / 1000, seq=i) for i in range(3)])
+        spool.close()
+        call_command('replay_spool', directory.name, stdout=io.StringIO())
+        self.assertEqual(BusLocation.objects.count(), 3)
+        self.assertEqual(self.daily_fixes(), [3])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DeviceSeqTests(TestCase):
+    def setUp(self):
+        self.driver = CustomUser.objects.create_user('driver', role='driver')
+        self.bus = Bus.objects.create(bus_number='B1', driver=self.driver, school=make_school())
+        # A fresh window per test, as in a worker that has not seen these seqs
+        patcher = mock.patch('core.ingest._recent_seqs', ingest.RecentSeqWindow())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, key, seqs):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Device {key}')
+        fixes = [{'latitude': 23.5, 'longitude': 58.3 + seq / 1000, 'seq': seq} for seq in seqs]
+        response = client.post(f'/api/bus-trips/{self.bus.id}/post_locations/', {'fixes': fixes}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['accepted'], response.json()['duplicates']
+
+    def test_devices_of_one_bus_count_their_own_seqs(self):
+        _, phone = issue_device_token(self.driver, self.bus)
+        _, tablet = issue_device_token(self.driver, self.bus)
+        self.assertEqual(self.post(phone, [1, 2]), (2, 0))
+        self.assertEqual(self.post(tablet, [1, 2]), (2, 0))
+        self.assertEqual(BusLocation.objects.count(), 4)
+
+    def test_seqs_already_stored_are_reported_as_duplicates(self):
+        _, key = issue_device_token(self.driver, self.bus)
+        self.assertEqual(self.post(key, [1, 2]), (2, 0))
+        with mock.patch('core.ingest._recent_seqs', ingest.RecentSeqWindow()):  # e.g. another worker
+            self.assertEqual(self.post(key, [2, 3]), (1, 1))
+        self.assertEqual(sorted(BusLocation.objects.values_list('seq', flat=True)), [1, 2, 3])
+
+
+class ApplyPlanTests(TestCase):
+    def setUp(self):
+        self.school = make_school()
+        self.full, self.empty = (Bus.objects.create(bus_number=number, school=self.school) for number in ('B1', 'B2'))
+        self.old_stops = [{'name': 'Stop 1', 'lat': 23.6, 'lng': 58.4}]
+        self.kept = Route.objects.create(name='R2', school=self.school, bus=self.empty, stops=self.old_stops)
+        self.rewritten = Route.objects.create(name='R1', school=self.school, bus=self.full, stops=self.old_stops)
+        self.students = [
+            Student.objects.create(first_name=f'Kid{i}', last_name='X', school=self.school, assigned_route=route)
+            for i, route in enumerate([self.rewritten, self.rewritten, self.kept])
+        ]
+
+    def test_buses_without_stops_keep_their_route(self):
+        placed, left_out, _ = self.students
+        plan = routing.SchoolPlan(self.school.id, [
+            routing.BusRoute(self.full.id, [routing.PlanStop(23.5, 58.3, [placed.id])], 1000, 1),
+            routing.BusRoute(self.empty.id, [], 0, 0),
+        ], [routing.PlanStop(23.7, 58.5, [left_out.id])], 0)
+        self.assertEqual(routing.apply_plan(plan), 1)
+        self.kept.refresh_from_db()
+        self.assertEqual(self.kept.stops, self.old_stops)
+        self.assertEqual(Route.objects.get(pk=self.rewritten.pk).stops[0]['student_ids'], [placed.id])
+        assigned = dict(Student.objects.values_list('id', 'assigned_route'))
+        self.assertEqual([assigned[s.id] for s in self.students], [self.rewritten.id, None, self.kept.id])
+
+
+
+class ClusterStopsTests(TestCase):
+    def test_stops_stay_within_walking_distance_and_capacity(self):
+        rng = random.Random(7)
+        pickups = [routing.PlanStop(23.58 + rng.uniform(-0.02, 0.02), 58.38 + rng.uniform(-0.02, 0.02), [i])
+                   for i in range(300)]
+        stops = routing.cluster_stops(pickups, max_walk_m=300, max_students=6)
+        self.assertLess(len(stops), len(pickups))
+        self.assertEqual(sorted(i for stop in stops for i in stop.student_ids), list(range(300)))
+        for stop in stops:
+            self.assertLessEqual(len(stop.student_ids), 6)
+            for i in stop.student_ids:
+                walk = geometry.haversine_m((pickups[i].lat, pickups[i].lng), (stop.lat, stop.lng))
+                self.assertLessEqual(walk, 300 * 1.01)
+        self.assertEqual(routing.cluster_stops(pickups, max_walk_m=0), pickups)
+
+
+class HistoryAnalyzerTests(TestCase):
+    def test_report_on_one_morning_run(self):
+        school = make_school()
+        bus = Bus.objects.create(bus_number='B1', school=school)
+        stops = [{'name': 'Stop 1', 'lat': 23.58, 'lng': 58.38}, {'name': 'Stop 2', 'lat': 23.58, 'lng': 58.39}]
+        route = Route.objects.create(name='R1', school=school, bus=bus, stops=stops)
+        day = timezone.localdate() - timedelta(days=1)
+        start = timezone.make_aware(datetime(day.year, day.month, day.day, 8))
+        fixes = [
+            (0, 23.58, 58.38, 0), (30, 23.58, 58.38, 0),  # 30 s at the first stop
+            (60, 23.58, 58.383, 20), (90, 23.58, 58.385, 30), (120, 23.58, 58.387, 40),
+            (150, 24.0, 58.385, 5),  # off the route: a hotspot, but no segment speed
+            (180, 23.58, 58.39, 0), (190, 23.58, 58.39, 0),  # 10 s at the second
+        ]
+        BusLocation.objects.bulk_create([
+            BusLocation(bus=bus, latitude=lat, longitude=lng, speed=speed, timestamp=start + timedelta(seconds=t))
+            for t, lat, lng, speed in fixes
+        ])
+        report = analytics.HistoryAnalyzer(day, day, MIN_SAMPLES=1, HOTSPOT_MIN_FIXES=1, CHUNK_SIZE=3).run()
+        self.assertEqual(report.fixes_scanned, len(fixes))
+        rows = {(row.kind, row.index): row for row in report.rows.all()}
+        self.assertEqual(sorted(rows), [
+            ('hotspot', None), ('segment_speed', 0), ('stop_dwell', 0), ('stop_dwell', 1),
+        ])
+        segment = rows['segment_speed', 0]
+        self.assertEqual((segment.route_id, segment.hour, segment.samples), (route.id, 8, 3))
+        self.assertAlmostEqual(segment.mean_speed, 30)
+        self.assertEqual([rows['stop_dwell', i].mean_dwell_seconds for i in (0, 1)], [30, 10])
+        hotspot = rows['hotspot', None]
+        self.assertEqual((hotspot.samples, hotspot.slow_share), (1, 1))
+
+
+class ArchiveRoundTripTests(TestCase):
+    fields = ('bus__bus_number', 'timestamp', 'latitude', 'longitude', 'speed', 'heading', 'is_trip_start',
+              'is_trip_end', 'seq', 'device')
+
+    def test_export_then_import_restores_the_history(self):
+        school = make_school()
+        now = timezone.now().replace(microsecond=0)
+        for device, number in enumerate(('B1', 'B2'), start=7):
+            bus = Bus.objects.create(bus_number=number, school=school)
+            BusLocation.objects.create(bus=bus, latitude=23.5, longitude=58.3, timestamp=now, is_trip_start=True)
+            BusLocation.objects.create(bus=bus, latitude=23.51, longitude=58.31, speed=32.5, heading=90,
+                                       timestamp=now + timedelta(seconds=5), seq=1, device=device)
+        history = sorted(BusLocation.objects.values_list(*self.fields))
+
+        for file_format, compress in (('csv', False), ('ndjson', True)):
+            with self.subTest(file_format=file_format, compress=compress):
+                data = b''.join(archive.export_chunks(file_format, compress=compress))
+                BusLocation.objects.all().delete()
+                counts = archive.HistoryImporter(batch_size=3).run(io.BytesIO(data))
+                self.assertEqual((counts['read'], counts['inserted']), (4, 4))
+                self.assertEqual(sorted(BusLocation.objects.values_list(*self.fields)), history)
+                # Importing the same archive again adds nothing
+                counts = archive.HistoryImporter().run(io.BytesIO(data))
+                self.assertEqual((counts['inserted'], counts['existing']), (0, 4))
+        self.assertEqual(BusDailyStats.objects.filter(fixes=1, trips_started=1).count(), 2)
+
+
+class SpatialRefreshTests(TestCase):
+    def test_refresh_finds_fixes_older_than_what_it_has_read(self):
+        school = make_school()
+        ahead, behind = Bus.objects.create(bus_number='A', school=school), Bus.objects.create(bus_number='B', school=school)
+        index = spatial.LiveBusIndex()
+        now = timezone.now()
+        ingest.write_fixes([ingest.make_fix(ahead.id, 23.5, 58.3, timestamp=now + timedelta(minutes=4))])
+        index.refresh(force=True)
+        # Written by another worker, from a device whose clock runs late
+        ingest.write_fixes([ingest.make_fix(behind.id, 23.6, 58.4, timestamp=now - timedelta(minutes=10))])
+        index.refresh(force=True)
+        self.assertEqual(index.get(behind.id).latitude, 23.6)
+
+
+
+class FleetGeneratorTests(TestCase):
+    def test_parents_share_their_childrens_school(self):
+        FleetGenerator(prefix='T', schools=3, buses=4, students=15, days=0, seed=1).run()
+        students = Student.all_objects.select_related('parent')
+        self.assertEqual(students.count(), 15)
+        for student in students:
+            self.assertEqual(student.parent.school_id, student.school_id, student.student_id)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TripMarkerTests(TestCase):
+    def setUp(self):
+        self.driver = CustomUser.objects.create_user('driver', password='pw', role='driver')
+        self.bus = Bus.objects.create(bus_number='B1', driver=self.driver, school=make_school(), status='delayed')
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def test_trip_cannot_start_before_the_bus_has_a_position(self):
+        response = self.client.post(f'/api/bus-trips/{self.bus.id}/start/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BusLocation.objects.exists())
+        self.bus.refresh_from_db()
+        self.assertEqual(self.bus.status, 'delayed')
+
+    def test_trip_markers_use_the_last_position(self):
+        Bus.objects.filter(pk=self.bus.pk).update(last_known_latitude=23.5, last_known_longitude=58.3)
+        self.assertEqual(self.client.post(f'/api/bus-trips/{self.bus.id}/start/').status_code, 200)
+        self.assertEqual(self.client.post(f'/api/bus-trips/{self.bus.id}/stop/').status_code, 200)
+        self.assertEqual(
+            list(BusLocation.objects.order_by('id').values_list('latitude', 'is_trip_start', 'is_trip_end')),
+            [(23.5, True, False), (23.5, False, True)],
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LiveBusLocationTests(TestCase):
+    def setUp(self):
+        school = make_school()
+        self.parent = CustomUser.objects.create_user('parent', role='parent', school=school)
+        self.admin = CustomUser.objects.create_user('admin', role='admin', school=school)
+        self.bus = Bus.objects.create(bus_number='B1', school=school)
+        Bus.objects.create(bus_number='B2', school=school)
+        route = Route.objects.create(name='R1', school=school, bus=self.bus)
+        Student.objects.create(first_name='Kid', last_name='One', school=school, parent=self.parent,
+                               assigned_route=route)
+        for i in range(3):
+            BusLocation.objects.create(bus=self.bus, latitude=23.5, longitude=58.3 + i / 1000)
+        self.client = APIClient()
+
+    def test_parents_see_their_childrens_buses(self):
+        self.client.force_authenticate(self.parent)
+        response = self.client.get('/api/live-bus-locations/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([bus['bus_number'] for bus in response.json()], ['B1'])
+
+    def test_polling_leaves_history_alone(self):
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(len(self.client.get('/api/live-bus-locations/').json()), 2)
+        self.assertEqual(BusLocation.objects.count(), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchoolBulkImportTests(TestCase):
+    def setUp(self):
+        self.school, self.other = make_school('A'), make_school('B')
+        self.parent = CustomUser.objects.create_user('parent', role='parent', school=self.school)
+        self.other_parent = CustomUser.objects.create_user('other_parent', role='parent', school=self.other)
+        Student.objects.create(first_name='Old', last_name='Other', student_id='S1', school=self.other)
+
+    def run_import(self, csv_text, school_id):
+        importer = BulkImporter(StudentResource, school_id=school_id)
+        valid = importer.validate(io.BytesIO(csv_text.encode()))
+        if valid:
+            importer.apply(io.BytesIO(csv_text.encode()))
+        return importer
+
+    def test_school_import_cannot_touch_other_schools(self):
+        importer = self.run_import(
+            'first_name,last_name,parent,student_id\n'
+            'New,Name,,S1\n'
+            f'Kid,One,{self.other_parent.id},S2\n',
+            self.school.id,
+        )
+        self.assertEqual([error['line'] for error in importer.errors], [2, 3])
+        self.assertIn('another school', importer.errors[0]['error'])
+        self.assertEqual(Student.objects.get(student_id='S1').first_name, 'Old')
+
+    def test_school_import_creates_rows_in_the_school(self):
+        importer = self.run_import(
+            f'first_name,last_name,parent,student_id\nKid,One,{self.parent.id},S2\n', self.school.id,
+        )
+        self.assertEqual(importer.errors, [])
+        self.assertEqual(Student.objects.get(student_id='S2').school, self.school)
+
+    def stock_import(self, *rows):
+        dataset = Dataset(*rows, headers=['first_name', 'last_name', 'parent', 'student_id'])
+        with school_scope(self.school.id):  # as the admin's import view runs
+            return StudentResource().import_data(dataset)
+
+    def test_stock_import_creates_rows_in_the_school(self):
+        self.assertFalse(self.stock_import(('Kid', 'One', self.parent.id, 'S2')).has_errors())
+        self.assertEqual(Student.objects.get(student_id='S2').school, self.school)
+
+    def test_stock_import_cannot_touch_other_schools(self):
+        self.assertTrue(self.stock_import(('New', 'Name', '', 'S1')).has_errors())
+        self.assertTrue(self.stock_import(('Kid', 'One', self.other_parent.id, 'S2')).has_errors())
+        self.assertEqual(list(Student.objects.values_list('student_id', 'first_name')), [('S1', 'Old')])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchoolAdminScopingTests(TestCase):
+    def setUp(self):
+        self.school, self.other = make_school('A'), make_school('B')
+        self.admin = CustomUser.objects.create_user('admin', role='admin', school=self.school, is_staff=True)
+        for school in (self.school, self.other):
+            driver = CustomUser.objects.create_user(f'driver{school.name}', role='driver', school=school)
+            bus = Bus.objects.create(bus_number=f'{school.name}1', school=school, driver=driver)
+            user = CustomUser.objects.create_user(f'parent{school.name}', role='parent', school=school)
+            Concern.objects.create(raised_by=user, bus=bus, subject=f'{school.name} concern', description='-')
+            Notification.objects.create(bus=bus, subject=f'{school.name} bus notice', message='-')
+            Notification.objects.create(sender=user, subject=f'{school.name} broadcast', message='-')
+            BusLocation.objects.create(bus=bus, latitude=23.5, longitude=58.3)
+            BusDailyStats.objects.create(bus=bus, date=timezone.localdate())
+            issue_device_token(driver, bus)
+            BulkImportJob.objects.create(model='core.Student', file='imports/x.csv', created_by=user)
+        self.client.force_login(self.admin)
+
+    def changelist(self, model):
+        response = self.client.get(f'/admin/core/{model}/')
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].queryset)
+
+    def test_changelists_show_only_the_admins_school(self):
+        self.assertEqual([str(bus) for bus in self.changelist('bus')], ['A1 (A)'])
+        self.assertEqual([concern.subject for concern in self.changelist('concern')], ['A concern'])
+        self.assertEqual(sorted(n.subject for n in self.changelist('notification')), ['A broadcast', 'A bus notice'])
+        for model in ('buslocation', 'busdailystats', 'devicetoken'):
+            self.assertEqual([row.bus.school for row in self.changelist(model)], [self.school], model)
+        self.assertEqual([job.created_by.school for job in self.changelist('bulkimportjob')], [self.school])
+
+    def test_other_schools_rows_cannot_be_opened(self):
+        concern = Concern.objects.get(subject='B concern')
+        response = self.client.get(f'/admin/core/concern/{concern.pk}/change/')
+        self.assertEqual(response.status_code, 302)  # "doesn't exist", back to the index
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ManagementTableTests(TestCase):
+    def setUp(self):
+        school = make_school()
+        self.client.force_login(CustomUser.objects.create_user('admin', role='admin', school=school))
+        for number in ('B1', 'B2', 'B3', 'B4', 'B5', 'X6', 'X7'):
+            Bus.objects.create(bus_number=number, school=school)
+
+    def page(self, **params):
+        response = self.client.get('/manage-buses/data/', {'draw': 1, 'length': 2, **params})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return data, [row[0] for row in data['data']]
+
+    def test_cursor_seeks_past_the_last_row_seen(self):
+        data, numbers = self.page()
+        self.assertEqual(numbers, ['B1', 'B2'])
+        self.assertEqual(data['next_start'], 2)
+        cursor = data['next_cursor']
+        # An OFFSET page would now skip B3
+        Bus.objects.filter(bus_number='B1').delete()
+        _, numbers = self.page(start=2, cursor=cursor)
+        self.assertEqual(numbers, ['B3', 'B4'])
+        # A cursor issued for another sort order is ignored
+        _, numbers = self.page(start=2, cursor=cursor, **{'order[0][dir]': 'desc'})
+        self.assertEqual(numbers, ['B5', 'B4'])
+
+    def test_search_counts_filtered_rows(self):
+        data, numbers = self.page(**{'search[value]': 'x'})
+        self.assertEqual((data['recordsTotal'], data['recordsFiltered']), (7, 2))
+        self.assertEqual(numbers, ['X6', 'X7'])
+        self.assertNotIn('next_cursor', data)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DashboardFragmentTests(TestCase):
+    def test_saving_a_row_invalidates_only_its_schools_fragments(self):
+        school, other = make_school('A'), make_school('B')
+        self.client.force_login(CustomUser.objects.create_user('admin', role='admin', school=school))
+        statistics = mock.patch.object(DashboardView, '_admin_statistics', autospec=True,
+                                       side_effect=DashboardView._admin_statistics)
+
+        def renders():
+            with statistics as computed:
+                self.assertEqual(self.client.get('/').status_code, 200)
+            return computed.call_count
+
+        self.assertEqual(renders(), 1)
+        self.assertEqual(renders(), 0)
+        Student.objects.create(first_name='Kid', last_name='B', school=other)
+        self.assertEqual(renders(), 0)
+        Student.objects.create(first_name='Kid', last_name='A', school=school)
+        self.assertEqual(renders(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RouteGeometryTests(TestCase):
+    stops = [{'name': 'Stop 1', 'lat': 23.58, 'lng': 58.38}, {'name': 'Stop 2', 'lat': 23.6, 'lng': 58.4}]
+
+    def test_unchanged_route_revalidates_to_304(self):
+        school = make_school()
+        self.client.force_login(CustomUser.objects.create_user('admin', role='admin', school=school))
+        route = Route.objects.create(name='R1', school=school, stops=self.stops)
+        response = self.client.get(f'/api/routes/{route.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['points'], [[23.58, 58.38], [23.6, 58.4]])
+        etag = response['ETag']
+        response = self.client.get(f'/api/routes/{route.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content), (304, b''))
+        route.stops = self.stops[:1]
+        route.save()
+        response = self.client.get(f'/api/routes/{route.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_cached_geometry_expires(self):
+        with mock.patch('core.geometry.build_geometry', wraps=geometry.build_geometry) as build:
+            geometry.route_geometry(self.stops)
+            geometry.route_geometry(self.stops)
+            self.assertEqual(build.call_count, 1)
+            with mock.patch('time.time', return_value=time.time() + geometry.CACHE_TIMEOUT + 1):
+                geometry.route_geometry(self.stops)
+            self.assertEqual(build.call_count, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch('core.changelists.MAX_EXACT_COUNT', 5)
+class LocationChangelistTests(TestCase):
+    def setUp(self):
+        school = make_school()
+        self.client.force_login(CustomUser.objects.create_superuser('root', 'root@example.com', 'pw12345!'))
+        self.bus = Bus.objects.create(bus_number='B1', school=school)
+        for i in range(8):
+            BusLocation.objects.create(bus=self.bus, latitude=23.5, longitude=58.3 + i / 1000)
+        BusLocation.objects.order_by('id').first().delete()
+
+    def result_count(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/core/buslocation/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl'].result_count, [query['sql'] for query in queries]
+
+    def test_unfiltered_count_is_the_table_estimate(self):
+        count, queries = self.result_count()
+        # SQLite's estimate is the newest rowid, so it still includes the deleted row
+        self.assertEqual(count, 8)
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql and 'core_buslocation' in sql])
+
+    def test_filtered_count_is_capped(self):
+        count, _ = self.result_count(bus__id__exact=self.bus.pk)
+        self.assertEqual(count, 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchoolManagementScopingTests(TestCase):
+    def test_other_schools_rows_cannot_be_edited_or_deleted(self):
+        school, other = make_school('A'), make_school('B')
+        self.client.force_login(CustomUser.objects.create_user('admin', role='admin', school=school))
+        parent = CustomUser.objects.create_user('parent', role='parent', school=other)
+        bus = Bus.objects.create(bus_number='B1', school=other)
+        rows = {
+            'users': parent,
+            'students': Student.objects.create(first_name='Kid', last_name='B', school=other),
+            'buses': bus,
+            'routes': Route.objects.create(name='R1', school=other, bus=bus),
+        }
+        for page, row in rows.items():
+            for action in ('edit', 'delete'):
+                response = self.client.get(f'/manage-{page}/{action}/{row.pk}/')
+                self.assertEqual(response.status_code, 404, f'{page} {action}')
+        self.assertEqual(self.client.post(f'/manage-buses/delete/{bus.pk}/').status_code, 404)
+        self.assertTrue(Bus.objects.filter(pk=bus.pk).exists())
+        own = Bus.objects.create(bus_number='A1', school=school)
+        self.assertEqual(self.client.get(f'/manage-buses/edit/{own.pk}/').status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchoolApiScopingTests(TestCase):
+    def setUp(self):
+        # The process's bus index would still hold buses of earlier tests
+        patcher = mock.patch('core.spatial._index', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.school, self.other = make_school('A'), make_school('B')
+        now = timezone.now()
+        for i in range(2):  # far from the search point
+            Bus.objects.create(bus_number=f'A{i}', school=self.school, last_known_latitude=24.0 + i / 100,
+                               last_known_longitude=58.38, last_known_location_time=now)
+        for i in range(5):  # next to it
+            Bus.objects.create(bus_number=f'B{i}', school=self.other, last_known_latitude=23.58 + i / 1000,
+                               last_known_longitude=58.38, last_known_location_time=now)
+        CustomUser.objects.create_user('admin', password='pw12345!', role='admin', school=self.school)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'admin:pw12345!').decode())
+
+    def test_basic_auth_requests_are_bound_to_the_users_school(self):
+        response = self.client.get('/api/buses/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(bus['bus_number'] for bus in response.json()), ['A0', 'A1'])
+
+    def test_other_schools_bus_history_is_not_found(self):
+        for number, status in (('A0', 200), ('B0', 404)):
+            bus = Bus.objects.get(bus_number=number)
+            self.assertEqual(self.client.get(f'/api/bus-trips/{bus.pk}/location_history/').status_code, status)
+
+    def test_history_export_holds_only_the_admins_buses(self):
+        for bus in Bus.objects.all():
+            BusLocation.objects.create(bus=bus, latitude=23.5, longitude=58.3)
+        response = self.client.get('/api/location-history/export/', {'since': timezone.localdate().isoformat()})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(sorted(line.split(',')[0] for line in lines[1:]), ['A0', 'A1'])
+
+    def test_ingest_status_lists_only_the_admins_buses(self):
+        response = self.client.get('/api/bus-trips/ingest_status/')
+        self.assertEqual(sorted(bus['bus_number'] for bus in response.json()['buses']), ['A0', 'A1'])
+
+    def test_nearest_returns_k_buses_of_the_admins_school(self):
+        response = self.client.get('/api/buses/nearest/', {'lat': 23.58, 'lng': 58.38, 'k': 2})
+        self.assertEqual([bus['bus_number'] for bus in response.json()['results']], ['A0', 'A1'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchoolAnalyticsScopingTests(TestCase):
+    def setUp(self):
+        today = timezone.localdate()
+        for name, fixes in (('A', 10), ('B', 100)):
+            bus = Bus.objects.create(bus_number=f'{name}1', school=make_school(name))
+            BusDailyStats.objects.create(bus=bus, date=today, fixes=fixes)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create_user('admin', role='admin', school=School.objects.get(name='A')))
+
+    def test_admins_get_their_schools_stats_and_totals(self):
+        rows = self.client.get('/api/analytics/daily/').json()
+        self.assertEqual([row['fixes'] for row in rows], [10])
+        days = self.client.get('/api/analytics/daily/fleet/').json()
+        self.assertEqual([(day['buses'], day['fixes']) for day in days], [(1, 10)])
+
+
+class RolePermissionTests(TestCase):
+    def test_school_admins_get_only_school_scoped_models(self):
+        admin = CustomUser.objects.create_user('admin', role='admin', school=make_school(), is_staff=True)
+        self.assertTrue(admin.has_perms(['core.change_student', 'core.delete_concern', 'core.view_buslocation']))
+        for permission in ('core.delete_buslocation', 'core.change_devicetoken', 'core.view_historyreport',
+                           'core.change_school'):
+            self.assertFalse(admin.has_perm(permission), permission)
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get('/admin/core/historyreport/').status_code, 403)
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES, REQUEST_METRICS={'ENABLED': True, 'SAMPLE_RATE': 1.0, 'TOKEN': 'scrape'})
+class RequestMetricsTests(TestCase):
+    def test_metrics_need_the_token_or_staff_and_histogram_sampled_requests(self):
+        school = make_school()
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.client.force_login(CustomUser.objects.create_user('admin', role='admin', school=school))
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+        for _ in range(2):
+            self.assertEqual(self.client.get('/manage-buses/data/').status_code, 200)
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE busmonitor_request_duration_seconds histogram', body)
+
+        def sample(line):
+            return float(re.search(re.escape(line) + r' (\S+)', body).group(1))
+
+        count = sample('busmonitor_request_queries_count{view="core:manage_buses_data"}')
+        self.assertGreaterEqual(count, 2)
+        self.assertEqual(sample('busmonitor_request_queries_bucket{view="core:manage_buses_data",le="+Inf"}'), count)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PROFILER={'MAX_SECONDS': 5})
+class ProfileViewTests(TestCase):
+    def test_admins_start_one_bounded_profile_at_a_time(self):
+        school = make_school()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiler = SamplingProfiler(directory.name, interval_ms=5)
+        patcher = mock.patch('core.profiler._profiler', profiler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(CustomUser.objects.create_user('driver', role='driver', school=school))
+        self.assertEqual(self.client.post('/profile/?seconds=1').status_code, 403)
+        self.client.force_login(CustomUser.objects.create_user('admin', role='admin', school=school))
+        for seconds in ('0', '6', 'soon'):
+            self.assertEqual(self.client.post(f'/profile/?seconds={seconds}').status_code, 400, seconds)
+
+        self.assertEqual(self.client.post('/profile/?seconds=0.2').status_code, 202)
+        self.assertEqual(self.client.post('/profile/?seconds=0.2').status_code, 409)
+        deadline = time.monotonic() + 5
+        while self.client.get('/profile/').json()['running'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        report = self.client.get('/profile/').json()
+        self.assertFalse(report['running'])
+        self.assertIsNone(report['error'])
+        self.assertGreater(report['samples'], 0)
+        with open(report['path'], encoding='utf-8') as collapsed:
+            self.assertTrue(collapsed.read().strip())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkTests(TransactionTestCase):
+    def test_all_benchmarks_run_in_one_database(self):
+        # What `manage.py benchmark` runs inside its test database, scaled down
+        params = {'fixes': 200, 'requests': 3, 'basic_requests': 2, 'buses': 10, 'students': 50, 'schools': 2,
+                  'queries': 20, 'seconds': 0.5, 'repeat': 1}
+        self.addCleanup(benchmarks.reset_benchmark_state)
+        results = benchmarks.run_benchmarks(list(benchmarks.BENCHMARKS), params, io.StringIO())
+        self.assertEqual(list(results), list(benchmarks.BENCHMARKS))
+        self.assertTrue(all(results.values()))
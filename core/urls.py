@@ -3,6 +3,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views # Your existing views for templates
+from .archive import history_export_view
+from .metrics import metrics_view
+from .profiler import profile_view
 
 # Create a router and register our viewsets with it.
 router = DefaultRouter()
@@ -10,6 +13,7 @@ router.register(r'buses', views.BusViewSet, basename='bus') # Provides list and
 router.register(r'bus-trips', views.BusTripViewSet, basename='bus-trip') # Provides start/stop/post_location actions for buses
 router.register(r'live-bus-locations', views.LiveBusLocationViewSet, basename='live-bus-location') # Provides list of live locations
 router.register(r'routes', views.RouteViewSet, basename='route') # Provides list and detail for routes
+router.register(r'analytics/daily', views.BusDailyStatsViewSet, basename='daily-stats') # Per-bus per-day rollups, plus /fleet/ totals
 
 # You would register other ViewSets here (User, Student, Concern, Notification)
 # router.register(r'users', api_views.UserViewSet, basename='user')
@@ -36,24 +40,28 @@ urlpatterns = [
 
     # Manage Users
     path('manage-users/', views.ManageUsersView.as_view(), name='manage_users'),
+    path('manage-users/data/', views.ManageUsersDataView.as_view(), name='manage_users_data'),
     path('manage-users/add/', views.AddUserView.as_view(), name='add_user'),
     path('manage-users/edit/<int:pk>/', views.EditUserView.as_view(), name='edit_user'),
     path('manage-users/delete/<int:pk>/', views.DeleteUserView.as_view(), name='delete_user'),
 
     # Manage Students
     path('manage-students/', views.ManageStudentsView.as_view(), name='manage_students'),
+    path('manage-students/data/', views.ManageStudentsDataView.as_view(), name='manage_students_data'),
     path('manage-students/add/', views.AddStudentView.as_view(), name='add_student'),
     path('manage-students/edit/<int:pk>/', views.EditStudentView.as_view(), name='edit_student'),
     path('manage-students/delete/<int:pk>/', views.DeleteStudentView.as_view(), name='delete_student'),
 
     # Manage Buses
     path('manage-buses/', views.ManageBusesView.as_view(), name='manage_buses'),
+    path('manage-buses/data/', views.ManageBusesDataView.as_view(), name='manage_buses_data'),
     path('manage-buses/add/', views.AddBusView.as_view(), name='add_bus'),
     path('manage-buses/edit/<int:pk>/', views.EditBusView.as_view(), name='edit_bus'),
     path('manage-buses/delete/<int:pk>/', views.DeleteBusView.as_view(), name='delete_bus'),
 
     # Manage Routes
     path('manage-routes/', views.ManageRoutesView.as_view(), name='manage_routes'),
+    path('manage-routes/data/', views.ManageRoutesDataView.as_view(), name='manage_routes_data'),
     path('manage-routes/add/', views.AddRouteView.as_view(), name='add_route'),
     path('manage-routes/edit/<int:pk>/', views.EditRouteView.as_view(), name='edit_route'),
     path('manage-routes/delete/<int:pk>/', views.DeleteRouteView.as_view(), name='delete_route'),
@@ -71,6 +79,10 @@ urlpatterns = [
     path('start_trip/<int:bus_id>/', views.start_trip, name='start_trip'),
     path('stop_trip/<int:bus_id>/', views.stop_trip, name='stop_trip'),
 
+    path('metrics/', metrics_view, name='metrics'),
+    path('profile/', profile_view, name='profile'),
+    path('api/location-history/export/', history_export_view, name='location_history_export'),
+
     # API URLs (using DRF Router)
     path('api/', include(router.urls)),
 ]
@@ -1,25 +1,36 @@
-from datetime import timedelta
+import hashlib
+from datetime import date, timedelta
 from django.http import HttpResponse
 from django.utils import timezone
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views.generic import TemplateView, CreateView
 from django.contrib.auth.views import LoginView, LogoutView, PasswordResetView, PasswordResetDoneView, PasswordResetConfirmView, PasswordResetCompleteView
 from django.contrib.auth.forms import AuthenticationForm
-from django.db.models import Subquery, OuterRef, Q, Avg
+from django.db.models import Subquery, OuterRef, Q, Count, Max, Min, Sum
 from django.contrib.auth import get_user_model
 from django.conf import settings
 
 CustomUser = get_user_model()
 
-from core.serializers import BusSerializer, RouteSerializer
+from core.serializers import BusDailyStatsSerializer, BusSerializer, RouteSerializer
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 
 # Assuming your models are in core.models
-from core.models import Bus, BusLocation, Route, CustomUser, School, Student, Concern, Notification
+from core.models import Bus, BusDailyStats, BusLocation, Route, CustomUser, School, Student, Concern, Notification
+from core import ingest, ingest_metrics, spatial
+from core.authentication import DeviceAuth, issue_device_token
+from core.datatables import Column, DataTablesView
+from core.fragments import fragment_context
+from core.geometry import route_geometry, stops_hash
+from core.tenancy import current_school_id, for_school, school_q
+from django.utils.http import parse_etags
+from django.utils.functional import SimpleLazyObject
+from django.utils.html import escape, format_html
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 
@@ -80,6 +91,13 @@ class SchoolDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         }
         return context
 
+def row_actions(edit_url, delete_url, pk):
+    """Edit/Delete buttons for a server-side DataTables row."""
+    return format_html(
+        '<a href="{}" class="btn btn-sm btn-warning">Edit</a> <a href="{}" class="btn btn-sm btn-danger">Delete</a>',
+        reverse(edit_url, args=[pk]), reverse(delete_url, args=[pk]),
+    )
+
 # Manage Users
 class ManageUsersView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     """View to display a list of all users."""
@@ -90,6 +108,32 @@ class ManageUsersView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+class ManageUsersDataView(DataTablesView):
+    """Server-side DataTables source for the users table."""
+    columns = [
+        Column('username', keyset=True),
+        Column('last_name', keyset=True),
+        Column('email'),
+        Column('role', keyset=True),
+        Column(),
+    ]
+    search_fields = ['username', 'first_name', 'last_name', 'email']
+
+    def test_func(self):
+        return self.request.user.role == 'admin'
+
+    def get_queryset(self):
+        return CustomUser.objects.only('username', 'first_name', 'last_name', 'email', 'role')
+
+    def render_row(self, user):
+        return [
+            escape(user.username),
+            escape(user.get_full_name() or 'N/A'),
+            escape(user.email or 'N/A'),
+            escape(user.get_role_display()),
+            row_actions('core:edit_user', 'core:delete_user', user.pk),
+        ]
+
 class AddUserView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     """View to add a new user."""
     model = CustomUser
@@ -110,6 +154,10 @@ class EditUserView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+    def get_queryset(self):
+        # Not the model's default manager (all_objects): other schools' users must 404
+        return CustomUser.objects.all()
+
 class DeleteUserView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     """View to delete a user."""
     model = CustomUser
@@ -119,6 +167,9 @@ class DeleteUserView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+    def get_queryset(self):
+        return CustomUser.objects.all()
+
 # Manage Students
 class ManageStudentsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     """View to display a list of all students."""
@@ -129,6 +180,36 @@ class ManageStudentsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+class ManageStudentsDataView(DataTablesView):
+    """Server-side DataTables source for the students table."""
+    columns = [
+        Column('student_id'),
+        Column('last_name', keyset=True),
+        Column('parent__last_name'),
+        Column('assigned_route__name'),
+        Column('school__name'),
+        Column(),
+    ]
+    default_order = 1
+    search_fields = ['student_id', 'first_name', 'last_name', 'parent__first_name', 'parent__last_name',
+                     'assigned_route__name']
+
+    def test_func(self):
+        return self.request.user.role == 'admin'
+
+    def get_queryset(self):
+        return Student.objects.select_related('parent', 'assigned_route', 'school')
+
+    def render_row(self, student):
+        return [
+            escape(student.student_id or 'N/A'),
+            escape(f'{student.first_name} {student.last_name}'),
+            escape(student.parent.get_full_name() or student.parent.username) if student.parent else 'N/A',
+            escape(student.assigned_route.name) if student.assigned_route else 'Not Assigned',
+            escape(student.school.name) if student.school else 'N/A',
+            row_actions('core:edit_student', 'core:delete_student', student.pk),
+        ]
+
 class AddStudentView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     """View to add a new student."""
     model = Student
@@ -149,6 +230,9 @@ class EditStudentView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+    def get_queryset(self):
+        return Student.objects.all()
+
     def test_func(self):
         return self.request.user.role == 'admin'
 
@@ -161,6 +245,9 @@ class DeleteStudentView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+    def get_queryset(self):
+        return Student.objects.all()
+
 # Manage Buses
 class ManageBusesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     """View to display a list of all buses."""
@@ -171,6 +258,39 @@ class ManageBusesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+class ManageBusesDataView(DataTablesView):
+    """Server-side DataTables source for the buses table."""
+    columns = [
+        Column('bus_number', keyset=True),
+        Column('capacity'),
+        Column('status', keyset=True),
+        Column('driver__username'),
+        Column('assigned_route__name'),
+        Column(),
+    ]
+    search_fields = ['bus_number', 'driver__username', 'driver__first_name', 'driver__last_name',
+                     'assigned_route__name']
+
+    def test_func(self):
+        return self.request.user.role == 'admin'
+
+    def get_queryset(self):
+        return Bus.objects.select_related('driver', 'assigned_route')
+
+    def render_row(self, bus):
+        try:
+            route = bus.assigned_route
+        except Route.DoesNotExist:
+            route = None
+        return [
+            escape(bus.bus_number),
+            escape(bus.capacity if bus.capacity is not None else 'N/A'),
+            escape(bus.get_status_display()),
+            escape(bus.driver.get_full_name() or bus.driver.username) if bus.driver else 'N/A',
+            escape(route.name) if route else 'Unassigned',
+            row_actions('core:edit_bus', 'core:delete_bus', bus.pk),
+        ]
+
 class AddBusView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     """View to add a new bus."""
     model = Bus
@@ -191,6 +311,9 @@ class EditBusView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+    def get_queryset(self):
+        return Bus.objects.all()
+
 class DeleteBusView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     """View to delete a bus."""
     model = Bus
@@ -200,6 +323,9 @@ class DeleteBusView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+    def get_queryset(self):
+        return Bus.objects.all()
+
 # Manage Routes
 class ManageRoutesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     """View to display a list of all routes."""
@@ -210,6 +336,34 @@ class ManageRoutesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+class ManageRoutesDataView(DataTablesView):
+    """Server-side DataTables source for the routes table."""
+    columns = [
+        Column('name', keyset=True),
+        Column('school__name'),
+        Column('bus__bus_number'),
+        Column('start_time'),
+        Column('end_time'),
+        Column(),
+    ]
+    search_fields = ['name', 'school__name', 'bus__bus_number']
+
+    def test_func(self):
+        return self.request.user.role == 'admin'
+
+    def get_queryset(self):
+        return Route.objects.select_related('school', 'bus').defer('stops')
+
+    def render_row(self, route):
+        return [
+            escape(route.name),
+            escape(route.school.name) if route.school else 'N/A',
+            escape(route.bus.bus_number) if route.bus else 'Unassigned',
+            route.start_time.strftime('%H:%M') if route.start_time else '',
+            route.end_time.strftime('%H:%M') if route.end_time else '',
+            row_actions('core:edit_route', 'core:delete_route', route.pk),
+        ]
+
 class AddRouteView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     """View to add a new route."""
     model = Route
@@ -230,6 +384,9 @@ class EditRouteView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+    def get_queryset(self):
+        return Route.objects.all()
+
 class DeleteRouteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     """View to delete a route."""
     model = Route
@@ -239,6 +396,9 @@ class DeleteRouteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         return self.request.user.role == 'admin'
 
+    def get_queryset(self):
+        return Route.objects.all()
+
 class BusViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Bus.objects.all()
     permission_classes = [IsAuthenticated]
@@ -256,26 +416,106 @@ class BusViewSet(viewsets.ReadOnlyModelViewSet):
             return Bus.objects.filter(id__in=bus_ids).distinct()
         return Bus.objects.none()
 
+    def _search_point(self, request):
+        """(lat, lng) from ?school=<id> or ?lat=&lng=; raises ValueError with a client-facing message."""
+        params = request.query_params
+        if params.get('school'):
+            school = get_object_or_404(School.objects.only('latitude', 'longitude'), pk=params['school'])
+            return school.latitude, school.longitude
+        try:
+            lat, lng = float(params['lat']), float(params['lng'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Pass numeric lat and lng, or a school id.')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError('Latitude or longitude out of range.')
+        return lat, lng
+
+    def _search(self, request, query):
+        """Runs a spatial index query limited to the buses this user may see and renders the matches."""
+        try:
+            lat, lng = self._search_point(request)
+            max_age = request.query_params.get('max_age')
+            since = timezone.now() - timedelta(seconds=int(max_age)) if max_age else None
+            if request.user.role == 'admin' and current_school_id() is None:
+                include = None  # every bus
+            else:
+                # The index holds every school's buses, so a school's admin is limited before the k-limit too
+                include = set(self.get_queryset().values_list('id', flat=True))
+            index = spatial.get_bus_index()
+            index.refresh()
+            matches = query(index, lat, lng, include, since)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        buses = Bus.objects.only('bus_number', 'status').in_bulk([match.bus_id for match in matches])
+        return Response({
+            'latitude': lat,
+            'longitude': lng,
+            'results': [{
+                'bus_id': match.bus_id,
+                'bus_number': buses[match.bus_id].bus_number,
+                'status': buses[match.bus_id].status,
+                'latitude': match.latitude,
+                'longitude': match.longitude,
+                'timestamp': match.timestamp,
+                'distance_m': round(match.distance_m, 1),
+            } for match in matches if match.bus_id in buses],
+        })
+
+    @action(detail=False, methods=['get'])
+    def nearest(self, request):
+        """
+        The k buses nearest to a point: ?lat=&lng= or ?school=<id>, plus k (default 5,
+        at most 50), max_distance_m and max_age (seconds since the bus's last fix).
+        """
+        def query(index, lat, lng, include, since):
+            k = min(max(int(request.query_params.get('k', 5)), 1), 50)
+            max_distance = request.query_params.get('max_distance_m')
+            return index.nearest(lat, lng, k, float(max_distance) if max_distance else None, include, since)
+        return self._search(request, query)
+
+    @action(detail=False, methods=['get'])
+    def within(self, request):
+        """
+        Buses within radius_m (default 2000, at most 50000) of ?lat=&lng= or
+        ?school=<id>, nearest first; max_age as for nearest.
+        """
+        def query(index, lat, lng, include, since):
+            radius = min(float(request.query_params.get('radius_m', 2000)), 50000)
+            return index.within(lat, lng, radius, include, since)
+        return self._search(request, query)
+
 class BusTripViewSet(viewsets.ViewSet):
     """Enhanced bus trip management with location history"""
     
+    def _trip_marker(self, bus, **flags):
+        """
+        A trip start/end fix at the bus's newest known position (this worker's
+        unflushed live state first), or None if the bus has never reported one.
+        """
+        latitude, longitude, seen_at = bus.last_known_latitude, bus.last_known_longitude, bus.last_known_location_time
+        if ingest.write_behind_enabled():
+            fix = ingest.get_location_buffer().live_state.get(bus.id)
+            if fix is not None and (seen_at is None or fix.timestamp > seen_at):
+                latitude, longitude = fix.latitude, fix.longitude
+        if latitude is None or longitude is None:
+            return None
+        return ingest.make_fix(bus.id, latitude, longitude, speed=0, **flags)
+
     @action(detail=True, methods=['post'])
     def start(self, request, pk=None):
-        bus = get_object_or_404(Bus, pk=pk)
+        bus = get_object_or_404(Bus.objects, pk=pk)
         if request.user.role != 'driver' or bus.driver != request.user:
             return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
+        marker = self._trip_marker(bus, is_trip_start=True)
+        if marker is None:
+            return Response({'detail': 'The bus has no known position yet; send a location first.'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         bus.status = 'active'
         bus.save()
         
-        # Create a trip start log
-        BusLocation.objects.create(
-            bus=bus,
-            latitude=bus.last_known_latitude,
-            longitude=bus.last_known_longitude,
-            speed=0,
-            is_trip_start=True
-        )
+        # Create a trip start log (queued behind any fixes already accepted for this bus)
+        ingest.submit_fixes([marker])
         
         return Response({
             'status': f'Trip started for Bus {bus.bus_number}',
@@ -284,66 +524,191 @@ class BusTripViewSet(viewsets.ViewSet):
 
     @action(detail=True, methods=['post'])
     def stop(self, request, pk=None):
-        bus = get_object_or_404(Bus, pk=pk)
+        bus = get_object_or_404(Bus.objects, pk=pk)
         if request.user.role != 'driver' or bus.driver != request.user:
             return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
 
+        marker = self._trip_marker(bus, is_trip_end=True)
+        if marker is None:
+            return Response({'detail': 'The bus has no known position yet; send a location first.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
         bus.status = 'inactive'
         bus.save()
         
         # Create a trip end log
-        BusLocation.objects.create(
-            bus=bus,
-            latitude=bus.last_known_latitude,
-            longitude=bus.last_known_longitude,
-            speed=0,
-            is_trip_end=True
-        )
+        ingest.submit_fixes([marker])
         
         return Response({
             'status': f'Trip stopped for Bus {bus.bus_number}',
             'bus_status': bus.status
         })
 
+    def _ingest_target(self, request, pk):
+        """
+        Returns (bus_id, bus, device) for a driver posting fixes to bus pk, or None if not
+        allowed. Device-token requests are already bound to their bus, so they are checked
+        without loading the user or the bus (bus is then None); device is the token's id,
+        which the fixes' seqs count within. Other requests have no device.
+        """
+        if isinstance(request.auth, DeviceAuth):
+            if str(request.auth.bus_id) != str(pk):
+                return None
+            return request.auth.bus_id, None, request.auth.token_id
+        bus = get_object_or_404(Bus.objects, pk=pk)
+        if request.user.role != 'driver' or bus.driver_id != request.user.id:
+            return None
+        return bus.id, bus, None
+
+    def _with_bus_status(self, data, bus):
+        if bus is not None:
+            data['bus_status'] = bus.status
+        return data
+
     @action(detail=True, methods=['post'])
-    def post_location(self, request, pk=None):
-        bus = get_object_or_404(Bus, pk=pk)
-        if request.user.role != 'driver' or bus.driver != request.user:
+    def device_token(self, request, pk=None):
+        """
+        Issues a device token for the requesting driver's assigned bus. The token is
+        returned once; send it as `Authorization: Device <token>` on ingest requests.
+        """
+        bus = get_object_or_404(Bus.objects, pk=pk)
+        if request.user.role != 'driver' or bus.driver_id != request.user.id:
             return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
+        token, key = issue_device_token(request.user, bus, name=str(request.data.get('name', ''))[:100])
+        return Response({'token': key, 'token_id': token.id, 'bus': bus.id}, status=status.HTTP_201_CREATED)
 
-        latitude = request.data.get('latitude')
-        longitude = request.data.get('longitude')
-        speed = request.data.get('speed', 0)
+    @action(detail=True, methods=['post'])
+    def post_location(self, request, pk=None):
+        target = self._ingest_target(request, pk)
+        if target is None:
+            return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
+        bus_id, bus, device = target
 
-        if None in (latitude, longitude):
-            return Response(
-                {'detail': 'Latitude and longitude are required.'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        try:
+            fix = ingest.fix_from_data(bus_id, request.data, device)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Update the bus's live state and record the fix (queued when write-behind is enabled)
+        if not ingest.submit_fixes([fix]):
+            # A retry of a fix we already have; acknowledge it so the device stops resending
+            return Response(self._with_bus_status({
+                'status': 'Duplicate fix ignored',
+                'seq': fix.seq,
+            }, bus), status=status.HTTP_200_OK)
+
+        return Response(self._with_bus_status({
+            'status': 'Location updated',
+            'timestamp': fix.timestamp,
+        }, bus), status=status.HTTP_201_CREATED)
 
-        # Update bus's last known location
-        bus.last_known_latitude = latitude
-        bus.last_known_longitude = longitude
-        bus.last_known_location_time = timezone.now()
-        bus.save()
+    @action(detail=True, methods=['post'])
+    def post_locations(self, request, pk=None):
+        """
+        Batch ingest for fixes buffered on the device (dead zones, retries).
+        Body: {"fixes": [{"latitude", "longitude", "speed", "heading", "timestamp", "seq"}, ...]}
+        where timestamp is the device time (ISO 8601 or epoch ms) and seq the device's
+        fix sequence number (per device token; per bus without one). Fixes may be late
+        or out of order; retried seqs are dropped and counted as duplicates.
+        """
+        target = self._ingest_target(request, pk)
+        if target is None:
+            return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
+        bus_id, bus, device = target
+
+        items = request.data.get('fixes')
+        if not isinstance(items, list) or not items:
+            return Response({'detail': 'A non-empty "fixes" list is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_batch = ingest.ingest_settings()['MAX_BATCH']
+        if len(items) > max_batch:
+            return Response({'detail': f'At most {max_batch} fixes per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fixes = []
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('Each fix must be an object.')
+                fixes.append(ingest.fix_from_data(bus_id, item, device))
+            except ValueError as e:
+                return Response({'detail': f'Fix {index}: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        accepted = ingest.submit_fixes(fixes)
+        return Response(self._with_bus_status({
+            'status': 'Locations recorded',
+            'accepted': len(accepted),
+            'duplicates': len(fixes) - len(accepted),
+        }, bus), status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], parser_classes=[ingest.BinaryFixParser])
+    def post_locations_binary(self, request, pk=None):
+        """
+        Compact batch ingest: Content-Type application/vnd.busmonitor.fixes, body is
+        back-to-back 44-byte little-endian records <qddffq> of
+        (timestamp_ms, latitude, longitude, speed, heading, seq) - see core/ingest.py.
+        Same semantics as post_locations.
+        """
+        target = self._ingest_target(request, pk)
+        if target is None:
+            return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
+        bus_id, bus, device = target
 
-        # Create location record
-        location = BusLocation.objects.create(
-            bus=bus,
-            latitude=latitude,
-            longitude=longitude,
-            speed=speed
-        )
+        body = request.data
+        max_batch = ingest.ingest_settings()['MAX_BATCH']
+        if len(body) > max_batch * ingest.BINARY_FIX.size:
+            return Response({'detail': f'At most {max_batch} fixes per request.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fixes = ingest.fixes_from_binary(bus_id, body, device)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        accepted = ingest.submit_fixes(fixes)
         return Response({
-            'status': 'Location updated',
-            'timestamp': location.timestamp,
-            'bus_status': bus.status
+            'accepted': len(accepted),
+            'duplicates': len(fixes) - len(accepted),
         }, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['get'])
+    def ingest_status(self, request):
+        """
+        How far behind real time ingest is (admins only): this worker's fix
+        rates, device-to-server and write latency, its write-behind queue if
+        enabled, and how stale every active bus's live position is. Per-bus
+        figures cover only the admin's school when bound to one.
+        ?stale_only=1 lists only buses older than INGEST_METRICS['STALE_SECONDS'].
+        """
+        if request.user.role != 'admin':
+            return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
+        data = {'write_behind': ingest.write_behind_enabled()}
+        if data['write_behind']:
+            data.update(ingest.get_location_buffer().stats())
+
+        stale_after = ingest_metrics.ingest_metrics_settings()['STALE_SECONDS']
+        buses = [
+            {
+                'bus_id': bus_id,
+                'bus_number': bus_number,
+                'last_known_location_time': seen_at,
+                'staleness_seconds': round(seconds, 1) if seconds is not None else None,
+                'stale': seconds is None or seconds > stale_after,
+            }
+            for bus_id, bus_number, seen_at, seconds in ingest_metrics.bus_staleness(school_id=current_school_id())
+        ]
+        data['ingest'] = ingest_metrics.get_ingest_metrics().snapshot()
+        if current_school_id() is not None:
+            school_buses = set(Bus.objects.values_list('id', flat=True))
+            data['ingest']['bus_fixes_per_second'] = {
+                bus_id: rate for bus_id, rate in data['ingest']['bus_fixes_per_second'].items() if bus_id in school_buses
+            }
+        data['stale_after_seconds'] = stale_after
+        data['stale_buses'] = sum(bus['stale'] for bus in buses)
+        if request.query_params.get('stale_only') in ('1', 'true'):
+            buses = [bus for bus in buses if bus['stale']]
+        data['buses'] = buses
+        return Response(data)
+
     @action(detail=True, methods=['get'])
     def location_history(self, request, pk=None):
-        bus = get_object_or_404(Bus, pk=pk)
+        bus = get_object_or_404(Bus.objects, pk=pk)
         if request.user.role not in ['admin', 'driver'] or (
             request.user.role == 'driver' and bus.driver != request.user
         ):
@@ -382,26 +747,27 @@ class LiveBusLocationViewSet(viewsets.ReadOnlyModelViewSet):
         if user.role == 'admin':
             active_buses = Bus.objects.all()
         elif user.role == 'parent':
-            active_buses = Bus.objects.filter(route__students__parent=user).distinct()
+            active_buses = Bus.objects.filter(assigned_route__students__parent=user).distinct()
         elif user.role == 'driver':
             active_buses = Bus.objects.filter(driver=user)
 
-        # Get latest location per bus
-        latest_locations = BusLocation.objects.filter(bus=OuterRef('pk')).order_by('-timestamp')
-
-        # Update Bus model with latest known latitude, longitude, timestamp, speed, and heading
-        Bus.objects.update(
-            last_known_latitude=Subquery(latest_locations.values('latitude')[:1]),
-            last_known_longitude=Subquery(latest_locations.values('longitude')[:1]),
-            last_known_location_time=Subquery(latest_locations.values('timestamp')[:1]),
-            last_known_speed=Subquery(latest_locations.values('speed')[:1]),
-            last_known_heading=Subquery(latest_locations.values('heading')[:1])
-        )
-
-        # Remove older locations, keeping only the latest per bus
-        BusLocation.objects.exclude(id__in=latest_locations.values('id')[:1]).delete()
+        # Bus.last_known_* is kept current by ingest (core/ingest.py); fixes accepted
+        # by this worker but not yet flushed are newer than what is stored
+        if ingest.write_behind_enabled():
+            live_state = ingest.get_location_buffer().live_state
+            active_buses = list(active_buses.select_related('assigned_route'))
+            for bus in active_buses:
+                fix = live_state.get(bus.id)
+                if fix is not None and (bus.last_known_location_time is None or fix.timestamp > bus.last_known_location_time):
+                    bus.last_known_latitude = fix.latitude
+                    bus.last_known_longitude = fix.longitude
+                    bus.last_known_location_time = fix.timestamp
+                    bus.last_known_speed = fix.speed
+                    bus.last_known_heading = fix.heading
 
         # Serialize updated bus data
+        if not isinstance(active_buses, list):
+            active_buses = active_buses.select_related('assigned_route')
         serializer = BusSerializer(active_buses, many=True)
         return Response(serializer.data)
 
@@ -415,16 +781,88 @@ class RouteViewSet(viewsets.ReadOnlyModelViewSet):
 
     def retrieve(self, request, pk=None):
         """
-        Returns details for a specific route, including placeholder points.
+        Returns a route with its precomputed geometry (core/geometry.py). The
+        ETag only changes with the route's name or stops, so map clients
+        revalidate with If-None-Match and get a 304 instead of the polyline.
         """
-        route = get_object_or_404(Route, pk=pk)
-        # You would typically fetch and format route points here
-        # Example: Fetch points from route.points field (if it exists and is a JSONField)
-        # route_points = route.points if hasattr(route, 'points') else []
-        # Or if points are in a separate model:
-        # route_points = list(route.route_points.values('latitude', 'longitude')) # Assuming a related_name 'route_points'
+        route = get_object_or_404(Route.objects.only('id', 'name', 'stops'), pk=pk)
+        digest = stops_hash(route.stops)
+        etag = '"%s"' % hashlib.sha256(f'{route.id}:{route.name}:{digest}'.encode()).hexdigest()[:32]
 
-        return Response({'route_id': route.id, 'route_name': route.name, 'points': []}) # Replace [] with actual route points
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            _, geometry = route_geometry(route.stops, digest)
+            response = Response({'route_id': route.id, 'route_name': route.name, **geometry})
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+class BusDailyStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Per-bus per-day analytics, read from the BusDailyStats rollups only (see
+    core/rollups.py). Filters: ?bus=<id>, ?school=<id>, ?since=/?until=
+    (YYYY-MM-DD, default the last 30 days). Admins see every bus of their
+    school (every school if not bound to one), drivers their own and parents
+    their children's.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = BusDailyStatsSerializer
+
+    def get_queryset(self):
+        user = self.request.user
+        # BusDailyStats has no scoped manager; admins see their school's buses only
+        stats = for_school(BusDailyStats.objects.select_related('bus'), current_school_id(), 'bus__school_id')
+        if user.role == 'driver':
+            stats = stats.filter(bus__driver=user)
+        elif user.role == 'parent':
+            stats = stats.filter(bus__assigned_route__students__parent=user).distinct()
+        elif user.role != 'admin':
+            return stats.none()
+
+        params = self.request.query_params
+        try:
+            until = date.fromisoformat(params['until']) if params.get('until') else timezone.localdate()
+            since = date.fromisoformat(params['since']) if params.get('since') else until - timedelta(days=29)
+            if params.get('bus'):
+                stats = stats.filter(bus_id=int(params['bus']))
+            if params.get('school'):
+                stats = stats.filter(bus__school_id=int(params['school']))
+        except ValueError:
+            raise ParseError('since/until must be YYYY-MM-DD and bus/school numeric ids.')
+        return stats.filter(date__gte=since, date__lte=until)
+
+    @action(detail=False, methods=['get'])
+    def fleet(self, request):
+        """The same filters, summed over buses per day."""
+        days = (
+            self.get_queryset().order_by().values('date')
+            .annotate(
+                buses=Count('bus', distinct=True),
+                fixes=Sum('fixes'),
+                distance_m=Sum('distance_m'),
+                speed_sum=Sum('speed_sum'),
+                speed_count=Sum('speed_count'),
+                max_speed=Max('max_speed'),
+                trips_started=Sum('trips_started'),
+                trips_completed=Sum('trips_completed'),
+                trips_scheduled=Sum('trips_scheduled'),
+                trips_on_time=Sum('trips_on_time'),
+                first_fix_at=Min('first_fix_at'),
+                last_fix_at=Max('last_fix_at'),
+            )
+            .order_by('-date')
+        )
+        results = []
+        for day in days:
+            speed_sum, speed_count = day.pop('speed_sum'), day.pop('speed_count')
+            day['average_speed'] = speed_sum / speed_count if speed_count else None
+            day['on_time_percentage'] = (
+                100.0 * day['trips_on_time'] / day['trips_scheduled'] if day['trips_scheduled'] else None
+            )
+            results.append(day)
+        return Response(results)
 
 # --- Registration and Authentication Views ---
 class CustomLoginView(LoginView):
@@ -492,6 +930,15 @@ class CustomPasswordResetCompleteView(PasswordResetCompleteView):
     template_name = 'registration/password_reset_complete.html' # Create this template
 
 # --- Dashboard and Management Views (Admin/Driver/Parent) ---
+def school_locations():
+    """School markers for the dashboard and tracking maps: the request's school, or all of them."""
+    return [{
+        'name': school.name,
+        'lat': school.latitude,
+        'lng': school.longitude,
+        'address': school.address
+    } for school in for_school(School.objects.all(), current_school_id(), 'pk')]
+
 class DashboardView(LoginRequiredMixin, TemplateView):
     """Enhanced Dashboard with role-specific statistics
         Dashboard view displaying information based on user role.
@@ -503,16 +950,32 @@ class DashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
-        
+        # Everything below is lazy and only queried when its {% cache %} fragment misses (core/fragments.py)
+        context.update(fragment_context(user))
+
         # School locations for map
-        schools = School.objects.all()
-        context['school_locations'] = [{
-            'name': school.name,
-            'lat': school.latitude,
-            'lng': school.longitude,
-            'address': school.address
-        } for school in schools]
-        
+        context['school_locations'] = SimpleLazyObject(school_locations)
+        context['buses'] = SimpleLazyObject(lambda: self._map_buses(user))
+
+        # Role-specific statistics
+        role_statistics = {
+            'admin': self._admin_statistics,
+            'parent': self._parent_statistics,
+            'driver': self._driver_statistics,
+        }.get(user.role)
+        if role_statistics:
+            data = SimpleLazyObject(lambda: role_statistics(user))
+            for key in ('stats', 'recent_activity', 'map_buses', 'children', 'assigned_bus', 'assigned_route'):
+                context[key] = SimpleLazyObject(lambda key=key: data.get(key))
+            for key in ('recent_concerns', 'recent_notifications'):
+                context[key] = SimpleLazyObject(lambda key=key: data.get('recent_activity', {}).get(key))
+        if user.role == 'driver':
+            # The trip controls script needs the bus on every request, don't compute all driver stats for it
+            context['assigned_bus'] = SimpleLazyObject(lambda: Bus.objects.filter(driver=user).first())
+
+        return context
+
+    def _map_buses(self, user):
         # Bus data for map
         if user.role == 'admin':
             buses = Bus.objects.annotate(
@@ -534,26 +997,18 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         else:
             buses = Bus.objects.none()
             
-        context['buses'] = [{
+        return [{
             'id': bus.id,
             'bus_number': bus.bus_number,
             'status': bus.status,
             'latitude': bus.last_known_latitude,
             'longitude': bus.last_known_longitude,
             'timestamp': bus.last_known_location_time,
-            'route_name': bus.route.name if bus.route else None,
-            'route_stops': bus.route.stops if bus.route else []
-        } for bus in buses]
-        
-        # Role-specific statistics
-        if user.role == 'admin':
-            context.update(self._admin_statistics(user))
-        elif user.role == 'parent':
-            context.update(self._parent_statistics(user))
-        elif user.role == 'driver':
-            context.update(self._driver_statistics(user))
-            
-        return context    
+            'route_name': bus.assigned_route.name if hasattr(bus, 'assigned_route') else None,
+            # Clients fetch the geometry once per route from /api/routes/<id>/
+            'route_id': bus.assigned_route.id if hasattr(bus, 'assigned_route') else None,
+        } for bus in buses.select_related('assigned_route')]
+
     def _admin_statistics(self, user):
         from django.db.models import Count, Q, Subquery, OuterRef
         from datetime import datetime, timedelta
@@ -562,6 +1017,15 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         now = timezone.now()
         today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
 
+        # Bus, Route and Student are scoped to the request's school by their managers (core/tenancy.py),
+        # the rest go through their bus
+        school_id = current_school_id()
+        concerns = for_school(Concern.objects.all(), school_id, 'bus__school_id')
+        notifications = Notification.objects.all()
+        if school_id is not None:
+            notifications = notifications.filter(school_q(Notification, school_id))
+        locations = for_school(BusLocation.objects.all(), school_id, 'bus__school_id')
+
         return {
             'stats': {
                 'total_buses': Bus.objects.count(),
@@ -571,15 +1035,15 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                 'unassigned_routes': Route.objects.filter(bus__isnull=True).count(),
                 'total_students': Student.objects.count(),
                 'students_without_route': Student.objects.filter(assigned_route__isnull=True).count(),
-                'open_concerns': Concern.objects.filter(status='open').count(),
-                'today_notifications': Notification.objects.filter(
+                'open_concerns': concerns.filter(status='open').count(),
+                'today_notifications': notifications.filter(
                     timestamp__gte=today_start
                 ).count(),
             },
             'recent_activity': {
-                'recent_concerns': Concern.objects.order_by('-timestamp')[:5],
-                'recent_notifications': Notification.objects.order_by('-timestamp')[:5],
-                'bus_status_changes': BusLocation.objects.filter(
+                'recent_concerns': concerns.order_by('-timestamp')[:5],
+                'recent_notifications': notifications.order_by('-timestamp')[:5],
+                'bus_status_changes': locations.filter(
                     # Adjust this filter to use existing fields or remove it
                     # Example: Q(speed__gt=0)  # Example condition
                 ).order_by('-timestamp')[:5],
@@ -631,21 +1095,15 @@ class DashboardView(LoginRequiredMixin, TemplateView):
             assigned_bus = Bus.objects.get(driver=user)
             route = assigned_bus.assigned_route
             
-            # Get today's trip history
-            today_start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            today_locations = BusLocation.objects.filter(
-                bus=assigned_bus,
-                timestamp__gte=today_start
-            ).order_by('timestamp')
+            # Today's totals come from the daily rollup (core/rollups.py), not the location history
+            today = BusDailyStats.objects.filter(bus=assigned_bus, date=timezone.localdate()).first()
             
             return {
                 'assigned_bus': assigned_bus,
                 'assigned_route': route,
                 'stats': {
-                    'today_stops': today_locations.count(),
-                    'average_speed': today_locations.aggregate(
-                        avg_speed=Avg('speed')
-                    )['avg_speed'] or 0,
+                    'today_stops': today.fixes if today else 0,
+                    'average_speed': (today.average_speed if today else None) or 0,
                     'route_stops': len(route.stops) if route and hasattr(route, 'stops') else 0,
                     'last_update': assigned_bus.last_known_location_time,
                 },
@@ -653,11 +1111,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                     'recent_notifications': Notification.objects.filter(
                         Q(recipient_group__in=['driver', 'all'])
                     ).order_by('-timestamp')[:5],
-                    'today_trips': BusLocation.objects.filter(
-                        bus=assigned_bus,
-                        timestamp__gte=today_start,
-                        is_trip_start=True
-                    ).count(),
+                    'today_trips': today.trips_started if today else 0,
                 },
                 'map_buses': Bus.objects.filter(
                     driver=user
@@ -685,19 +1139,14 @@ class BusTrackingView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
+        context.update(fragment_context(user))
 
-        # School locations for map
-        schools = School.objects.all()
-        context['school_locations'] = [{
-            'name': school.name,
-            'lat': school.latitude,
-            'lng': school.longitude,
-            'address': school.address
-        } for school in schools]
+        # School locations for map, only queried when the cached markers fragment misses
+        context['school_locations'] = SimpleLazyObject(school_locations)
 
         # Bus data for map
         if user.role == 'admin':
-            buses = Bus.objects.all()
+            buses = Bus.objects.all()  # the admin's school only (core/tenancy.py)
         elif user.role == 'parent':
             buses = Bus.objects.filter(
                 assigned_route__students__parent=user
@@ -708,7 +1157,7 @@ class BusTrackingView(LoginRequiredMixin, TemplateView):
             buses = Bus.objects.none()
 
         context['buses'] = []
-        for bus in buses:
+        for bus in buses.select_related('assigned_route'):
             latest_location = BusLocation.objects.filter(bus=bus).order_by('-timestamp').first()
             if latest_location:
                 context['buses'].append({
@@ -718,8 +1167,8 @@ class BusTrackingView(LoginRequiredMixin, TemplateView):
                     'latitude': latest_location.latitude,
                     'longitude': latest_location.longitude,
                     'timestamp': latest_location.timestamp,
-                    'route_name': bus.route.name if bus.route else 'Unassigned',
-                    'route_stops': bus.route.stops if bus.route else []
+                    'route_name': bus.assigned_route.name if hasattr(bus, 'assigned_route') else 'Unassigned',
+                    'route_id': bus.assigned_route.id if hasattr(bus, 'assigned_route') else None,
                 })
 
         return context
@@ -0,0 +1,14 @@
+// static/js/route-geometry.js
+// Route polylines for the maps. Each route's geometry is fetched once per page from
+// /api/routes/<id>/; across page loads the browser revalidates it with the ETag (304).
+const routeGeometry = (function() {
+    const requests = new Map();
+    return function(routeId) {
+        if (!requests.has(routeId)) {
+            requests.set(routeId, fetch(`/api/routes/${routeId}/`, { credentials: 'same-origin' })
+                .then(response => response.ok ? response.json() : null)
+                .catch(() => null));
+        }
+        return requests.get(routeId);
+    };
+})();
@@ -0,0 +1,40 @@
+// static/js/server-datatable.js
+// Turns every <table data-source="..."> into a server-side DataTable (see core/datatables.py).
+// Each response carries a keyset cursor for the next page; it is sent back when the user
+// pages forward so the server can seek instead of using OFFSET.
+(function($) {
+  'use strict';
+  $(function() {
+    $('table[data-source]').each(function() {
+      var table = $(this);
+      var nextCursor = null;
+      var nextStart = null;
+
+      table.DataTable({
+        serverSide: true,
+        processing: true,
+        searchDelay: 400,
+        pageLength: 25,
+        aLengthMenu: [[10, 25, 50, 100], [10, 25, 50, 100]],
+        columnDefs: [{ targets: 'no-sort', orderable: false, searchable: false }],
+        ajax: {
+          url: table.data('source'),
+          data: function(params) {
+            if (nextCursor && params.start === nextStart) {
+              params.cursor = nextCursor;
+            }
+          },
+          dataSrc: function(json) {
+            nextCursor = json.next_cursor || null;
+            nextStart = json.next_start;
+            return json.data;
+          }
+        },
+        language: { search: '' }
+      });
+
+      var searchInput = table.closest('.dataTables_wrapper').find('div[id$=_filter] input');
+      searchInput.attr('placeholder', 'Search');
+    });
+  });
+})(jQuery);